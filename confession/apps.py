@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ConfessionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'confession'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,208 @@
+import math
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery, Count, Q
+from django.db.models.functions import Coalesce
+from taggit.models import Tag
+
+from . import models, feed, trending
+
+
+_state = threading.local()
+
+
+def is_deferred():
+    return getattr(_state, 'deferred', False)
+
+
+@contextmanager
+def deferred(confession_ids):
+    """
+    Skips the per-row counter and reaction summary updates of confession.signals for bulk changes, recounting the given
+    confessions with a few set-based queries at the end instead
+    """
+    _state.deferred = True
+    try:
+        yield
+    finally:
+        _state.deferred = False
+    confessions = models.Confession.objects.filter(pk__in=confession_ids)
+    recount(confessions)
+    rebuild_reaction_summaries(confessions)
+
+
+def increment(confession_id, field, delta):
+    if confession_id is None:
+        return
+    queryset = models.Confession.objects.filter(pk=confession_id)
+    if delta < 0:
+        queryset = queryset.filter(**{field + '__gte': -delta})
+    if not queryset.update(**{field: F(field) + delta}):
+        return
+    # The update keeps the row locked until the commit, so these are the values it made, and the previous ones are known
+    values = models.Confession.objects.filter(pk=confession_id).values(*feed.KEY_FIELDS, 'is_approved').get()
+    previous = {**values, field: values[field] - delta}
+    values['trending_score'] = trending.score(values['created'], values['reaction_count'], values['comment_count'])
+    models.Confession.objects.filter(pk=confession_id).update(trending_score=values['trending_score'])
+    if values['is_approved']:
+        feed.invalidate([values, previous])
+
+
+def _count_subquery(model):
+    return Coalesce(Subquery(
+        model.objects.filter(confession=OuterRef('pk')).order_by().values('confession')
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def recount(queryset=None):
+    """
+    Recomputes the stored comment/reaction counters of the given confessions (all by default) and returns how many of
+    them had drifted
+    """
+    if queryset is None:
+        queryset = models.Confession.objects.all()
+    drifted = queryset.annotate(actual_comment_count=_count_subquery(models.Comment),
+                                actual_reaction_count=_count_subquery(models.Reaction))\
+        .filter(~Q(comment_count=F('actual_comment_count')) | ~Q(reaction_count=F('actual_reaction_count')))
+    updated = models.Confession.objects.filter(pk__in=drifted.values('pk'))\
+        .update(comment_count=_count_subquery(models.Comment), reaction_count=_count_subquery(models.Reaction))
+    if updated:
+        # The previous counts are unknown
+        feed.invalidate_all()
+        rescore(queryset)
+    return updated
+
+
+def rescore(queryset=None, batch_size=1000):
+    """
+    Recomputes the stored trending scores of the given confessions (all by default) and returns how many of them had
+    drifted, e.g. after counters were repaired or the TRENDING_* settings changed
+    """
+    if queryset is None:
+        queryset = models.Confession.objects.all()
+    drifted, keys = [], []
+    for values in queryset.values(*feed.KEY_FIELDS).iterator():
+        score = trending.score(values['created'], values['reaction_count'], values['comment_count'])
+        # Far below the effect of a single reaction, but above the difference made by auto_now_add setting `created`
+        # a little after Confession.save() scored it
+        if not math.isclose(score, values['trending_score'], rel_tol=0, abs_tol=1e-6):
+            drifted.append(models.Confession(pk=values['pk'], trending_score=score))
+            keys += [values, {**values, 'trending_score': score}]
+    models.Confession.objects.bulk_update(drifted, ('trending_score',), batch_size=batch_size)
+    feed.invalidate(keys)
+    return len(drifted)
+
+
+def adjust_reaction_summary(reaction, delta):
+    target = {'confession_id': reaction.confession_id} if reaction.confession_id else {'comment_id': reaction.comment_id}
+    if target == {'comment_id': None}:
+        return
+    summaries = models.ReactionSummary.objects.filter(emoji=reaction.emoji, **target)
+    if delta < 0:
+        summaries.filter(count__lte=-delta).delete()
+        summaries.update(count=F('count') + delta)
+    elif not summaries.update(count=F('count') + delta):
+        try:
+            with transaction.atomic():
+                models.ReactionSummary.objects.create(emoji=reaction.emoji, count=delta, **target)
+        except IntegrityError:
+            # Created concurrently
+            summaries.update(count=F('count') + delta)
+
+
+def rebuild_reaction_summaries(confessions):
+    """
+    Rebuilds the reaction summaries of the given confessions and of their comments
+    """
+    comments = models.Comment.objects.filter(confession__in=confessions)
+    models.ReactionSummary.objects.filter(Q(confession__in=confessions) | Q(comment__in=comments)).delete()
+    reactions = models.Reaction.objects.filter(Q(confession__in=confessions) | Q(comment__in=comments)).order_by()
+    models.ReactionSummary.objects.bulk_create([
+        models.ReactionSummary(**summary) for summary in
+        reactions.values('confession_id', 'comment_id', 'emoji').annotate(count=Count('pk'))
+    ])
+
+
+def _add_counts(queryset, field, counts, sign):
+    # One update per distinct change, usually a single one
+    by_change = defaultdict(list)
+    for pk, count in counts.items():
+        by_change[count * sign].append(pk)
+    for change, pks in by_change.items():
+        rows = queryset.filter(pk__in=pks)
+        if change < 0:
+            rows = rows.filter(**{field + '__gte': -change})
+        rows.update(**{field: F(field) + change})
+
+
+def adjust_tag_counts(tag_ids, sign):
+    """
+    Adds (or, with a negative sign, subtracts) the occurrences of each tag among `tag_ids` to its approved confession
+    count
+    """
+    counts = Counter(tag_ids)
+    if not counts:
+        return
+    if sign > 0:
+        missing = set(counts) - set(models.TagCount.objects.filter(tag__in=counts).values_list('tag', flat=True))
+        if missing:
+            models.TagCount.objects.bulk_create([
+                models.TagCount(tag_id=pk, name=name, key=name.lower())
+                for pk, name in Tag.objects.filter(pk__in=missing).values_list('pk', 'name')
+            ], ignore_conflicts=True)
+    _add_counts(models.TagCount.objects.all(), 'count', counts, sign)
+
+
+def adjust_category_counts(category_ids, sign):
+    counts = Counter(category_ids)
+    if counts:
+        _add_counts(models.Category.objects.all(), 'confession_count', counts, sign)
+
+
+def _tagged_items(confession_ids):
+    return models.Confession.tags.through.objects.filter(
+        content_type=ContentType.objects.get_for_model(models.Confession), object_id__in=confession_ids)
+
+
+def adjust_term_counts(confession_ids, sign):
+    """
+    Counts the given confessions in (or, with a negative sign, out of) the approved confession counts of their tags and
+    categories, e.g. when they get approved or deleted
+    """
+    confession_ids = list(confession_ids)
+    if confession_ids:
+        adjust_tag_counts(_tagged_items(confession_ids).values_list('tag_id', flat=True), sign)
+        adjust_category_counts(models.Confession.categories.through.objects.filter(confession__in=confession_ids)
+                               .values_list('category_id', flat=True), sign)
+
+
+def recount_terms():
+    """
+    Recomputes the approved confession counts of all tags and categories and returns how many of them had drifted
+    """
+    approved = models.Confession.objects.filter(is_approved=True).values('pk')
+    tag_counts = dict(_tagged_items(approved).order_by().values('tag').annotate(count=Count('pk')).values_list('tag', 'count'))
+    category_counts = dict(models.Confession.categories.through.objects.filter(confession__in=approved).order_by()
+                           .values('category').annotate(count=Count('pk')).values_list('category', 'count'))
+    rows = {row.tag_id: row for row in models.TagCount.objects.all()}
+    created, drifted = [], []
+    for pk, name in Tag.objects.values_list('pk', 'name'):
+        count = tag_counts.get(pk, 0)
+        if pk not in rows:
+            created.append(models.TagCount(tag_id=pk, name=name, key=name.lower(), count=count))
+        elif rows[pk].count != count or rows[pk].name != name:
+            rows[pk].count, rows[pk].name, rows[pk].key = count, name, name.lower()
+            drifted.append(rows[pk])
+    models.TagCount.objects.bulk_create(created, batch_size=1000, ignore_conflicts=True)
+    models.TagCount.objects.bulk_update(drifted, ('count', 'name', 'key'), batch_size=1000)
+    categories = [category for category in models.Category.objects.all()
+                  if category.confession_count != category_counts.get(category.pk, 0)]
+    for category in categories:
+        category.confession_count = category_counts.get(category.pk, 0)
+    models.Category.objects.bulk_update(categories, ('confession_count',), batch_size=1000)
+    return len([row for row in created if row.count]) + len(drifted) + len(categories)
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from djangoProject.db_router import primary_reads
+
+from . import models
+from .filters import SORT_ORDERINGS
+
+FEED_CACHE_ALIAS = 'feed'
+DEFAULT_SORT = 'newest'
+CACHEABLE_PARAMS = {'sort_by', 'page'}
+# Fields the feed sort orders are made of, whose values place a confession in each of them
+KEY_FIELDS = ('pk', 'created', 'reaction_count', 'comment_count', 'trending_score')
+# Boundary of a region which holds every approved confession
+ALL = '*'
+LOCK_TIMEOUT = 5
+LOCK_POLL_INTERVAL = 0.05
+# Accepted media types for which the feed is rendered as JSON
+JSON_MEDIA_TYPES = {'*/*', 'application/*', 'application/json'}
+
+
+def _cache():
+    return caches[FEED_CACHE_ALIAS]
+
+
+def _pages():
+    return getattr(settings, 'FEED_CACHE_PAGES', 3)
+
+
+def _timeout():
+    return getattr(settings, 'FEED_CACHE_TIMEOUT', 60)
+
+
+def _version_key(sort):
+    return 'feed:version:%s' % sort
+
+
+def _boundary_key(sort, version):
+    return 'feed:boundary:%s:%d' % (sort, version)
+
+
+def _page_key(sort, version, page, host):
+    return 'feed:page:%s:%d:%s:%s' % (sort, version, page or 'first', host)
+
+
+def _key(values, ordering):
+    return tuple(values[field.lstrip('-')] for field in ordering)
+
+
+def _ranks_within(key, boundary, ordering):
+    if boundary == ALL:
+        return True
+    for value, limit, field in zip(key, boundary, ordering):
+        if value != limit:
+            return value > limit if field.startswith('-') else value < limit
+    return True
+
+
+def get_cache_params(request):
+    """
+    Returns the sort order and page (None for the first keyset page) of a cacheable feed request, which is an anonymous
+    read of one of the first FEED_CACHE_PAGES pages of a sort order without any other filters, or None
+    """
+    if request.user.is_authenticated or request.method not in ('GET', 'HEAD') or not _pages():
+        return None
+    # The query parameters of both Django's and DRF's requests
+    params = request.GET
+    if set(params) - CACHEABLE_PARAMS or any(len(params.getlist(param)) > 1 for param in params):
+        return None
+    sort = params.get('sort_by') or DEFAULT_SORT
+    if sort not in SORT_ORDERINGS:
+        return None
+    page = params.get('page')
+    if page is not None:
+        if not page.isdigit() or not 1 <= int(page) <= _pages():
+            return None
+        page = int(page)
+    return sort, page
+
+
+def get_versions(sorts=tuple(SORT_ORDERINGS)):
+    cache = _cache()
+    keys = {sort: _version_key(sort) for sort in sorts}
+    versions = cache.get_many(keys.values())
+    for key in keys.values():
+        if key not in versions:
+            # Started from the clock, so that an evicted version doesn't lead back to the pages cached under it
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return {sort: versions[key] for sort, key in keys.items()}
+
+
+def compute_boundary(sort):
+    """
+    Sort key of the last confession of the cached region of the sort order, which spans the first FEED_CACHE_PAGES pages
+    """
+    ordering = SORT_ORDERINGS[sort]
+    size = _pages() * api_settings.PAGE_SIZE
+    rows = list(models.Confession.objects.filter(is_approved=True).order_by(*ordering).values(*KEY_FIELDS)[size - 1:size])
+    return _key(rows[0], ordering) if rows else ALL
+
+
+def _render(data):
+    content = JSONRenderer().render(data)
+    return {'data': json.loads(content), 'content': content, 'etag': '"%s"' % hashlib.md5(content).hexdigest(),
+            'last_modified': int(time.time())}
+
+
+def conditional_response(request, entry, response):
+    """
+    The response of a cached feed page, or a 304 when the client's copy of it is still current
+    """
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    # Revalidated on every use, which the conditional request makes cheap
+    response['Cache-Control'] = 'no-cache'
+    return get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'], response=response)
+
+
+def get_page(request, sort, page, build):
+    """
+    Returns the cached entry (data, etag and last_modified) of the feed page, building its data with `build` on a miss.
+    Only one worker rebuilds a missing page, while the others wait for its result instead of querying the database too.
+    The cached data is read from the primary, as a page built from a lagging replica would outlast the invalidation.
+    """
+    cache = _cache()
+    version = get_versions((sort,))[sort]
+    key = _page_key(sort, version, page, request.get_host())
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    lock_key = key + ':lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            with primary_reads():
+                # Stored before the page and kept for longer, so that no cached page misses an invalidation
+                boundary_key = _boundary_key(sort, version)
+                if cache.get(boundary_key) is None:
+                    cache.set(boundary_key, compute_boundary(sort), _timeout() * 2)
+                entry = _render(build())
+            cache.set(key, entry, _timeout())
+            return entry
+        finally:
+            cache.delete(lock_key)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            # The rebuild failed
+            break
+    return _render(build())
+
+
+def _get_cached_entry(sort, page, host):
+    cache = _cache()
+    version = cache.get(_version_key(sort))
+    return None if version is None else cache.get(_page_key(sort, version, page, host))
+
+
+async def get_cached_response(request, *args, **kwargs):
+    """
+    Fast path of the async feed view (see djangoProject.async_views), answering a cacheable request for a cached page
+    with the rendered JSON, or None. A request without a session cookie is known to be anonymous without loading its
+    user, so only the cache reads leave the event loop.
+    """
+    if args or kwargs or request.session.session_key is not None:
+        return None
+    accepted = {media_type.split(';')[0].strip() for media_type in request.META.get('HTTP_ACCEPT', '*/*').split(',')}
+    params = get_cache_params(request) if accepted <= JSON_MEDIA_TYPES else None
+    if params is None:
+        return None
+    # Not tied to the thread of the request, as the cache backends don't use the database connections
+    entry = await sync_to_async(_get_cached_entry, thread_sensitive=False)(*params, request.get_host())
+    # Entries cached by an older release don't have the content
+    if entry is None or 'content' not in entry:
+        return None
+    response = HttpResponse(entry['content'], content_type='application/json')
+    patch_vary_headers(response, ('Accept',))
+    return conditional_response(request, entry, response)
+
+
+def _bump(sort):
+    try:
+        _cache().incr(_version_key(sort))
+    except ValueError:
+        # Evicted, the next version starts anew
+        pass
+
+
+def _invalidate(keys):
+    cache = _cache()
+    versions = get_versions()
+    boundary_keys = {sort: _boundary_key(sort, version) for sort, version in versions.items()}
+    boundaries = cache.get_many(boundary_keys.values())
+    for sort, ordering in SORT_ORDERINGS.items():
+        boundary = boundaries.get(boundary_keys[sort])
+        # A missing boundary was either never stored, or evicted before the pages
+        if boundary is None or any(_ranks_within(_key(values, ordering), boundary, ordering) for values in keys):
+            _bump(sort)
+
+
+def invalidate(keys):
+    """
+    Invalidates, once the transaction commits, the cached pages of the sort orders in whose cached region any of the
+    given sort keys (dicts of KEY_FIELDS values, current or previous ones of changed confessions) ranks. Changes
+    further down a sort order can't move the confessions of its cached region, so they keep it.
+    """
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: _invalidate(keys))
+
+
+def invalidate_all():
+    transaction.on_commit(lambda: [_bump(sort) for sort in SORT_ORDERINGS])
+
+
+def confession_changed(instance):
+    invalidate([{field: getattr(instance, field) for field in KEY_FIELDS}])
+
+
+def confessions_changed(pks):
+    invalidate(models.Confession.objects.filter(pk__in=pks).values(*KEY_FIELDS))
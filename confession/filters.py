@@ -1,31 +1,68 @@
-from django_filters import OrderingFilter, FilterSet
-from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
+from django_filters import OrderingFilter, FilterSet, IsoDateTimeFilter, NumberFilter
+from rest_framework.filters import SearchFilter
+
+from . import search
+
+
+SORT_ORDERINGS = {
+    'newest': ('-pk',),
+    'popularity': ('-reaction_count', '-comment_count', '-pk'),
+    'most_reactions': ('-reaction_count', '-pk'),
+    'most_comments': ('-comment_count', '-pk'),
+    'oldest': ('created', 'pk'),
+    'trending': ('-trending_score', '-pk'),
+}
 
 
 class ConfessionOrderingFilter(OrderingFilter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.extra['choices'] += (
+            ('newest', "Newest"),
             ('popularity', "Popularity"),
             ('most_reactions', "Most reactions"),
             ('most_comments', "Most comments"),
             ('oldest', "Oldest"),
+            ('trending', "Trending"),
         )
 
     def filter(self, qs, value):
         if value:
             for v in value:
-                if v == 'popularity':
-                    return qs.order_by(Coalesce('reaction_count', 'comment_count').desc())
-                if v == 'most_reactions':
-                    return qs.order_by('-reaction_count')
-                if v == 'most_comments':
-                    return qs.order_by('-comment_count')
-                if v == 'oldest':
-                    return qs.order_by('created')
+                if v in SORT_ORDERINGS:
+                    return qs.order_by(*SORT_ORDERINGS[v])
         return super().filter(qs, value)
 
 
 class ConfessionFilter(FilterSet):
     sort_by = ConfessionOrderingFilter()
 
+
+class CommentPollFilter(FilterSet):
+    confession = NumberFilter(required=True)
+    since = IsoDateTimeFilter(field_name='created', lookup_expr='gt', required=True)
+
+
+class ConfessionSearchFilter(SearchFilter):
+    """
+    Searches through the full-text index of confessions (see confession.search), falling back to the `search_fields`
+    lookups on databases without one. Unless another sort is requested, results are ordered by relevance, which is
+    limited to the `ranked_result_limit` best matches among the confessions of the queryset, as ranking has to go
+    through all of them on every page. Requesting another sort lifts the limit.
+    """
+    ranked_result_limit = 1000
+    search_description = ("Full-text search terms. Results are ordered by relevance, and limited to the %d best matches "
+                          "unless `sort_by` is given." % ranked_result_limit)
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        backend = search.get_backend(queryset.db)
+        if not query or backend is None:
+            return super().filter_queryset(request, queryset, view)
+        if request.query_params.get('sort_by'):
+            return queryset.filter(pk__in=RawSQL(*backend.match_sql(query)))
+        pks = backend.search(query, self.ranked_result_limit, queryset)
+        if not pks:
+            return queryset.none()
+        return queryset.filter(pk__in=pks).annotate(search_rank=backend.rank_expression(pks)).order_by('search_rank', '-pk')
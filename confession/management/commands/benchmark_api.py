@@ -0,0 +1,148 @@
+import json
+import random
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework.settings import api_settings
+
+from confession import models
+from djangoProject.benchmark import measure, format_summary
+from member.models import User
+from moderation.models import Conversation, Report
+
+FLOWS = ('feed', 'search', 'comment', 'reaction', 'inbox', 'vote')
+SORTS = ('newest', 'popularity', 'most_reactions', 'most_comments', 'oldest', 'trending')
+SEARCH_QUERIES = ('love', 'secret friend', 'boss office mistake')
+EMOJIS = ('\U0001F600', '\U0001F602', '\U0001F622', '\U0001F621', '\U0001F44D', '\U0001F631', '❤')
+COMPARED = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+class Command(BaseCommand):
+    help = ("Runs the main API flows through the test client against the current database (e.g. filled by generate_data), "
+            "reports their throughput and latency percentiles, and saves or compares JSON baselines. Writes are rolled "
+            "back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=FLOWS, help="Flows to run, all by default.")
+        parser.add_argument('--iterations', '-i', type=int, default=50, help="Number of timed requests of each benchmark.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', help="File to save the results to as a baseline.")
+        parser.add_argument('--compare', help="Baseline file to compare the results with.")
+        parser.add_argument('--threshold', type=float, default=10,
+                            help="Percentage by which a latency percentile may grow before it's reported as a regression.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.iterations = options['iterations']
+        self.confession_ids = list(models.Confession.objects.filter(is_approved=True).values_list('pk', flat=True))
+        if not self.confession_ids:
+            raise CommandError("There are no approved confessions, fill the database with generate_data first.")
+        self.approved_count = len(self.confession_ids)
+        self.random.shuffle(self.confession_ids)
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver'], DRF_RECAPTCHA_TESTING=True), transaction.atomic():
+            for flow in options['flows']:
+                for name, function, setup in getattr(self, 'get_%s_benchmarks' % flow)():
+                    results[name] = measure(function, self.iterations, setup=setup)
+                    self.stdout.write(format_summary(name, results[name]))
+            transaction.set_rollback(True)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f)['results'], results, options['threshold'])
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({'database': connection.vendor, 'iterations': self.iterations, 'seed': options['seed'],
+                           'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS("Saved the baseline to %s" % options['save']))
+
+    @staticmethod
+    def request(client, method, path, data=None, expected_status=200):
+        response = getattr(client, method)(path, data, content_type='application/json') if method == 'post' else client.get(path, data)
+        if response.status_code != expected_status:
+            raise CommandError("%s %s answered %d: %s" % (method.upper(), path, response.status_code, response.content[:500]))
+        return response
+
+    def next_confession_id(self):
+        return self.confession_ids.pop() if len(self.confession_ids) > 1 else self.confession_ids[0]
+
+    def logged_in_client(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def get_feed_benchmarks(self):
+        client = Client()
+        for sort in SORTS:
+            yield 'feed sort_by=%s' % sort, lambda sort=sort: self.request(client, 'get', '/confession/entry/', {'sort_by': sort}), None
+        # Halfway through the feed
+        page = max(1, self.approved_count // api_settings.PAGE_SIZE // 2)
+        yield 'feed deep page', lambda: self.request(client, 'get', '/confession/entry/', {'page': page}), None
+
+    def get_search_benchmarks(self):
+        client = Client()
+        for query in SEARCH_QUERIES:
+            yield 'search %r' % query, lambda query=query: self.request(client, 'get', '/confession/entry/', {'search': query}), None
+
+    def get_comment_benchmarks(self):
+        client = self.logged_in_client(User.objects.filter(role=None).first() or User.objects.create())
+
+        def setup():
+            caches['ratelimit'].clear()
+            return self.next_confession_id()
+        yield 'comment create', lambda confession_id: self.request(client, 'post', '/confession/comment/', {
+            'confession': confession_id, 'text': "Benchmark comment", 'recaptcha': 'benchmark'}, 201), setup
+        yield 'comment list', lambda confession_id: self.request(client, 'get', '/confession/comment/', {'confession': confession_id}), \
+            self.next_confession_id
+
+    def get_reaction_benchmarks(self):
+        client = self.logged_in_client(User.objects.filter(role=None).last() or User.objects.create())
+
+        def setup():
+            caches['ratelimit'].clear()
+            return self.next_confession_id()
+        yield 'reaction create', lambda confession_id: self.request(client, 'post', '/confession/reaction/', {
+            'confession': confession_id, 'emoji': self.random.choice(EMOJIS), 'recaptcha': 'benchmark'}, 201), setup
+        yield 'reaction list', lambda confession_id: self.request(client, 'get', '/confession/reaction/', {'confession': confession_id}), \
+            self.next_confession_id
+
+    def get_inbox_benchmarks(self):
+        conversation = Conversation.objects.order_by('-message_count').select_related('user', 'other').first()
+        if conversation is None:
+            return
+        client = self.logged_in_client(conversation.user)
+        yield 'inbox list', lambda: self.request(client, 'get', '/moderation/message/'), None
+        yield 'inbox thread', lambda: self.request(client, 'get', '/moderation/message/%s/' % conversation.other.handle), None
+
+    def get_vote_benchmarks(self):
+        moderator = User.objects.filter(role='moderator').first()
+        if moderator is None:
+            return
+        client = self.logged_in_client(moderator)
+        report_ids = list(Report.objects.filter(vote_count__lt=2).exclude(voters=moderator).values_list('pk', flat=True))
+        if len(report_ids) < self.iterations + 1:
+            self.stdout.write(self.style.WARNING("Not enough reports to vote on, skipping"))
+            return
+        yield 'report vote', lambda report_id: self.request(client, 'post', '/moderation/report/%d/vote/' % report_id), report_ids.pop
+
+    def compare(self, baseline, results, threshold):
+        self.stdout.write(self.style.MIGRATE_HEADING("Compared with the baseline:"))
+        for name, summary in results.items():
+            if name not in baseline:
+                self.stdout.write("%s: not in the baseline" % name)
+                continue
+            changes = []
+            regressed = False
+            for key in COMPARED:
+                old, new = baseline[name][key], summary[key]
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                # Higher throughput, but lower latency is better
+                regressed |= change < -threshold if key == 'throughput' else change > threshold
+                changes.append('%s %.2f -> %.2f (%+.0f%%)' % (key, old, new, change))
+            line = '%s: %s' % (name, ', '.join(changes))
+            self.stdout.write(self.style.ERROR(line + ' REGRESSION') if regressed else line)
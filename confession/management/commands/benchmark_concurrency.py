@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+
+from confession import models, urls
+from djangoProject.async_views import async_routes
+from djangoProject.benchmark import summarize, format_summary
+
+MODES = ('wsgi', 'asgi', 'asgi-async-views')
+ENDPOINTS = ('feed', 'confession', 'comments', 'summary')
+
+
+def urlconf(confession_patterns):
+    return type('URLConf', (), {'urlpatterns': [path('confession/', include(confession_patterns))]})
+
+
+class Command(BaseCommand):
+    help = ("Compares the requests per second and latency percentiles of the read endpoints under many concurrent "
+            "anonymous clients: WSGI with a thread per client, ASGI with the synchronous views, and ASGI with the async "
+            "views of ASYNC_READ_VIEWS. Requests go through the full middleware chain in this process, without a server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+        parser.add_argument('--concurrency', '-c', type=int, default=50, help="Number of concurrent clients.")
+        parser.add_argument('--requests', '-n', type=int, default=1000, help="Number of requests per endpoint and mode.")
+
+    def handle(self, *args, **options):
+        confession_id = models.Confession.objects.filter(is_approved=True).values_list('pk', flat=True).last()
+        if confession_id is None:
+            raise CommandError("There are no approved confessions, fill the database with generate_data first.")
+        paths = {
+            'feed': '/confession/entry/',
+            'confession': '/confession/entry/%d/' % confession_id,
+            'comments': '/confession/comment/?confession=%d' % confession_id,
+            'summary': '/confession/reaction/summary/?confessions=%d' % confession_id,
+        }
+        urlconfs = {
+            'wsgi': urlconf(urls.sync_urlpatterns),
+            'asgi': urlconf(urls.sync_urlpatterns),
+            'asgi-async-views': urlconf(async_routes(urls.sync_urlpatterns, urls.ASYNC_ROUTES)),
+        }
+        for endpoint in options['endpoints']:
+            for mode in options['modes']:
+                with override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF=urlconfs[mode]):
+                    run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+                    durations, total_time = run(paths[endpoint], options['concurrency'], options['requests'])
+                self.stdout.write(format_summary('%s, %s' % (endpoint, mode), summarize(durations, total_time)))
+
+    @staticmethod
+    def check_response(response, path):
+        if response.status_code != 200:
+            raise CommandError("GET %s answered %d: %s" % (path, response.status_code, response.content[:500]))
+
+    def run_wsgi(self, path, concurrency, request_count):
+        local = threading.local()
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.get(path)
+            duration = time.perf_counter() - started
+            self.check_response(response, path)
+            return duration
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            # Warms up the caches and the connections of the threads
+            list(executor.map(request, range(concurrency)))
+            started = time.perf_counter()
+            durations = list(executor.map(request, range(request_count)))
+        return durations, time.perf_counter() - started
+
+    def run_asgi(self, path, concurrency, request_count):
+        async def client_loop(count, durations):
+            client = AsyncClient()
+            for _ in range(count):
+                # A context per request, as the ASGI handler makes, so that requests don't share the sync thread
+                async with ThreadSensitiveContext():
+                    started = time.perf_counter()
+                    response = await client.get(path)
+                    durations.append(time.perf_counter() - started)
+                self.check_response(response, path)
+
+        async def run():
+            await asyncio.gather(*[client_loop(1, []) for _ in range(concurrency)])
+            durations = []
+            started = time.perf_counter()
+            await asyncio.gather(*[client_loop(request_count // concurrency + (i < request_count % concurrency), durations)
+                                   for i in range(concurrency)])
+            return durations, time.perf_counter() - started
+        return asyncio.run(run())
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from confession import models, filters
+from confession.views import ConfessionViewSet
+from djangoProject.benchmark import measure, format_summary
+
+
+class Command(BaseCommand):
+    help = "Compares the full-text search index with the LIKE based SearchFilter on the current database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='+', help="Search queries to run.")
+        parser.add_argument('--iterations', '-i', type=int, default=20, help="Number of timed runs of each query.")
+        parser.add_argument('--page_size', '-p', type=int, default=10, help="Number of results fetched per run.")
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = ConfessionViewSet()
+        queryset = models.Confession.objects.filter(is_approved=True)
+        for query in options['queries']:
+            request = Request(factory.get('/confession/entry/', {'search': query}))
+            for name, backend in (('LIKE', SearchFilter()), ('full-text', filters.ConfessionSearchFilter())):
+                def run():
+                    return list(backend.filter_queryset(request, queryset, view)[:options['page_size']])
+                summary = measure(run, options['iterations'])
+                self.stdout.write(format_summary('%r, %s (%d results)' % (query, name, len(run())), summary))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from confession import models, views
+from djangoProject.benchmark import measure
+from djangoProject.row_serializer import ROLES, role_user
+
+VIEWS = {'confession': views.ConfessionViewSet, 'comment': views.CommentViewSet, 'reaction': views.ReactionViewSet}
+
+
+class Command(BaseCommand):
+    help = ("Compares the rows per second of the list serializers with the RowSerializer of their views on the current "
+            "database, fetching included")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=VIEWS, default=list(VIEWS), help="Views to measure, all by default.")
+        parser.add_argument('--roles', nargs='+', choices=ROLES, default=['anonymous', 'admin'])
+        parser.add_argument('--rows', '-r', type=int, default=100, help="Number of rows serialized per run.")
+        parser.add_argument('--iterations', '-i', type=int, default=20, help="Number of timed runs of each benchmark.")
+
+    def handle(self, *args, **options):
+        if not models.Confession.objects.exists():
+            raise CommandError("There are no confessions, fill the database with generate_data first.")
+        factory = APIRequestFactory()
+        for name in options['views']:
+            view = VIEWS[name]
+            queryset = view.queryset.order_by('-pk')[:options['rows']]
+            row_count = queryset.count()
+            for role in options['roles']:
+                request = factory.get('/')
+                request.user = role_user(role)
+                context = {'request': request}
+                results = {
+                    'serializer': measure(lambda: view.serializer_class(queryset.all(), many=True, context=context).data,
+                                          options['iterations']),
+                    'rows': measure(lambda: view.row_serializer.to_representation(
+                        view.row_serializer.values(queryset.all(), role), role), options['iterations']),
+                }
+                line = ', '.join('%s %.0f rows/s (p50 %.2f ms)' % (path, row_count * summary['throughput'], summary['p50_ms'])
+                                 for path, summary in results.items())
+                self.stdout.write('%s as %s (%d rows): %s, %.1fx' % (
+                    name, role, row_count, line, results['rows']['throughput'] / results['serializer']['throughput']))
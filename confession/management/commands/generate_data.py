@@ -0,0 +1,212 @@
+import itertools
+import random
+from contextlib import contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+
+from confession import models, counters, search
+from member.models import User, Session
+from moderation.models import Report, Message
+
+WORDS = (
+    'love', 'work', 'school', 'friend', 'family', 'secret', 'money', 'dream', 'night', 'party', 'crush', 'exam', 'boss',
+    'sister', 'brother', 'mother', 'father', 'city', 'summer', 'winter', 'phone', 'coffee', 'music', 'game', 'dog', 'cat',
+    'lie', 'truth', 'guilt', 'fear', 'hope', 'trip', 'car', 'house', 'neighbor', 'teacher', 'wedding', 'birthday', 'gift',
+    'letter', 'mistake', 'apology', 'promise', 'habit', 'diet', 'gym', 'sleep', 'movie', 'book', 'song', 'online', 'date',
+    'breakup', 'roommate', 'office', 'holiday', 'kitchen', 'garden', 'beach', 'train', 'concert', 'stranger', 'wallet',
+)
+EMOJIS = ('\U0001F600', '\U0001F602', '\U0001F622', '\U0001F621', '\U0001F44D', '\U0001F631', '❤')
+REASONS = ("Offensive content here", "Spam and advertising", "Reveals personal information", "Harassment of someone")
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Lets bulk_create() keep the given timestamps instead of overwriting them with the current time
+    """
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Fills the database with a synthetic dataset for benchmarks, the same one for the same seed on an empty database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Number of users, each with a session.")
+        parser.add_argument('--anonymous_sessions', type=int, default=1000, help="Number of additional sessions without a user.")
+        parser.add_argument('--moderators', type=int, default=10, help="Number of the users who are moderators.")
+        parser.add_argument('--confessions', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--reactions', type=int, default=50000)
+        parser.add_argument('--reports', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=200, help="Size of the tag vocabulary.")
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="Zipf exponent of the popularity of confessions, 0 spreads comments and reactions evenly.")
+        parser.add_argument('--days', type=int, default=90, help="Timestamps are spread over this many past days.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch_size', '-b', type=int, default=1000, help="Number of rows inserted per query.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # Default values of the models (handles, passwords) come from the global generator
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+
+        with transaction.atomic():
+            users, sessions = self.create_users(options)
+            confessions = self.create_confessions(users, options)
+            comments = self.create_comments(confessions, sessions, options)
+            self.create_reactions(confessions, comments, sessions, options)
+            self.create_reports(confessions, sessions, users[:options['moderators']], options)
+            self.create_messages(users, options)
+
+            self.stdout.write("Updating counters and summaries...")
+            confession_queryset = models.Confession.objects.filter(pk__in=[confession.pk for confession in confessions])
+            counters.recount(confession_queryset)
+            counters.rebuild_reaction_summaries(confession_queryset)
+            counters.rescore(confession_queryset)
+            counters.recount_terms()
+            call_command('rebuild_conversations', stdout=self.stdout)
+        if search.get_backend() is not None:
+            call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Generated the dataset"))
+
+    def timestamp(self, after=None):
+        start = after or self.now - timezone.timedelta(days=self.days)
+        return start + (self.now - start) * self.random.random()
+
+    def skewed_choices(self, population, k, skew):
+        """
+        Picks k elements, the first ones of the population being the most likely ones
+        """
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(population))))
+        return self.random.choices(population, cum_weights=cum_weights, k=k)
+
+    def bulk_create(self, model, objects):
+        self.stdout.write("Creating %d %s rows..." % (len(objects), model._meta.object_name))
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_users(self, options):
+        first_ip = Session.objects.count()
+        with explicit_timestamps(User._meta.get_field('created'), Session._meta.get_field('created')):
+            users = self.bulk_create(User, [User(created=self.timestamp(), last_login=self.now) for _ in range(options['users'])])
+            users = list(User.objects.filter(handle__in=[user.handle for user in users]).order_by('pk'))
+            User.objects.filter(pk__in=[user.pk for user in users[:options['moderators']]]).update(role='moderator')
+            sessions = self.bulk_create(Session, [
+                Session(ip_address='10.%d.%d.%d' % ((first_ip + i) >> 16 & 255, (first_ip + i) >> 8 & 255, (first_ip + i) & 255),
+                        user=users[i] if i < len(users) else None, created=self.timestamp())
+                for i in range(len(users) + options['anonymous_sessions'])
+            ])
+        return users, list(Session.objects.filter(ip_address__in=[session.ip_address for session in sessions]))
+
+    def create_confessions(self, users, options):
+        categories = self.bulk_create(models.Category, [models.Category(name='Category %d' % i) for i in range(options['categories'])])
+        categories = list(models.Category.objects.order_by('-pk')[:len(categories)])
+        tags = []
+        for i in range(0, options['tags'], self.batch_size):
+            names = ['%s%d' % (self.random.choice(WORDS), j) for j in range(i, min(i + self.batch_size, options['tags']))]
+            Tag.objects.bulk_create([Tag(name=name, slug=name) for name in names], ignore_conflicts=True)
+            tags += Tag.objects.filter(name__in=names)
+
+        with explicit_timestamps(models.Confession._meta.get_field('created')):
+            confessions = self.bulk_create(models.Confession, [models.Confession(
+                title=' '.join(self.random.choices(WORDS, k=self.random.randint(2, 6))).capitalize(),
+                text=' '.join(self.random.choices(WORDS, k=self.random.randint(40, 200))),
+                author=self.random.choice(users) if users else None,
+                is_approved=self.random.random() < 0.9,
+                created=self.timestamp(),
+            ) for _ in range(options['confessions'])])
+        confessions = list(models.Confession.objects.order_by('-pk')[:len(confessions)])[::-1]
+
+        content_type = ContentType.objects.get_for_model(models.Confession)
+        self.bulk_create(models.Confession.categories.through, [
+            models.Confession.categories.through(confession=confession, category=category)
+            for confession in confessions for category in self.random.sample(categories, min(len(categories), self.random.randint(0, 2)))
+        ])
+        self.bulk_create(TaggedItem, [
+            TaggedItem(content_type=content_type, object_id=confession.pk, tag=tag)
+            for confession in confessions for tag in self.random.sample(tags, min(len(tags), self.random.randint(0, 4)))
+        ])
+        # The popularity order of the confessions is random, rather than by age
+        popularity = confessions[:]
+        self.random.shuffle(popularity)
+        return popularity
+
+    def create_comments(self, confessions, sessions, options):
+        with explicit_timestamps(models.Comment._meta.get_field('created')):
+            self.bulk_create(models.Comment, [
+                models.Comment(confession=confession, sender=self.random.choice(sessions),
+                               text=' '.join(self.random.choices(WORDS, k=self.random.randint(3, 30))),
+                               created=self.timestamp(confession.created))
+                for confession in self.skewed_choices(confessions, options['comments'], options['skew'])
+            ])
+        return list(models.Comment.objects.filter(confession__in=confessions).order_by('pk'))
+
+    def create_reactions(self, confessions, comments, sessions, options):
+        targets = self.skewed_choices(confessions, options['reactions'], options['skew'])
+        seen = set()
+        reactions = []
+        for confession in targets:
+            comment = self.random.choice(comments) if comments and self.random.random() < 0.3 else None
+            sender = self.random.choice(sessions)
+            # A session reacts at most once to the same confession or comment
+            key = (sender.pk, comment.pk if comment else None, None if comment else confession.pk)
+            if key in seen:
+                continue
+            seen.add(key)
+            reactions.append(models.Reaction(
+                confession=None if comment else confession, comment=comment, sender=sender, emoji=self.random.choice(EMOJIS),
+                created=self.timestamp(comment.created if comment else confession.created)
+            ))
+        with explicit_timestamps(models.Reaction._meta.get_field('created')):
+            self.bulk_create(models.Reaction, reactions)
+
+    def create_reports(self, confessions, sessions, moderators, options):
+        reported = self.skewed_choices(confessions, options['reports'], options['skew'])
+        with explicit_timestamps(Report._meta.get_field('created')):
+            self.bulk_create(Report, [
+                Report(confession=confession, session=self.random.choice(sessions), reason=self.random.choice(REASONS),
+                       created=self.timestamp(confession.created))
+                for confession in reported
+            ])
+        reports = list(Report.objects.order_by('-pk')[:len(reported)])
+        # Below the vote limit of ReportViewSet, so that the benchmarks can vote
+        self.bulk_create(Report.voters.through, [
+            Report.voters.through(report=report, user=user)
+            for report in reports for user in self.random.sample(moderators, min(len(moderators), self.random.randint(0, 1)))
+        ])
+        Report.objects.filter(pk__in=[report.pk for report in reports]).update(vote_count=Coalesce(Subquery(
+            Report.voters.through.objects.filter(report=OuterRef('pk')).order_by()
+            .values('report').annotate(count=Count('pk')).values('count')
+        ), 0))
+
+    def create_messages(self, users, options):
+        if len(users) < 2:
+            return
+        # Most users only talk to a few others
+        contacts = {user.pk: self.random.sample(users, min(len(users), 5)) for user in users}
+        messages = []
+        for sender in self.skewed_choices(users, options['messages'], options['skew']):
+            receiver = self.random.choice(contacts[sender.pk])
+            if receiver.pk != sender.pk:
+                messages.append(Message(sender=sender, receiver=receiver, sent=self.timestamp(),
+                                        text=' '.join(self.random.choices(WORDS, k=self.random.randint(2, 20)))))
+        messages.sort(key=lambda message: message.sent)
+        with explicit_timestamps(Message._meta.get_field('sent')):
+            self.bulk_create(Message, messages)
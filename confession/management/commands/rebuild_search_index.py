@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from confession import models, search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of confessions from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', '-b', type=int, default=500, help="Number of confessions indexed per batch.")
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        if backend is None:
+            raise CommandError("The database doesn't support the full-text search index.")
+        self.stdout.write("Clearing the index...")
+        backend.clear()
+        indexed_count = 0
+        last_pk = 0
+        while True:
+            pks = list(models.Confession.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            with transaction.atomic():
+                backend.update(pks)
+            indexed_count += len(pks)
+            last_pk = pks[-1]
+            self.stdout.write("Indexed %d confessions..." % indexed_count)
+        self.stdout.write(self.style.SUCCESS("Indexed %d confessions" % indexed_count))
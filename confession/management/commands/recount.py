@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from confession import models, counters
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the stored comment and reaction counters and the reaction summaries of confessions, and the approved "
+            "confession counts of tags and categories, repairing any drift")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', '-b', type=int, default=1000, help="Number of confessions recounted per query.")
+
+    def handle(self, *args, **options):
+        repaired_count = 0
+        last_pk = 0
+        while True:
+            pks = list(models.Confession.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            confessions = models.Confession.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+            with transaction.atomic():
+                repaired_count += counters.recount(confessions)
+                counters.rebuild_reaction_summaries(confessions)
+            last_pk = pks[-1]
+        with transaction.atomic():
+            repaired_count += counters.recount_terms()
+        self.stdout.write(self.style.SUCCESS("Repaired %d counters" % repaired_count) if repaired_count > 0 else "All counters are up to date")
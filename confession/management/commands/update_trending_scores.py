@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from confession import models, counters
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the stored trending scores of confessions, writing only the drifted ones. Scores don't change with "
+            "time, so running it periodically only repairs the ones which bulk changes or a change of the TRENDING_* "
+            "settings left behind.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', '-b', type=int, default=1000, help="Number of confessions rescored per transaction.")
+
+    def handle(self, *args, **options):
+        rescored_count = 0
+        last_pk = 0
+        while True:
+            pks = list(models.Confession.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            with transaction.atomic():
+                rescored_count += counters.rescore(models.Confession.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]),
+                                                   options['batch_size'])
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS("Rescored %d confessions" % rescored_count) if rescored_count > 0 else "All trending scores are up to date")
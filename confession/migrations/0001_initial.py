@@ -0,0 +1,74 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:33
+
+import confession.models
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import taggit.managers
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('taggit', '0004_alter_taggeditem_content_type_alter_taggeditem_tag'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('member', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=255, validators=[django.core.validators.MinLengthValidator(3)])),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Confession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, validators=[django.core.validators.MinLengthValidator(3)])),
+                ('text', models.TextField(max_length=5000, validators=[django.core.validators.MinLengthValidator(200)])),
+                ('is_approved', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('categories', models.ManyToManyField(to='confession.category')),
+                ('tags', taggit.managers.TaggableManager(help_text='A comma-separated list of tags.', through='taggit.TaggedItem', to='taggit.Tag', verbose_name='Tags')),
+            ],
+            options={
+                'ordering': ('-pk',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Reaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=1, validators=[confession.models.check_if_emoji])),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='confession.comment')),
+                ('confession', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='confession.confession')),
+                ('sender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='member.session')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='confession',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='confession.confession'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='sender',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='member.session'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:33
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Confession = apps.get_model('confession', 'Confession')
+
+    def count_subquery(model_name):
+        return Coalesce(Subquery(
+            apps.get_model('confession', model_name).objects.filter(confession=OuterRef('pk')).order_by()
+            .values('confession').annotate(count=Count('pk')).values('count')
+        ), 0)
+
+    Confession.objects.update(comment_count=count_subquery('Comment'), reaction_count=count_subquery('Reaction'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confession',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='confession',
+            name='reaction_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(fields=['is_approved', '-reaction_count', '-comment_count', '-id'], name='confession_reactions_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(fields=['is_approved', '-comment_count', '-id'], name='confession_comments_idx'),
+        ),
+    ]
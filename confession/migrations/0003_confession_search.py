@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+SCHEMA = {
+    'sqlite': (
+        ("CREATE VIRTUAL TABLE confession_search USING fts5("
+         "title, text, tags, categories, tokenize = 'unicode61 remove_diacritics 2')",),
+        ('DROP TABLE confession_search',),
+    ),
+    'postgresql': (
+        ('CREATE TABLE confession_search ('
+         'confession_id bigint PRIMARY KEY REFERENCES confession_confession (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+         'document tsvector NOT NULL)',
+         'CREATE INDEX confession_search_document_idx ON confession_search USING GIN (document)'),
+        ('DROP TABLE confession_search',),
+    ),
+}
+
+
+def create_search_table(apps, schema_editor):
+    for sql in SCHEMA.get(schema_editor.connection.vendor, ((), ()))[0]:
+        schema_editor.execute(sql)
+
+
+def drop_search_table(apps, schema_editor):
+    for sql in SCHEMA.get(schema_editor.connection.vendor, ((), ()))[1]:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0002_confession_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def populate_summaries(apps, schema_editor):
+    Reaction = apps.get_model('confession', 'Reaction')
+    ReactionSummary = apps.get_model('confession', 'ReactionSummary')
+    ReactionSummary.objects.bulk_create([
+        ReactionSummary(**summary) for summary in
+        Reaction.objects.order_by().values('confession_id', 'comment_id', 'emoji').annotate(count=Count('pk'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0003_confession_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReactionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=1)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='confession.comment')),
+                ('confession', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='confession.confession')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reactionsummary',
+            constraint=models.UniqueConstraint(fields=('confession', 'emoji'), name='reaction_summary_confession_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='reactionsummary',
+            constraint=models.UniqueConstraint(fields=('comment', 'emoji'), name='reaction_summary_comment_unique'),
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
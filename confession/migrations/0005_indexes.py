@@ -0,0 +1,61 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0004_reaction_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='confession',
+            name='confession_reactions_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='confession',
+            name='confession_comments_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['confession', '-created'], name='comment_confession_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['sender', 'created'], name='comment_sender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-id'], name='confession_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-reaction_count', '-comment_count', '-id'], name='confession_feed_reactions_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-comment_count', '-id'], name='confession_feed_comments_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(fields=['-reaction_count', '-comment_count', '-id'], name='confession_reactions_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(fields=['-comment_count', '-id'], name='confession_comments_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(fields=['author', 'created'], name='confession_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['sender', 'created'], name='reaction_sender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['confession', 'emoji'], name='reaction_confession_emoji_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+from confession import trending
+
+
+def populate_trending_scores(apps, schema_editor):
+    Confession = apps.get_model('confession', 'Confession')
+    confessions = list(Confession.objects.only('created', 'reaction_count', 'comment_count'))
+    for confession in confessions:
+        confession.trending_score = trending.score(confession.created, confession.reaction_count, confession.comment_count)
+    Confession.objects.bulk_update(confessions, ('trending_score',), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confession',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_trending_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='confession',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-trending_score', '-id'], name='confession_feed_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def populate_counts(apps, schema_editor):
+    Confession = apps.get_model('confession', 'Confession')
+    Category = apps.get_model('confession', 'Category')
+    TagCount = apps.get_model('confession', 'TagCount')
+    Tag = apps.get_model('taggit', 'Tag')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    approved = Confession.objects.filter(is_approved=True).values('pk')
+    content_type = ContentType.objects.filter(app_label='confession', model='confession').first()
+    tag_counts = {} if content_type is None else dict(
+        TaggedItem.objects.filter(content_type=content_type, object_id__in=approved).order_by()
+        .values('tag').annotate(count=Count('pk')).values_list('tag', 'count')
+    )
+    TagCount.objects.bulk_create([TagCount(tag_id=pk, name=name, key=name.lower(), count=tag_counts.get(pk, 0))
+                                  for pk, name in Tag.objects.values_list('pk', 'name')], batch_size=1000)
+    categories = list(Category.objects.annotate(count=Count('confession', filter=models.Q(confession__is_approved=True))))
+    for category in categories:
+        category.confession_count = category.count
+    Category.objects.bulk_update(categories, ('confession_count',), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0004_alter_taggeditem_content_type_alter_taggeditem_tag'),
+        ('confession', '0006_confession_trending_score'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='taggit.tag')),
+                ('name', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='confession_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-confession_count', 'name'], name='category_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['-count', 'key'], name='tagcount_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['key'], name='tagcount_key_idx'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
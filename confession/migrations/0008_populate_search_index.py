@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from confession import search
+
+
+BATCH_SIZE = 500
+
+
+def populate_search_index(apps, schema_editor):
+    backend = search.BACKENDS.get(schema_editor.connection.vendor)
+    if backend is None:
+        return
+    backend = backend(schema_editor.connection)
+    Confession = apps.get_model('confession', 'Confession')
+    using = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        pks = list(Confession.objects.using(using).filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        backend.update(pks, apps)
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('confession', '0007_tag_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -1,40 +1,97 @@
 from django.core.exceptions import ValidationError
 from django.core.validators import MinLengthValidator
 from django.db import models
+from django.utils import timezone
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 
-from djangoProject.common import EMOJI_PATTERN
+from djangoProject.common import EMOJI_PATTERN, AtomicSaveModel
+from . import trending
 
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
+    # Number of approved confessions in the category, kept up to date by confession.counters
+    confession_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = (models.Index(fields=('-confession_count', 'name'), name='category_count_idx'),)
 
     def __str__(self):
         return 'Category: %s' % self.name
 
 
-class Confession(models.Model):
+class Confession(AtomicSaveModel):
     title = models.CharField(max_length=255, validators=[MinLengthValidator(3)])
     text = models.TextField(max_length=5000, validators=[MinLengthValidator(200)])
     author = models.ForeignKey('member.User', on_delete=models.SET_NULL, null=True)
     is_approved = models.BooleanField(default=False)
     categories = models.ManyToManyField(Category)
     tags = TaggableManager()
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    reaction_count = models.PositiveIntegerField(default=0, editable=False)
+    # See confession.trending, kept up to date by confession.counters
+    trending_score = models.FloatField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ('-pk',)
+        indexes = (
+            # Filtering on a boolean compiles to a bare "WHERE is_approved" on some backends, which only a partial
+            # index can serve
+            models.Index(fields=('-id',), condition=models.Q(is_approved=True), name='confession_feed_idx'),
+            models.Index(fields=('-reaction_count', '-comment_count', '-id'), condition=models.Q(is_approved=True),
+                         name='confession_feed_reactions_idx'),
+            models.Index(fields=('-comment_count', '-id'), condition=models.Q(is_approved=True),
+                         name='confession_feed_comments_idx'),
+            models.Index(fields=('-trending_score', '-id'), condition=models.Q(is_approved=True),
+                         name='confession_feed_trending_idx'),
+            models.Index(fields=('-reaction_count', '-comment_count', '-id'), name='confession_reactions_idx'),
+            models.Index(fields=('-comment_count', '-id'), name='confession_comments_idx'),
+            models.Index(fields=('author', 'created'), name='confession_author_created_idx'),
+        )
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.trending_score = trending.score(self.created or timezone.now(), self.reaction_count, self.comment_count)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return 'Confession %s: %s' % (self.author, self.title)
 
 
-class Comment(models.Model):
+class TagCount(models.Model):
+    """
+    Number of approved confessions with the tag, kept up to date by confession.counters
+    """
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True)
+    name = models.CharField(max_length=100)
+    # Lowercase name, for case-insensitive prefix lookups which an index can serve
+    key = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            models.Index(fields=('-count', 'key'), name='tagcount_count_idx'),
+            models.Index(fields=('key',), name='tagcount_key_idx'),
+        )
+
+    def __str__(self):
+        return 'Tag %s: %d' % (self.name, self.count)
+
+
+class Comment(AtomicSaveModel):
     sender = models.ForeignKey('member.Session', on_delete=models.SET_NULL, null=True)
     confession = models.ForeignKey(Confession, on_delete=models.CASCADE)
     text = models.CharField(max_length=255, validators=[MinLengthValidator(3)])
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = (
+            models.Index(fields=('confession', '-created'), name='comment_confession_created_idx'),
+            models.Index(fields=('sender', 'created'), name='comment_sender_created_idx'),
+        )
+
     def __str__(self):
         return 'Comment %s: #%d' % (self.sender, self.pk)
 
@@ -44,13 +101,37 @@ def check_if_emoji(value):
         raise ValidationError("%(value)s is not an Emoji" % {'value': value})
 
 
-class Reaction(models.Model):
+class Reaction(AtomicSaveModel):
     sender = models.ForeignKey('member.Session', on_delete=models.SET_NULL, null=True)
     confession = models.ForeignKey(Confession, on_delete=models.CASCADE, null=True, blank=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
     emoji = models.CharField(max_length=1, validators=[check_if_emoji])
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = (
+            models.Index(fields=('sender', 'created'), name='reaction_sender_created_idx'),
+            models.Index(fields=('confession', 'emoji'), name='reaction_confession_emoji_idx'),
+        )
+
     def __str__(self):
         return 'Reaction %s: %s%s' % (self.sender, self.confession, self.comment)
 
+
+class ReactionSummary(models.Model):
+    """
+    Number of reactions with each emoji given to a confession or a comment, maintained by confession.signals
+    """
+    confession = models.ForeignKey(Confession, on_delete=models.CASCADE, null=True, blank=True)
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
+    emoji = models.CharField(max_length=1)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('confession', 'emoji'), name='reaction_summary_confession_unique'),
+            models.UniqueConstraint(fields=('comment', 'emoji'), name='reaction_summary_comment_unique'),
+        )
+
+    def __str__(self):
+        return 'Reaction summary %s%s: %s x%d' % (self.confession, self.comment, self.emoji, self.count)
@@ -1,7 +1,6 @@
 from rest_framework.permissions import SAFE_METHODS
 
-from djangoProject.common import BasePermission
-from member.models import Session
+from djangoProject.common import BasePermission, get_current_session
 
 
 class ConfessionPermission(BasePermission):
@@ -15,6 +14,6 @@ class ConfessionPermission(BasePermission):
 class CommentReactionPermission(BasePermission):
     def has_object_permission(self, request, view, obj):
         return request.method in SAFE_METHODS or \
-               Session.objects.get(ip_address=request.META['REMOTE_ADDR']) == obj.sender or \
+               get_current_session(request).pk == obj.sender_id or \
                request.method == 'DELETE' and request.user.is_authenticated and request.user.role == 'admin'
 
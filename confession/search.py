@@ -0,0 +1,179 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import IntegerField
+from django.db.models.expressions import RawSQL
+
+from . import models
+
+
+SEARCH_TABLE = 'confession_search'
+
+
+class BaseSearchBackend(ABC):
+    """
+    Full-text index of confession titles, texts, tag names and category names, kept in SEARCH_TABLE whose schema is
+    created by the confession migrations
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    @abstractmethod
+    def match_sql(self, query):
+        """
+        Returns SQL and params selecting the ids of all confessions matching the query
+        """
+
+    @abstractmethod
+    def search(self, query, limit, queryset):
+        """
+        Returns ids of the best matching confessions among those of the queryset, best match first
+        """
+
+    @abstractmethod
+    def rank_expression(self, pks):
+        """
+        Returns an expression evaluating to the position of the confession in the `pks` list returned by search()
+        """
+
+    @abstractmethod
+    def _delete(self, cursor, pks):
+        pass
+
+    @abstractmethod
+    def _insert(self, cursor, documents):
+        pass
+
+    @staticmethod
+    def candidates_sql(queryset):
+        """
+        Returns SQL and params selecting the ids of the confessions of the queryset, to which the ranking is limited so
+        that the result limit isn't used up by confessions the queryset filters out
+        """
+        return queryset.order_by().values('pk').query.get_compiler(queryset.db).as_sql()
+
+    def update(self, pks, apps=global_apps):
+        pks = list(pks)
+        if not pks:
+            return
+        documents = get_documents(pks, self.connection.alias, apps)
+        with self.connection.cursor() as cursor:
+            self._delete(cursor, pks)
+            if documents:
+                self._insert(cursor, documents)
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % SEARCH_TABLE)
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    # bm25() weights of the title, text, tags and categories columns
+    weights = (10.0, 1.0, 5.0, 5.0)
+
+    @staticmethod
+    def to_match_expression(query):
+        # Each term is quoted so that FTS5 operators can't be injected and matched as a prefix
+        return ' '.join('"%s"*' % term.replace('"', '""') for term in query.split())
+
+    def match_sql(self, query):
+        return 'SELECT rowid FROM %s WHERE %s MATCH %%s' % (SEARCH_TABLE, SEARCH_TABLE), \
+               (self.to_match_expression(query),)
+
+    def search(self, query, limit, queryset):
+        candidates_sql, candidates_params = self.candidates_sql(queryset)
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s AND rowid IN ({2}) ORDER BY bm25({0}, {1}) '
+                           'LIMIT %s'.format(SEARCH_TABLE, ', '.join(str(weight) for weight in self.weights),
+                                             candidates_sql),
+                           (self.to_match_expression(query), *candidates_params, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def rank_expression(self, pks):
+        # The offset of ",<id>," in ",<id1>,<id2>,...," grows with the position of the id in the list
+        return RawSQL("instr(%%s, ',' || %s.id || ',')" % self.connection.ops.quote_name(models.Confession._meta.db_table),
+                      (',%s,' % ','.join(str(pk) for pk in pks),), output_field=IntegerField())
+
+    def _delete(self, cursor, pks):
+        cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (SEARCH_TABLE, ', '.join(['%s'] * len(pks))), pks)
+
+    def _insert(self, cursor, documents):
+        cursor.executemany('INSERT INTO %s (rowid, title, text, tags, categories) VALUES (%%s, %%s, %%s, %%s, %%s)'
+                           % SEARCH_TABLE, documents)
+
+
+class PostgreSQLSearchBackend(BaseSearchBackend):
+    @property
+    def config(self):
+        return getattr(settings, 'SEARCH_CONFIG', 'english')
+
+    def match_sql(self, query):
+        return 'SELECT confession_id FROM %s WHERE document @@ websearch_to_tsquery(%%s, %%s)' % SEARCH_TABLE, \
+               (self.config, query)
+
+    def search(self, query, limit, queryset):
+        candidates_sql, candidates_params = self.candidates_sql(queryset)
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT confession_id FROM %s, websearch_to_tsquery(%%s, %%s) query WHERE document @@ query '
+                           'AND confession_id IN (%s) ORDER BY ts_rank(document, query) DESC LIMIT %%s'
+                           % (SEARCH_TABLE, candidates_sql), (self.config, query, *candidates_params, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def rank_expression(self, pks):
+        return RawSQL('array_position(%%s::bigint[], %s.id)' % self.connection.ops.quote_name(
+            models.Confession._meta.db_table), (list(pks),), output_field=IntegerField())
+
+    def _delete(self, cursor, pks):
+        cursor.execute('DELETE FROM %s WHERE confession_id = ANY(%%s)' % SEARCH_TABLE, (pks,))
+
+    def _insert(self, cursor, documents):
+        cursor.executemany(
+            'INSERT INTO %s (confession_id, document) VALUES (%%s, '
+            "setweight(to_tsvector(%%s, %%s), 'A') || setweight(to_tsvector(%%s, %%s), 'C') || "
+            "setweight(to_tsvector(%%s, %%s), 'B') || setweight(to_tsvector(%%s, %%s), 'B'))" % SEARCH_TABLE,
+            [(pk, self.config, title, self.config, text, self.config, tags, self.config, categories)
+             for pk, title, text, tags, categories in documents]
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend(using=None):
+    """
+    Returns the search backend of the database holding confessions, or None if that database isn't supported
+    """
+    connection = connections[using or router.db_for_read(models.Confession)]
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class(connection) if backend_class else None
+
+
+def get_documents(pks, using, apps=global_apps):
+    """
+    Returns the (id, title, text, tags, categories) documents of the confessions, read through the models of `apps` so
+    that migrations can pass their historical ones
+    """
+    Confession = apps.get_model('confession', 'Confession')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    tags, categories = defaultdict(list), defaultdict(list)
+    content_type = ContentType.objects.db_manager(using).get_for_model(Confession)
+    for pk, name in Confession.tags.through.objects.using(using)\
+            .filter(content_type=content_type, object_id__in=pks).values_list('object_id', 'tag__name'):
+        tags[pk].append(name)
+    for pk, name in Confession.categories.through.objects.using(using).filter(confession_id__in=pks)\
+            .values_list('confession_id', 'category__name'):
+        categories[pk].append(name)
+    return [(pk, title, text, ' '.join(tags[pk]), ' '.join(categories[pk]))
+            for pk, title, text in Confession.objects.using(using).filter(pk__in=pks).values_list('pk', 'title', 'text')]
+
+
+def update_index(pks):
+    backend = get_backend(router.db_for_write(models.Confession))
+    if backend is not None:
+        backend.update(pks)
@@ -1,15 +1,17 @@
+from collections import defaultdict
+
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from rest_framework.permissions import SAFE_METHODS
 from drf_recaptcha.fields import ReCaptchaV3Field
 
-from djangoProject.common import ConfessionOrCommentInSerializerUnique
+from djangoProject.common import ConfessionOrCommentInSerializerUnique, BulkSerializer, get_current_session, set_through_rows
+from djangoProject.instrumentation import TimedSerializerMixin
 from djangoProject.taggit_serializer import TaggitSerializer, TagListSerializerField
-from member.models import Session
 from . import models
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Category
         fields = '__all__'
@@ -27,8 +29,27 @@ class RecaptchaSerializer(serializers.Serializer):
         return super().validate(attrs)
 
 
-class ConfessionSerializer(TaggitSerializer, RecaptchaSerializer, serializers.ModelSerializer):
-    categories = serializers.SerializerMethodField()
+@extend_schema_field(serializers.ListField(child=serializers.CharField()))
+class CategoryNamesField(serializers.ListField):
+    child = serializers.CharField(max_length=255)
+
+    def to_representation(self, value):
+        return [category.name for category in value.all()]
+
+
+def load_category_names(confession_ids):
+    """
+    Related loader of the category names of confessions for RowSerializer
+    """
+    names = defaultdict(list)
+    for confession_id, name in models.Confession.categories.through.objects.filter(confession_id__in=confession_ids)\
+            .values_list('confession_id', 'category__name'):
+        names[confession_id].append(name)
+    return names
+
+
+class ConfessionSerializer(TimedSerializerMixin, TaggitSerializer, RecaptchaSerializer, serializers.ModelSerializer):
+    categories = CategoryNamesField(required=False)
     comment_count = serializers.IntegerField(read_only=True)
     reaction_count = serializers.IntegerField(read_only=True)
     tags = TagListSerializerField()
@@ -47,10 +68,28 @@ class ConfessionSerializer(TaggitSerializer, RecaptchaSerializer, serializers.Mo
             elif self.context['request'].user.is_anonymous or self.context['request'].user.role != 'admin':
                 self.fields.pop('author')
 
+    def validate_categories(self, names):
+        # Category names are stored capitalized, see CategorySerializer
+        names = {name.capitalize() for name in names}
+        categories = list(models.Category.objects.filter(name__in=names).values_list('pk', 'name'))
+        unknown = names - {name for _, name in categories}
+        if unknown:
+            raise serializers.ValidationError("Unknown categories: %s." % ', '.join(sorted(unknown)))
+        return {pk for pk, _ in categories}
+
+    @staticmethod
+    def _save_categories(instance, category_ids):
+        if category_ids is not None:
+            through = models.Confession.categories.through
+            set_through_rows(instance, through, {'confession': instance}, 'category', category_ids)
+            getattr(instance, '_prefetched_objects_cache', {}).pop('categories', None)
+        return instance
+
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
         validated_data.pop('is_approved', None)
-        return super().create(validated_data)
+        category_ids = validated_data.pop('categories', None)
+        return self._save_categories(super().create(validated_data), category_ids)
 
     def update(self, instance, validated_data):
         validated_data.pop('author', None)
@@ -59,20 +98,36 @@ class ConfessionSerializer(TaggitSerializer, RecaptchaSerializer, serializers.Mo
             validated_data.pop('text', None)
         if instance.author == self.context['request'].user or self.context['request'].user.role not in ['admin', 'moderator']:
             validated_data.pop('is_approved', None)
-        return super().update(instance, validated_data)
+        category_ids = validated_data.pop('categories', None)
+        return self._save_categories(super().update(instance, validated_data), category_ids)
+
+
+class TagCloudQuerySerializer(serializers.Serializer):
+    prefix = serializers.CharField(required=False, max_length=100)
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+
+class TermCountSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class TagCloudSerializer(serializers.Serializer):
+    tags = TermCountSerializer(many=True)
+    categories = TermCountSerializer(many=True)
+
 
-    @extend_schema_field(serializers.ListField(child=serializers.CharField()))
-    def get_categories(self, obj):
-        return obj.categories.values_list('name', flat=True)
+class BulkModerationSerializer(BulkSerializer):
+    is_approved = serializers.BooleanField()
 
 
-class BaseCommentReactionSerializer(RecaptchaSerializer, serializers.ModelSerializer):
+class BaseCommentReactionSerializer(TimedSerializerMixin, RecaptchaSerializer, serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         if 'request' in self.context:
             if self.context['request'].method == 'POST':
-                self.fields['sender'] = serializers.HiddenField(default=Session.objects.get(ip_address=self.context['request'].META['REMOTE_ADDR']))
+                self.fields['sender'] = serializers.HiddenField(default=get_current_session(self.context['request']))
             elif self.context['request'].user.is_anonymous or self.context['request'].user.role != 'admin':
                 self.fields.pop('sender')
 
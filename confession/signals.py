@@ -0,0 +1,142 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from taggit.models import Tag
+
+from djangoProject import pubsub
+from . import models, counters, search, feed
+
+
+@receiver(post_save, sender=models.Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.confession_id, 'comment_count', 1)
+        pubsub.publish_on_commit('comment:%d' % instance.confession_id)
+
+
+@receiver(post_delete, sender=models.Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if counters.is_deferred():
+        return
+    counters.increment(instance.confession_id, 'comment_count', -1)
+
+
+@receiver(post_save, sender=models.Reaction)
+def reaction_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.confession_id, 'reaction_count', 1)
+        counters.adjust_reaction_summary(instance, 1)
+
+
+@receiver(post_delete, sender=models.Reaction)
+def reaction_deleted(sender, instance, **kwargs):
+    if counters.is_deferred():
+        return
+    counters.increment(instance.confession_id, 'reaction_count', -1)
+    counters.adjust_reaction_summary(instance, -1)
+
+
+@receiver(post_save, sender=models.Confession)
+@receiver(post_delete, sender=models.Confession)
+def confession_changed(sender, instance, **kwargs):
+    search.update_index([instance.pk])
+    # New confessions await approval before reaching the feed
+    if not kwargs.get('created') or instance.is_approved:
+        feed.confession_changed(instance)
+
+
+@receiver(pre_save, sender=models.Confession)
+def confession_saving(sender, instance, **kwargs):
+    # Runs within the transaction of AtomicSaveModel.save(), where the row lock serializes concurrent approvals
+    instance._was_approved = not instance._state.adding and bool(
+        models.Confession.objects.select_for_update().filter(pk=instance.pk).values_list('is_approved', flat=True).first())
+
+
+@receiver(post_save, sender=models.Confession)
+def confession_approval_changed(sender, instance, **kwargs):
+    if instance.is_approved != getattr(instance, '_was_approved', False):
+        counters.adjust_term_counts([instance.pk], 1 if instance.is_approved else -1)
+    instance._was_approved = instance.is_approved
+
+
+@receiver(pre_delete, sender=models.Confession)
+def confession_deleting(sender, instance, **kwargs):
+    # The tag and category rows are deleted along with the confession, without m2m_changed signals. The instance may
+    # predate an approval by queryset update (e.g. bulk_moderate), so the database is asked.
+    if models.Confession.objects.filter(pk=instance.pk, is_approved=True).exists():
+        counters.adjust_term_counts([instance.pk], -1)
+
+
+@receiver(m2m_changed, sender=models.Confession.tags.through)
+@receiver(m2m_changed, sender=models.Confession.categories.through)
+def confession_terms_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the approved confession counts of tags and categories up to date
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    is_category = sender is models.Confession.categories.through
+    adjust = counters.adjust_category_counts if is_category else counters.adjust_tag_counts
+    sign = 1 if action == 'post_add' else -1
+    if not reverse:
+        if not instance.is_approved:
+            return
+        if action == 'pre_clear':
+            pk_set = (instance.categories if is_category else instance.tags).values_list('pk', flat=True)
+        adjust(pk_set, sign)
+    else:
+        confessions = models.Confession.objects.filter(**{'categories' if is_category else 'tags': instance}) \
+            if action == 'pre_clear' else models.Confession.objects.filter(pk__in=pk_set)
+        adjust([instance.pk] * confessions.filter(is_approved=True).count(), sign)
+
+
+@receiver(m2m_changed, sender=models.Confession.tags.through)
+@receiver(m2m_changed, sender=models.Confession.categories.through)
+def confession_tags_or_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        if action != 'pre_clear':
+            search.update_index([instance.pk])
+            feed.confessions_changed([instance.pk])
+    elif action == 'pre_clear':
+        # The cleared confessions are unknown after the fact, so they're remembered here
+        instance._search_cleared_pks = list(instance.confession_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        search.update_index(getattr(instance, '_search_cleared_pks', ()))
+        feed.confessions_changed(getattr(instance, '_search_cleared_pks', ()))
+    else:
+        search.update_index(pk_set)
+        feed.confessions_changed(pk_set)
+
+
+@receiver(post_save, sender=models.Category)
+def category_changed(sender, instance, created, **kwargs):
+    if not created:
+        pks = list(instance.confession_set.values_list('pk', flat=True))
+        search.update_index(pks)
+        feed.confessions_changed(pks)
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, created, **kwargs):
+    if not created:
+        pks = list(models.Confession.objects.filter(tags=instance).values_list('pk', flat=True))
+        search.update_index(pks)
+        feed.confessions_changed(pks)
+        models.TagCount.objects.filter(tag=instance).update(name=instance.name, key=instance.name.lower())
+
+
+@receiver(pre_delete, sender=models.Category)
+@receiver(pre_delete, sender=Tag)
+def category_or_tag_deleting(sender, instance, **kwargs):
+    # Their confessions are unknown after the cascade, which sends no m2m_changed, so they're remembered here
+    confessions = instance.confession_set if sender is models.Category else models.Confession.objects.filter(tags=instance)
+    instance._deleted_from_pks = list(confessions.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=models.Category)
+@receiver(post_delete, sender=Tag)
+def category_or_tag_deleted(sender, instance, **kwargs):
+    pks = getattr(instance, '_deleted_from_pks', ())
+    search.update_index(pks)
+    feed.confessions_changed(pks)
@@ -1,3 +1,730 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from taggit.models import Tag
+
+from djangoProject import db_router, instrumentation
+from djangoProject.async_views import async_routes
+from djangoProject.db_router import PIN_COOKIE, ReplicaRouter, replicate_sqlite
+from djangoProject.instrumentation import SNAPSHOT_TTL_INTERVALS, collector, Histogram
+from djangoProject.row_serializer import ROLES, role_user
+from djangoProject.testing import ClearCachesMixin, QueryPlanMixin
+from member.models import Session, User
+from . import models, counters, feed, filters, search, serializers, trending, views, urls
+
+
+class ConfessionTestCase(ClearCachesMixin, TestCase):
+    @staticmethod
+    def create_confessions(count, tag_count=1, category_count=1):
+        categories = [models.Category.objects.create(name='Category %d' % i) for i in range(category_count)]
+        for i in range(count):
+            confession = models.Confession.objects.create(title='Confession %d' % i, text='x' * 200, is_approved=True)
+            confession.categories.set(categories)
+            confession.tags.set(['tag%d' % j for j in range(tag_count)])
+
+    def count_list_queries(self, path='/confession/entry/'):
+        self.client.get(path)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+
+# Measures the database path, which the feed cache would skip
+@override_settings(FEED_CACHE_PAGES=0)
+class ConfessionListQueriesTest(ConfessionTestCase):
+    def test_query_count_is_constant(self):
+        self.create_confessions(2)
+        query_count = self.count_list_queries()
+        self.create_confessions(8, tag_count=5, category_count=3)
+        self.assertEqual(self.count_list_queries(), query_count)
+
+    def test_prefetched_representation(self):
+        self.create_confessions(1, tag_count=2, category_count=2)
+        result = self.client.get('/confession/entry/').json()['results'][0]
+        self.assertEqual(sorted(result['tags']), ['tag0', 'tag1'])
+        self.assertEqual(sorted(result['categories']), ['Category 0', 'Category 1'])
+
+
+class RowSerializerTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_confessions(3, tag_count=2, category_count=2)
+        author = User.objects.create()
+        models.Confession.objects.create(title='Pending', text='x' * 200, author=author)
+        models.Confession.objects.create(title='No terms', text='x' * 200, author=author, is_approved=True)
+        confession = models.Confession.objects.first()
+        session = Session.objects.create(ip_address='10.0.0.1')
+        comment = models.Comment.objects.create(confession=confession, sender=session, text='Sent')
+        models.Comment.objects.create(confession=confession, text='Anonymous')
+        models.Reaction.objects.create(confession=confession, sender=session, emoji='\U0001F600')
+        models.Reaction.objects.create(comment=comment, emoji='\U0001F622')
+
+    @staticmethod
+    def normalize(data):
+        data = JSONRenderer().render(data)
+        return [{name: sorted(value) if isinstance(value, list) else value for name, value in row.items()}
+                for row in json.loads(data)]
+
+    @staticmethod
+    def request(role):
+        request = APIRequestFactory().get('/')
+        request.user = role_user(role)
+        return request
+
+    def test_rows_match_the_serializers(self):
+        for view in (views.ConfessionViewSet, views.CommentViewSet, views.ReactionViewSet):
+            queryset = view.queryset.order_by('pk')
+            for role in ROLES:
+                with self.subTest(view=view.__name__, role=role):
+                    expected = view.serializer_class(queryset, many=True, context={'request': self.request(role)}).data
+                    rows = view.row_serializer.values(queryset, role)
+                    self.assertEqual(self.normalize(view.row_serializer.to_representation(rows, role)), self.normalize(expected))
+
+    def test_list_pages_read_rows(self):
+        self.client.force_login(User.objects.create(role='admin'))
+        for params in ({}, {'sort_by': 'popularity'}, {'page': 1}, {'search': 'Confession'}):
+            with self.subTest(params=params):
+                response = self.client.get('/confession/entry/', params).json()
+                self.assertTrue(response['results'])
+                self.assertIn('author', response['results'][0])
+
+
+class ConfessionFeedPaginationTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_confessions(25, tag_count=0, category_count=0)
+        for i, confession in enumerate(models.Confession.objects.order_by('pk')):
+            models.Confession.objects.filter(pk=confession.pk).update(reaction_count=i % 3, comment_count=i % 2)
+
+    def walk(self, url):
+        pks = []
+        while url:
+            response = self.client.get(url).json()
+            pks += [result['id'] for result in response['results']]
+            url = response['next']
+        return pks
+
+    def test_every_sort_is_stable(self):
+        expected_orderings = {
+            'newest': ('-pk',),
+            'oldest': ('created', 'pk'),
+            'popularity': ('-reaction_count', '-comment_count', '-pk'),
+            'most_reactions': ('-reaction_count', '-pk'),
+            'most_comments': ('-comment_count', '-pk'),
+            'trending': ('-trending_score', '-pk'),
+        }
+        for sort_by, ordering in expected_orderings.items():
+            expected = list(models.Confession.objects.order_by(*ordering).values_list('pk', flat=True))
+            self.assertEqual(self.walk('/confession/entry/?sort_by=%s' % sort_by), expected, sort_by)
+
+    def test_previous_page(self):
+        first_page = self.client.get('/confession/entry/?sort_by=popularity').json()
+        second_page = self.client.get(first_page['next']).json()
+        self.assertEqual(self.client.get(second_page['previous']).json()['results'], first_page['results'])
+
+    def test_page_number_mode(self):
+        response = self.client.get('/confession/entry/?page=3').json()
+        self.assertEqual(response['count'], 25)
+        self.assertEqual(len(response['results']), 5)
+
+
+@override_settings(FEED_CACHE_PAGES=1)
+class FeedCacheTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_confessions(15, tag_count=0, category_count=0)
+        self.confessions = list(models.Confession.objects.order_by('pk'))
+
+    def titles(self, **params):
+        return [result['title'] for result in self.client.get('/confession/entry/', params).json()['results']]
+
+    def test_cached_page_and_conditional_get(self):
+        first = self.client.get('/confession/entry/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/confession/entry/')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.client.get('/confession/entry/', HTTP_IF_NONE_MATCH=second['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/confession/entry/', HTTP_IF_MODIFIED_SINCE=second['Last-Modified']).status_code, 304)
+        # Beyond the cached pages, with other parameters or for users
+        self.assertNotIn('ETag', self.client.get('/confession/entry/', {'page': 2}))
+        self.assertNotIn('ETag', self.client.get('/confession/entry/', {'search': 'confession'}))
+        self.client.force_login(User.objects.create())
+        self.assertNotIn('ETag', self.client.get('/confession/entry/'))
+
+    def test_invalidated_by_changes_in_cached_region(self):
+        self.assertEqual(self.titles()[0], 'Confession 14')
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Confession.objects.filter(pk=self.confessions[-1].pk).update(title='Edited')
+            self.confessions[-1].refresh_from_db()
+            self.confessions[-1].save()
+        self.assertEqual(self.titles()[0], 'Edited')
+        moderator = User.objects.create(role='moderator')
+        self.client.force_login(moderator)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/confession/entry/bulk_moderate/', {'ids': [self.confessions[-2].pk], 'is_approved': False},
+                             content_type='application/json')
+        self.client.logout()
+        self.assertNotIn('Confession 13', self.titles())
+
+    def test_changes_below_cached_region_keep_it(self):
+        self.titles()
+        self.titles(sort_by='most_comments')
+        versions = feed.get_versions()
+        # The oldest confession is outside of the first page of the newest ones, but enters the one with most comments
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Comment.objects.create(confession=self.confessions[0], text='Hello')
+        new_versions = feed.get_versions()
+        self.assertEqual(new_versions['newest'], versions['newest'])
+        self.assertNotEqual(new_versions['most_comments'], versions['most_comments'])
+        self.assertEqual(self.titles(sort_by='most_comments')[0], 'Confession 0')
+
+    def test_waits_for_concurrent_rebuild(self):
+        request = self.client.get('/confession/entry/').wsgi_request
+        caches['feed'].clear()
+        version = feed.get_versions(('newest',))['newest']
+        key = feed._page_key('newest', version, None, request.get_host())
+        caches['feed'].add(key + ':lock', 1)
+        threading.Timer(0.1, lambda: caches['feed'].set(key, {'data': 'rebuilt'})).start()
+        self.assertEqual(feed.get_page(request, 'newest', None, lambda: self.fail("Rebuilt twice")), {'data': 'rebuilt'})
+
+
+class TagWriteTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create(role='admin'))
+        for name in ('Work', 'Family'):
+            models.Category.objects.create(name=name)
+
+    def post(self, tags, categories=()):
+        caches['ratelimit'].clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/confession/entry/', {'title': 'Hello', 'text': 'x' * 200, 'tags': tags,
+                                                               'categories': categories, 'recaptcha': 'token'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json(), len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        Tag.objects.create(name='existing0')
+        # Warms up the session of the client
+        self.post([])
+        _, query_count = self.post(['new0', 'existing0'], ['work'])
+        _, many_query_count = self.post(['new%d' % i for i in range(1, 10)] + ['existing0'], ['work', 'family'])
+        self.assertEqual(many_query_count, query_count)
+
+    def test_update_writes_the_difference(self):
+        confession, _ = self.post(['a', 'b', ' b ', 'c'], ['work'])
+        self.assertEqual(sorted(confession['tags']), ['a', 'b', 'c'])
+        response = self.client.patch('/confession/entry/%d/' % confession['id'], {'tags': ['b', 'c', 'd'], 'categories': ['family'], 'recaptcha': 'token'},
+                                     content_type='application/json').json()
+        self.assertEqual(sorted(response['tags']), ['b', 'c', 'd'])
+        self.assertEqual(response['categories'], ['Family'])
+        self.assertEqual(self.client.get('/confession/entry/', {'search': 'family'}).json()['results'][0]['id'], confession['id'])
+        response = self.client.patch('/confession/entry/%d/' % confession['id'], {'categories': ['Unknown'], 'recaptcha': 'token'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TagCloudTest(ConfessionTestCase):
+    def cloud(self, **params):
+        response = self.client.get('/confession/tag/', params).json()
+        return {kind: [(term['name'], term['count']) for term in terms] for kind, terms in response.items()}
+
+    def test_counts_follow_approval_tagging_and_deletion(self):
+        category = models.Category.objects.create(name='Work')
+        approved = models.Confession.objects.create(title='Approved', text='x' * 200, is_approved=True)
+        approved.tags.set(['Office', 'boss'])
+        approved.categories.add(category)
+        pending = models.Confession.objects.create(title='Pending', text='x' * 200)
+        pending.tags.set(['office'])
+        pending.categories.add(category)
+        self.assertEqual(self.cloud(), {'tags': [('boss', 1), ('Office', 1)], 'categories': [('Work', 1)]})
+
+        self.client.force_login(User.objects.create(role='moderator'))
+        self.client.post('/confession/entry/bulk_moderate/', {'ids': [pending.pk], 'is_approved': True},
+                         content_type='application/json')
+        self.assertEqual(self.cloud(), {'tags': [('boss', 1), ('Office', 1), ('office', 1)], 'categories': [('Work', 2)]})
+        approved.tags.remove('boss')
+        pending.delete()
+        self.assertEqual(self.cloud(), {'tags': [('Office', 1)], 'categories': [('Work', 1)]})
+        approved.is_approved = False
+        approved.save()
+        self.assertEqual(self.cloud(), {'tags': [], 'categories': []})
+        self.assertEqual(counters.recount_terms(), 0)
+
+    def test_top_and_prefix(self):
+        self.create_confessions(3, tag_count=3, category_count=0)
+        models.Confession.objects.order_by('pk').first().tags.add('Tagline')
+        self.assertEqual(self.cloud(limit=2)['tags'], [('tag0', 3), ('tag1', 3)])
+        self.assertEqual(self.cloud(prefix='TAG')['tags'], [('tag0', 3), ('tag1', 3), ('tag2', 3), ('Tagline', 1)])
+        self.assertEqual(self.cloud(prefix='tagl')['tags'], [('Tagline', 1)])
+        self.assertEqual(self.client.get('/confession/tag/', {'limit': 0}).status_code, 400)
+
+
+class ConfessionSearchTest(ConfessionTestCase):
+    def search(self, query):
+        return [result['title'] for result in self.client.get('/confession/entry/', {'search': query}).json()['results']]
+
+    def test_index_follows_changes(self):
+        category = models.Category.objects.create(name='Work')
+        confession = models.Confession.objects.create(title='Late again', text='x' * 200, is_approved=True)
+        models.Confession.objects.create(title='Something else', text='late ' * 50, is_approved=True)
+        self.assertEqual(self.search('late'), ['Late again', 'Something else'])
+        confession.tags.add('commute')
+        confession.categories.add(category)
+        self.assertEqual(self.search('commut work'), ['Late again'])
+        category.name = 'Office'
+        category.save()
+        self.assertEqual(self.search('work'), [])
+        Tag.objects.get(name='commute').delete()
+        category.delete()
+        self.assertEqual(self.search('commute'), [])
+        self.assertEqual(self.search('office'), [])
+        confession.delete()
+        self.assertEqual(self.search('late'), ['Something else'])
+
+    def test_ranking_is_limited_to_visible_confessions(self):
+        models.Confession.objects.create(title='Late again', text='x' * 200)
+        models.Confession.objects.create(title='Something else', text='late ' * 50, is_approved=True)
+        with mock.patch.object(filters.ConfessionSearchFilter, 'ranked_result_limit', 1):
+            self.assertEqual(self.search('late'), ['Something else'])
+
+    def test_migration_populates_index(self):
+        category = models.Category.objects.create(name='Work')
+        confession = models.Confession.objects.create(title='Late again', text='x' * 200, is_approved=True)
+        confession.tags.add('commute')
+        confession.categories.add(category)
+        search.get_backend().clear()
+        self.assertEqual(self.search('late'), [])
+        migration = import_module('confession.migrations.0008_populate_search_index')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.populate_search_index(apps, mock.Mock(connection=connection))
+        self.assertEqual(self.search('late commute work'), ['Late again'])
+
+
+class CommentRateLimitTest(ConfessionTestCase):
+    def test_fourth_comment_is_throttled(self):
+        self.create_confessions(1)
+        data = {'confession': models.Confession.objects.get().pk, 'text': 'Hello', 'recaptcha': 'token'}
+        for _ in range(3):
+            self.assertEqual(self.client.post('/confession/comment/', data).status_code, 201)
+        response = self.client.post('/confession/comment/', data)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(models.Comment.objects.count(), 3)
+
+    def test_failed_comments_are_not_counted(self):
+        self.create_confessions(1)
+        data = {'confession': models.Confession.objects.get().pk, 'text': 'Hello', 'recaptcha': 'token'}
+        for _ in range(3):
+            self.assertEqual(self.client.post('/confession/comment/', {**data, 'confession': 0}).status_code, 400)
+        for _ in range(3):
+            self.assertEqual(self.client.post('/confession/comment/', data).status_code, 201)
+
+
+class ReactionSummaryTest(ConfessionTestCase):
+    def test_summary_follows_reactions(self):
+        self.create_confessions(2)
+        first, second = models.Confession.objects.order_by('pk')
+        sessions = [Session.objects.create(ip_address='10.0.0.%d' % i) for i in range(3)]
+        reactions = [models.Reaction.objects.create(confession=first, sender=session, emoji='\U0001F600') for session in sessions]
+        models.Reaction.objects.create(confession=second, sender=sessions[0], emoji='\U0001F622')
+        reactions[0].delete()
+
+        response = self.client.get('/confession/reaction/', {'confession': first.pk}).json()
+        self.assertEqual(response['results'], [{'emoji': '\U0001F600', 'count': 2}])
+        response = self.client.get('/confession/reaction/summary/', {'confessions': '%d,%d' % (first.pk, second.pk)}).json()
+        self.assertEqual(response['results'], {str(first.pk): [{'emoji': '\U0001F600', 'count': 2}],
+                                               str(second.pk): [{'emoji': '\U0001F622', 'count': 1}]})
+
+
+class CounterTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = Session.objects.create(ip_address='10.0.0.1')
+
+    def counts(self, confession):
+        confession.refresh_from_db()
+        return confession.comment_count, confession.reaction_count
+
+    def test_counts_follow_comments_and_reactions(self):
+        self.create_confessions(1)
+        confession = models.Confession.objects.get()
+        comment = models.Comment.objects.create(confession=confession, text='Comment', sender=self.session)
+        models.Comment.objects.create(confession=confession, text='Comment', sender=self.session)
+        reaction = models.Reaction.objects.create(confession=confession, sender=self.session, emoji='\U0001F600')
+        models.Reaction.objects.create(comment=comment, sender=self.session, emoji='\U0001F600')
+        self.assertEqual(self.counts(confession), (2, 1))
+        comment.delete()
+        reaction.delete()
+        self.assertEqual(self.counts(confession), (1, 0))
+
+    def test_term_counts_follow_approval_and_deletion(self):
+        self.create_confessions(2, tag_count=1, category_count=1)
+        first, second = models.Confession.objects.order_by('pk')
+        tag_count, category = models.TagCount.objects.get(name='tag0'), models.Category.objects.get()
+        self.assertEqual((tag_count.count, category.confession_count), (2, 2))
+        first.is_approved = False
+        first.save()
+        tag_count.refresh_from_db()
+        category.refresh_from_db()
+        self.assertEqual((tag_count.count, category.confession_count), (1, 1))
+        second.delete()
+        tag_count.refresh_from_db()
+        category.refresh_from_db()
+        self.assertEqual((tag_count.count, category.confession_count), (0, 0))
+        first.is_approved = True
+        first.save()
+        tag_count.refresh_from_db()
+        category.refresh_from_db()
+        self.assertEqual((tag_count.count, category.confession_count), (1, 1))
+
+    def test_confession_delete_defers_counters(self):
+        self.create_confessions(1)
+        confession = models.Confession.objects.get()
+        for _ in range(3):
+            comment = models.Comment.objects.create(confession=confession, text='Comment', sender=self.session)
+            models.Reaction.objects.create(comment=comment, sender=self.session, emoji='\U0001F600')
+            models.Reaction.objects.create(confession=confession, sender=self.session, emoji='\U0001F622')
+        self.client.force_login(User.objects.create(role='admin'))
+        with mock.patch.object(counters, 'increment', wraps=counters.increment) as increment:
+            self.assertEqual(self.client.delete('/confession/entry/%d/' % confession.pk).status_code, 204)
+        increment.assert_not_called()
+        self.assertFalse(models.ReactionSummary.objects.exists())
+        self.assertEqual(models.Category.objects.get().confession_count, 0)
+
+    def test_recount_repairs_drifted_counts(self):
+        self.create_confessions(2, tag_count=1, category_count=1)
+        first, second = models.Confession.objects.order_by('pk')
+        models.Comment.objects.create(confession=first, text='Comment', sender=self.session)
+        models.Reaction.objects.create(confession=first, sender=self.session, emoji='\U0001F600')
+        models.Confession.objects.filter(pk=first.pk).update(comment_count=5, reaction_count=0)
+        models.Confession.objects.filter(pk=second.pk).update(reaction_count=3)
+        models.ReactionSummary.objects.update(count=4)
+        models.TagCount.objects.update(count=0)
+        models.Category.objects.update(confession_count=7)
+        output = StringIO()
+        call_command('recount', batch_size=1, stdout=output)
+        self.assertIn("Repaired 4 counters", output.getvalue())
+        self.assertEqual((self.counts(first), self.counts(second)), ((1, 1), (0, 0)))
+        self.assertEqual(list(models.ReactionSummary.objects.values_list('count', flat=True)), [1])
+        self.assertEqual(models.TagCount.objects.get().count, 2)
+        self.assertEqual(models.Category.objects.get().confession_count, 2)
+        output = StringIO()
+        call_command('recount', stdout=output)
+        self.assertIn("up to date", output.getvalue())
+
+
+class TrendingTest(ConfessionTestCase):
+    def test_score_decays_with_age(self):
+        now = timezone.now()
+        fresh = trending.score(now, 2, 0)
+        self.assertGreater(fresh, trending.score(now - timezone.timedelta(days=2), 20, 5))
+        self.assertLess(fresh, trending.score(now - timezone.timedelta(hours=1), 20, 5))
+
+    def test_engagement_updates_the_stored_score(self):
+        self.create_confessions(2, tag_count=0, category_count=0)
+        older, newer = models.Confession.objects.order_by('pk')
+        models.Confession.objects.filter(pk=older.pk).update(created=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(counters.rescore(), 1)
+        self.assertEqual(self.client.get('/confession/entry/?sort_by=trending').json()['results'][0]['id'], newer.pk)
+        session = Session.objects.create(ip_address='10.0.0.1')
+        with self.captureOnCommitCallbacks(execute=True):
+            for emoji in ('\U0001F600', '\U0001F622'):
+                models.Reaction.objects.create(confession=older, sender=session, emoji=emoji)
+        self.assertEqual(self.client.get('/confession/entry/?sort_by=trending').json()['results'][0]['id'], older.pk)
+        self.assertEqual(counters.rescore(), 0)
+        output = StringIO()
+        call_command('update_trending_scores', stdout=output)
+        self.assertIn("up to date", output.getvalue())
+
+
+class BulkModerationTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(role='admin')
+        self.client.force_login(self.admin)
+        self.create_confessions(6, tag_count=0, category_count=0)
+        self.pks = list(models.Confession.objects.order_by('pk').values_list('pk', flat=True))
+
+    def results(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(result['id'], result['success']) for result in response.json()['results']]
+
+    def test_approve(self):
+        models.Confession.objects.filter(pk=self.pks[0]).update(author=self.admin)
+        ids = self.pks[:3] + [0]
+        self.assertEqual(self.results('/confession/entry/bulk_moderate/', {'ids': ids, 'is_approved': False}),
+                         [(self.pks[0], False), (self.pks[1], True), (self.pks[2], True), (0, False)])
+        self.assertEqual(list(models.Confession.objects.filter(is_approved=False).order_by('pk').values_list('pk', flat=True)), self.pks[1:3])
+
+    def test_delete_in_constant_queries(self):
+        comments = [models.Comment.objects.create(confession_id=pk, text='Comment') for pk in self.pks for _ in range(2)]
+        for comment in comments:
+            models.Reaction.objects.create(comment=comment, emoji='\U0001F600')
+            models.Reaction.objects.create(confession_id=comment.confession_id, emoji='\U0001F600')
+        self.results('/confession/comment/bulk_delete/', {'ids': [0]})
+        with CaptureQueriesContext(connection) as few:
+            self.results('/confession/comment/bulk_delete/', {'ids': [comment.pk for comment in comments[:2]]})
+        with CaptureQueriesContext(connection) as many:
+            self.results('/confession/comment/bulk_delete/', {'ids': [comment.pk for comment in comments[2:]]})
+        self.assertEqual(len(few), len(many))
+        self.results('/confession/reaction/bulk_delete/', {'ids': list(models.Reaction.objects.values_list('pk', flat=True)[:5])})
+        self.assertEqual(counters.recount(), 0)
+        self.assertEqual(sum(models.ReactionSummary.objects.values_list('count', flat=True)), models.Reaction.objects.count())
+        self.assertEqual(models.Confession.objects.get(pk=self.pks[0]).comment_count, 0)
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, CACHES={
+    **settings.CACHES, 'instrumentation': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'instrumentation'}
+})
+class InstrumentationTest(ConfessionTestCase):
+    def test_report(self):
+        collector.reset()
+        self.create_confessions(3)
+        self.client.force_login(User.objects.create(role='admin'))
+        for _ in range(2):
+            self.client.get('/confession/entry/')
+        routes = {route['route']: route for route in self.client.get('/instrumentation/').json()['results']}
+        feed = routes['GET entry-list']
+        self.assertEqual(feed['count'], 2)
+        self.assertEqual(feed['queries']['p50'], self.count_list_queries())
+        self.assertGreater(feed['serialization_ms']['max'], 0)
+        self.assertGreaterEqual(feed['wall_ms']['p50'], feed['sql_ms']['p50'])
+
+    async def test_async_requests_are_published_with_a_ttl(self):
+        await sync_to_async(collector.reset)()
+        await sync_to_async(self.create_confessions)(1)
+        response = await self.async_client.get('/confession/entry/')
+        self.assertEqual(response.status_code, 200)
+        routes = {route['route']: route for route in await sync_to_async(collector.report)()}
+        self.assertGreater(routes['GET entry-list']['serialization_ms']['max'], 0)
+        key = 'instrumentation:worker:%d' % collector.slot
+        self.assertIn('GET entry-list', collector.cache.get(key)['routes'])
+        expiry = time.time() + SNAPSHOT_TTL_INTERVALS * settings.INSTRUMENTATION_FLUSH_INTERVAL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=expiry):
+            self.assertIsNone(collector.cache.get(key))
+
+    def test_representation_is_timed(self):
+        self.create_confessions(2)
+        metrics, token, _ = instrumentation._start()
+        try:
+            serializers.ConfessionSerializer(models.Confession.objects.all(), many=True).data
+            serialization_time = metrics.serialization_time
+            views.ConfessionViewSet.row_serializer.to_representation(
+                views.ConfessionViewSet.row_serializer.values(models.Confession.objects.all(), 'anonymous'), 'anonymous')
+        finally:
+            instrumentation._current.reset(token)
+        self.assertGreater(serialization_time, 0)
+        self.assertGreater(metrics.serialization_time, serialization_time)
+        self.assertFalse(metrics.serializing)
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        for percent in (50, 95, 99):
+            self.assertAlmostEqual(histogram.percentile(percent), percent, delta=percent * (Histogram.growth - 1))
+
+
+class GenerateDataTest(ConfessionTestCase):
+    def test_generated_data_is_consistent_and_benchmarkable(self):
+        call_command('generate_data', users=20, anonymous_sessions=10, confessions=50, comments=200, reactions=300,
+                     reports=30, messages=100, tags=10, categories=3, stdout=StringIO())
+        self.assertEqual(models.Confession.objects.count(), 50)
+        self.assertEqual(counters.recount(), 0)
+        comment_count = models.Comment.objects.count()
+        output = StringIO()
+        call_command('benchmark_api', iterations=2, stdout=output)
+        self.assertIn('report vote', output.getvalue())
+        output = StringIO()
+        call_command('benchmark_serialization', iterations=2, roles=['anonymous', 'moderator'], stdout=output)
+        self.assertIn('confession as moderator', output.getvalue())
+        self.assertEqual(models.Comment.objects.count(), comment_count)
+
+
+class CommentPollTest(ConfessionTestCase):
+    def comment_and_commit(self, confession, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Comment.objects.create(confession=confession, text=text)
+
+    async def test_wakes_up_on_new_comment(self):
+        await sync_to_async(self.create_confessions)(2, tag_count=0, category_count=0)
+        first, second = await sync_to_async(list)(models.Confession.objects.order_by('pk'))
+        params = {'confession': first.pk, 'since': timezone.now().isoformat(), 'timeout': 5}
+        poll = asyncio.ensure_future(self.async_client.get('/confession/comment/poll/', params))
+        await asyncio.sleep(0.2)
+        await sync_to_async(self.comment_and_commit)(second, 'Elsewhere')
+        self.assertFalse(poll.done())
+        await sync_to_async(self.comment_and_commit)(first, 'First!')
+        response = await asyncio.wait_for(poll, 1)
+        self.assertEqual([comment['text'] for comment in response.json()['results']], ['First!'])
+
+
+class AsyncUrls:
+    urlpatterns = [path('confession/', include(async_routes(urls.sync_urlpatterns, urls.ASYNC_ROUTES)))]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncReadViewTest(ConfessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_confessions(3)
+        self.confession = models.Confession.objects.first()
+        self.session = Session.objects.create(ip_address='10.0.0.1')
+        models.Comment.objects.create(confession=self.confession, sender=self.session, text='Hello')
+        models.Reaction.objects.create(confession=self.confession, sender=self.session, emoji='\U0001F600')
+
+    async def test_cached_feed_page_skips_the_view(self):
+        response = await self.async_client.get('/confession/entry/')
+        self.assertEqual(len(response.json()['results']), 3)
+        with mock.patch.object(views.ConfessionViewSet, 'list', side_effect=AssertionError("Not served from the cache")):
+            cached = await self.async_client.get('/confession/entry/')
+            self.assertEqual(cached.json(), response.json())
+            self.assertEqual(cached['ETag'], response['ETag'])
+            self.assertEqual((await self.async_client.get('/confession/entry/', **{'If-None-Match': cached['ETag']})).status_code, 304)
+            # Rendered by the view for a browser (AsyncClient takes header names, rather than META keys)
+            with self.assertRaises(AssertionError):
+                await self.async_client.get('/confession/entry/', **{'Accept': 'text/html'})
+
+    async def test_matches_the_sync_views(self):
+        await sync_to_async(self.async_client.force_login)(await sync_to_async(User.objects.create)(role='admin'))
+        for url in ('/confession/entry/%d/' % self.confession.pk, '/confession/comment/?confession=%d' % self.confession.pk,
+                    '/confession/reaction/summary/?confessions=%d' % self.confession.pk, '/confession/entry/?sort_by=trending'):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                with override_settings(ROOT_URLCONF='djangoProject.urls'):
+                    self.client.cookies = self.async_client.cookies
+                    expected = await sync_to_async(self.client.get)(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_session_is_attached_on_first_use(self):
+        user = await sync_to_async(User.objects.create)()
+        await sync_to_async(self.async_client.force_login)(user)
+        response = await self.async_client.get('/confession/comment/', {'confession': self.confession.pk})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post('/confession/comment/', {
+            'confession': self.confession.pk, 'text': 'Async', 'recaptcha': 'token'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        session = await sync_to_async(Session.objects.get)(ip_address='127.0.0.1')
+        self.assertEqual(session.user_id, user.pk)
+
+
+@skipUnless(connection.vendor == 'sqlite', "The replica is a copy of the SQLite file")
+@override_settings(DATABASE_REPLICAS=['replica'], READ_YOUR_WRITES_WINDOW=10, FEED_CACHE_PAGES=0)
+class ReplicaRoutingTest(ClearCachesMixin, TransactionTestCase):
+    """
+    A second SQLite file stands in for the replica, which only gets the writes when replicate_sqlite() copies the
+    primary over it, so that the lag between two copies is up to the test
+    """
+    def setUp(self):
+        super().setUp()
+        self.replica_path = settings.BASE_DIR / 'test_db_replica.sqlite3'
+        connections.settings['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.replica_path}
+        self.author = User.objects.create()
+        self.client.force_login(self.author)
+        models.Confession.objects.create(title='Approved', text='x' * 200, is_approved=True)
+        replicate_sqlite('default', 'replica')
+
+    def tearDown(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        self.replica_path.unlink(missing_ok=True)
+
+    def own_titles(self):
+        response = self.client.get('/confession/entry/', {'own': 1})
+        self.assertEqual(response.status_code, 200)
+        return [confession['title'] for confession in response.json()['results']], response
+
+    def test_author_reads_their_writes(self):
+        response = self.client.post('/confession/entry/', {'title': 'Pending', 'text': 'y' * 200, 'tags': ['a'],
+                                                            'recaptcha': 'token'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.own_titles()[0], ['Pending'])
+
+        # Past the window, the replica lags behind
+        del self.client.cookies[PIN_COOKIE]
+        titles, response = self.own_titles()
+        self.assertEqual(titles, [])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        replicate_sqlite('default', 'replica')
+        self.assertEqual(self.own_titles()[0], ['Pending'])
+
+    def test_reads_outside_safe_requests_use_the_primary(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(models.Confession), 'default')
+        response = self.client.get('/confession/entry/')
+        self.assertEqual([confession['title'] for confession in response.json()['results']], ['Approved'])
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(models.Confession), 'default')
+
+    @override_settings(FEED_CACHE_PAGES=1)
+    def test_cached_feed_is_built_from_the_primary(self):
+        self.client.logout()
+        Session.objects.create(ip_address='127.0.0.1')
+        replicate_sqlite('default', 'replica')
+        models.Confession.objects.create(title='Unreplicated', text='x' * 200, is_approved=True)
+        response = self.client.get('/confession/entry/')
+        self.assertEqual([confession['title'] for confession in response.json()['results']], ['Unreplicated', 'Approved'])
+
+    def test_existing_session_is_read_without_pinning(self):
+        self.client.logout()
+        Session.objects.create(ip_address='127.0.0.1')
+        replicate_sqlite('default', 'replica')
+        with mock.patch.object(db_router, '_finish', wraps=db_router._finish) as finish:
+            response = self.client.get('/confession/entry/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(finish.call_args.args[1].wrote)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    def test_feed(self):
+        approved = models.Confession.objects.filter(is_approved=True)
+        for ordering in (('-pk',), ('-reaction_count', '-comment_count', '-pk'), ('-comment_count', '-pk'),
+                         ('-trending_score', '-pk')):
+            self.assertUsesIndex(approved.order_by(*ordering)[:11])
+        self.assertUsesIndex(approved.filter(pk__lt=100).order_by('-pk')[:11])
+        self.assertUsesIndex(models.Confession.objects.filter(Q(author=1) | Q(is_approved=True))
+                             .order_by('-reaction_count', '-comment_count', '-pk')[:11])
+
+    def test_top_tags(self):
+        self.assertUsesIndex(models.TagCount.objects.filter(count__gt=0).order_by('-count', 'key')[:20])
+
+    def test_recent_confessions_of_author(self):
+        self.assertUsesIndex(models.Confession.objects.filter(author=1, created__gte=timezone.now()).order_by())
+
+    def test_comments_of_confession(self):
+        self.assertUsesIndex(models.Comment.objects.filter(confession=1).order_by('-created')[:21])
+
+    def test_recent_comments_and_reactions_of_sender(self):
+        for model in (models.Comment, models.Reaction):
+            self.assertUsesIndex(model.objects.filter(sender=1, created__gte=timezone.now()))
+
+    def test_reactions_of_confession_by_emoji(self):
+        self.assertUsesIndex(models.Reaction.objects.filter(confession=1, emoji='\U0001F600'))
@@ -0,0 +1,17 @@
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+# Any fixed point in time, scores only matter relative to each other
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def score(created, reaction_count, comment_count):
+    """
+    Trending score of a confession: log(1 + engagement) + age / decay. Ordering by it is the same as ordering by the
+    engagement decayed by a factor of e every TRENDING_DECAY seconds of age, yet it's fixed for a given engagement, so
+    the stored scores only change on engagement events rather than with the passing time.
+    """
+    engagement = reaction_count + getattr(settings, 'TRENDING_COMMENT_WEIGHT', 2) * comment_count
+    return math.log1p(engagement) + (created - EPOCH).total_seconds() / getattr(settings, 'TRENDING_DECAY', 12 * 60 * 60)
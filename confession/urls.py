@@ -1,6 +1,9 @@
-# from django.urls import path
+from django.conf import settings
+from django.urls import path
 from rest_framework import routers
-from . import views
+
+from djangoProject.async_views import async_routes
+from . import views, feed
 
 router = routers.DefaultRouter()
 router.register(r'category', views.CategoryViewSet, basename='category')
@@ -8,4 +11,17 @@ router.register(r'entry', views.ConfessionViewSet, basename='entry')
 router.register(r'comment', views.CommentViewSet, basename='comment')
 router.register(r'reaction', views.ReactionViewSet, basename='reaction')
 
-urlpatterns = router.urls
+# Read paths served by async views under ASGI (see ASYNC_READ_VIEWS), with their fast paths
+ASYNC_ROUTES = {
+    'entry-list': feed.get_cached_response,
+    'entry-detail': None,
+    'comment-list': None,
+    'reaction-summary': None,
+}
+
+sync_urlpatterns = [
+    path('comment/poll/', views.comment_poll, name='comment-poll'),
+    path('tag/', views.TagCloudView.as_view(), name='tag-cloud'),
+] + router.urls
+
+urlpatterns = async_routes(sync_urlpatterns, ASYNC_ROUTES) if getattr(settings, 'ASYNC_READ_VIEWS', False) else sync_urlpatterns
@@ -1,16 +1,23 @@
-from django.utils import timezone
-from django.contrib.auth import login
-from django.db.models import Q, Count, Case, When
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Q
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from rest_framework import generics, viewsets, status
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter
 
-from djangoProject.common import is_string_truthy, get_current_session, IsAdminOrReadOnly, DefaultCursorPagination
-from member.models import User
-from . import serializers, permissions, models, filters
+from djangoProject import pubsub
+from djangoProject.common import is_string_truthy, get_current_session, IsAdminOrReadOnly, IsAdmin, IsStaff, DefaultCursorPagination, \
+    FeedPagination, BulkSerializer, bulk_response, save_with_current_session
+from djangoProject.ratelimit import ActionRateLimitMixin, RateLimit
+from djangoProject.row_serializer import RowSerializer, RowListMixin
+from djangoProject.taggit_serializer import tag_name_loader
+from member.identity import provision_anonymous_user
+from . import serializers, permissions, models, filters, counters, feed
 
 
 @extend_schema(responses=serializers.CategorySerializer)
@@ -20,6 +27,31 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = models.Category.objects.all()
 
 
+class TagCloudView(APIView):
+    """
+    The most used tags and categories with their approved confession counts, only the ones starting with `prefix` when
+    given (for autocompletion). Served from the counts maintained by confession.counters, so the cost doesn't grow with
+    the number of confessions.
+    """
+    @extend_schema(parameters=[serializers.TagCloudQuerySerializer], responses=serializers.TagCloudSerializer)
+    def get(self, request):
+        query = serializers.TagCloudQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        prefix, limit = query.validated_data.get('prefix', ''), query.validated_data['limit']
+        tags = models.TagCount.objects.filter(count__gt=0)
+        categories = models.Category.objects.filter(confession_count__gt=0)
+        if prefix:
+            # A range of the lowercase names, which unlike LIKE can use an index on every backend
+            key = prefix.lower()
+            tags = tags.filter(key__gte=key, key__lt=key[:-1] + chr(ord(key[-1]) + 1))
+            categories = categories.filter(name__istartswith=prefix)
+        return Response(serializers.TagCloudSerializer({
+            'tags': tags.order_by('-count', 'key')[:limit],
+            'categories': [{'name': category.name, 'count': category.confession_count}
+                           for category in categories.order_by('-confession_count', 'name')[:limit]],
+        }).data)
+
+
 OWN_QUERY_PARAM_DEFINITION = dict(list=extend_schema(
     parameters=[
         OpenApiParameter('own', OpenApiTypes.BOOL, OpenApiParameter.QUERY),
@@ -27,34 +59,69 @@ OWN_QUERY_PARAM_DEFINITION = dict(list=extend_schema(
 ))
 @extend_schema_view(**OWN_QUERY_PARAM_DEFINITION)
 @extend_schema(responses=serializers.ConfessionSerializer)
-class ConfessionViewSet(viewsets.ModelViewSet):
+class ConfessionViewSet(ActionRateLimitMixin, RowListMixin, viewsets.ModelViewSet):
     serializer_class = serializers.ConfessionSerializer
+    row_serializer = RowSerializer(serializers.ConfessionSerializer, {
+        'tags': tag_name_loader(models.Confession), 'categories': serializers.load_category_names})
     permission_classes = (permissions.ConfessionPermission,)
-    queryset = models.Confession.objects.all().annotate(comment_count=Count('comment'), reaction_count=Count('reaction')).order_by('-pk')
-    filter_backends = (DjangoFilterBackend, SearchFilter)
+    pagination_class = FeedPagination
+    queryset = models.Confession.objects.all().prefetch_related('categories', 'tags').order_by('-pk')
+    filter_backends = (DjangoFilterBackend, filters.ConfessionSearchFilter)
     search_fields = ('title', 'text', 'tags__name', 'categories__name')
     filterset_class = filters.ConfessionFilter
+    action_rate_limits = {'create': RateLimit(1, 24 * 60 * 60, "You already made one confession in the last day.")}
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
             if is_string_truthy(self.request.query_params.get('own', False)):
                 self.queryset = self.queryset.filter(author=self.request.user)
             if self.request.user.role not in ['admin', 'moderator']:
-                self.queryset = self.queryset.filter(Q(author=self.request.user) | Q(is_approved=True)).order_by('is_approved')
+                self.queryset = self.queryset.filter(Q(author=self.request.user) | Q(is_approved=True)).order_by('is_approved', '-pk')
         else:
             self.queryset = self.queryset.filter(is_approved=True)
         return self.queryset
 
+    def list(self, request, *args, **kwargs):
+        params = feed.get_cache_params(request)
+        if params is None:
+            return super().list(request, *args, **kwargs)
+        entry = feed.get_page(request, *params, lambda: super(ConfessionViewSet, self).list(request, *args, **kwargs).data)
+        return feed.conditional_response(request, entry, Response(entry['data']))
+
     def perform_create(self, serializer):
-        if not self.request.user.is_authenticated:
-            user = User.objects.create()
-            login(self.request, User.objects.create(last_login=timezone.now()))
-            session = get_current_session(self.request)
-            session.user = user
-            session.save()
-        elif models.Confession.objects.filter(author=self.request.user, created__gte=timezone.now() - timezone.timedelta(days=1)).exists():
-            return Response({"error": "You already made one confession in the last day."}, status=status.HTTP_403_FORBIDDEN)
-        serializer.save()
+        with transaction.atomic():
+            if not self.request.user.is_authenticated:
+                provision_anonymous_user(self.request)
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        # The cascade would otherwise update the counters of the confession once per comment and reaction
+        with transaction.atomic(), counters.deferred([instance.pk]):
+            instance.delete()
+
+    @extend_schema(request=serializers.BulkModerationSerializer, responses=OpenApiTypes.OBJECT)
+    @action(methods=['POST'], detail=False, permission_classes=(IsStaff,))
+    def bulk_moderate(self, request):
+        serializer = serializers.BulkModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        with transaction.atomic():
+            authors = dict(models.Confession.objects.filter(pk__in=ids).values_list('pk', 'author_id'))
+            errors = {}
+            for pk in ids:
+                if pk not in authors:
+                    errors[pk] = "Not found."
+                elif authors[pk] == request.user.pk:
+                    errors[pk] = "You can't moderate your own confession."
+            moderated = [pk for pk in ids if pk not in errors]
+            is_approved = serializer.validated_data['is_approved']
+            flipped = list(models.Confession.objects.filter(pk__in=moderated).exclude(is_approved=is_approved)
+                           .select_for_update().values_list('pk', flat=True))
+            models.Confession.objects.filter(pk__in=moderated).update(is_approved=is_approved)
+            counters.adjust_term_counts(flipped, 1 if is_approved else -1)
+            # The update sends no signals
+            feed.confessions_changed(moderated)
+        return bulk_response(ids, errors)
 
 
 class BaseCommentReactionView(generics.GenericAPIView):
@@ -72,43 +139,110 @@ class BaseCommentReactionView(generics.GenericAPIView):
             return self.queryset.filter(sender=get_current_session(self.request))
         return self.queryset
 
+    def perform_create(self, serializer):
+        save_with_current_session(self.request, lambda session: serializer.save(sender=session))
+
+    # Fields holding the confession a row counts towards, of which the first one set is taken
+    confession_fields = ('confession_id',)
+
+    def get_affected_confessions(self, queryset):
+        return {next(pk for pk in row if pk is not None) for row in queryset.values_list(*self.confession_fields)}
+
+    @extend_schema(request=BulkSerializer, responses=OpenApiTypes.OBJECT)
+    @action(methods=['POST'], detail=False, permission_classes=(IsAdmin,), filter_backends=())
+    def bulk_delete(self, request):
+        serializer = BulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        queryset = self.queryset.model.objects.filter(pk__in=ids)
+        with transaction.atomic():
+            confession_ids = self.get_affected_confessions(queryset)
+            found = set(queryset.values_list('pk', flat=True))
+            with counters.deferred(confession_ids):
+                queryset.delete()
+        return bulk_response(ids, {pk: "Not found." for pk in ids if pk not in found})
+
 
 @extend_schema_view(**OWN_QUERY_PARAM_DEFINITION)
 @extend_schema(responses=serializers.CommentSerializer)
-class CommentViewSet(BaseCommentReactionView, generics.ListCreateAPIView, generics.RetrieveDestroyAPIView, viewsets.GenericViewSet):
+class CommentViewSet(ActionRateLimitMixin, RowListMixin, BaseCommentReactionView, generics.ListCreateAPIView, generics.RetrieveDestroyAPIView, viewsets.GenericViewSet):
     serializer_class = serializers.CommentSerializer
+    row_serializer = RowSerializer(serializers.CommentSerializer)
     permission_classes = (permissions.CommentReactionPermission,)
     pagination_class = DefaultCursorPagination
     queryset = models.Comment.objects.all()
     filterset_fields = ('confession',)
-
-    def perform_create(self, serializer):
-        if models.Comment.objects.filter(sender=get_current_session(self.request), created__gte=timezone.now() - timezone.timedelta(hours=1)).count() == 3:
-            return Response({"error": "You already gave three comments in the last hour."}, status=status.HTTP_403_FORBIDDEN)
-        serializer.save()
+    action_rate_limits = {'create': RateLimit(3, 60 * 60, "You already gave three comments in the last hour.")}
 
 
 @extend_schema_view(**OWN_QUERY_PARAM_DEFINITION)
 @extend_schema(responses=serializers.ReactionSerializer)
-class ReactionViewSet(BaseCommentReactionView, generics.ListCreateAPIView, generics.RetrieveDestroyAPIView, viewsets.GenericViewSet):
+class ReactionViewSet(ActionRateLimitMixin, RowListMixin, BaseCommentReactionView, generics.ListCreateAPIView, generics.RetrieveDestroyAPIView, viewsets.GenericViewSet):
     serializer_class = serializers.ReactionSerializer
+    row_serializer = RowSerializer(serializers.ReactionSerializer)
     permission_classes = (permissions.CommentReactionPermission,)
     queryset = models.Reaction.objects.all()
     filterset_fields = ('confession', 'comment')
+    action_rate_limits = {'create': RateLimit(3, 60 * 60, "You already gave three reactions in the last hour.")}
+
+    confession_fields = ('confession_id', 'comment__confession_id')
+
+    _summary_id_limit = 100
 
     def list(self, request, *args, **kwargs):
         if self.check_is_own():
             return super().list(request, *args, **kwargs)
         if not request.query_params.get('confession', None) and not request.query_params.get('comment', None):
             return Response({"error": "You must specify either of the filters in query."}, status=status.HTTP_400_BAD_REQUEST)
-        queryset = self.filter_queryset(self.get_queryset())
-        extra_annotate = {}
+        summaries = list(self.filter_queryset(models.ReactionSummary.objects.order_by('emoji')).values('emoji', 'count'))
         if request.user.is_authenticated:
-            extra_annotate['is_author'] = Case(When(sender=get_current_session(request), then=True), default=False)
-        return Response({"results": queryset.values('emoji').annotate(count=Count('emoji'), **extra_annotate)})
-
-    def perform_create(self, serializer):
-        if models.Reaction.objects.filter(sender=get_current_session(self.request), created__gte=timezone.now() - timezone.timedelta(hours=1)).count() == 3:
-            return Response({"error": "You already gave three reactions in the last hour."}, status=status.HTTP_403_FORBIDDEN)
-        serializer.save()
-
+            own_emojis = set(self.filter_queryset(self.get_queryset()).filter(sender=get_current_session(request))
+                             .values_list('emoji', flat=True))
+            for summary in summaries:
+                summary['is_author'] = summary['emoji'] in own_emojis
+        return Response({"results": summaries})
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('confessions', OpenApiTypes.STR, OpenApiParameter.QUERY, description="Comma separated confession ids"),
+            OpenApiParameter('comments', OpenApiTypes.STR, OpenApiParameter.QUERY, description="Comma separated comment ids"),
+        ],
+        responses=OpenApiTypes.OBJECT
+    )
+    @action(methods=['GET'], detail=False, filter_backends=())
+    def summary(self, request):
+        for target in ('confession', 'comment'):
+            pks = request.query_params.get(target + 's', None)
+            if pks:
+                break
+        else:
+            return Response({"error": "You must specify either confessions or comments in query."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            pks = {int(pk) for pk in pks.split(',')}
+        except ValueError:
+            return Response({"error": "Ids must be comma separated integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(pks) > self._summary_id_limit:
+            return Response({"error": "At most %d ids can be given." % self._summary_id_limit}, status=status.HTTP_400_BAD_REQUEST)
+        results = {pk: [] for pk in pks}
+        for pk, emoji, count in models.ReactionSummary.objects.filter(**{target + '__in': pks})\
+                .order_by(target, 'emoji').values_list(target + '_id', 'emoji', 'count'):
+            results[pk].append({"emoji": emoji, "count": count})
+        return Response({"results": results})
+
+
+async def comment_poll(request):
+    """
+    Long-polls for the comments of `confession` created after `since`, answering as soon as there are any, or with an
+    empty result after `timeout` seconds
+    """
+    filterset = filters.CommentPollFilter(request.GET, models.Comment.objects.all())
+    if not filterset.is_valid():
+        return JsonResponse(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+    queryset = filterset.qs.order_by('created', 'pk')[:pubsub.POLL_RESULT_LIMIT]
+    await sync_to_async(lambda: request.user.is_authenticated)()
+
+    def fetch():
+        return serializers.CommentSerializer(queryset.all(), many=True, context={'request': request}).data
+    channel = 'comment:%d' % filterset.form.cleaned_data['confession']
+    results = await pubsub.long_poll([channel], fetch, pubsub.get_timeout(request))
+    return JsonResponse({"results": results})
@@ -0,0 +1,43 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.urls import URLPattern
+
+
+def as_async_view(view, fast_path=None):
+    """
+    Async variant of a synchronous (e.g. DRF) view for ASGI deployments. Django 4.0 has no async ORM, so the view still
+    runs in a thread, but together with the rendering of its response in a single sync_to_async call, where Django would
+    make a call for each. `fast_path` is an optional coroutine function taking the arguments of the view, which may
+    answer without any sync call by returning a response instead of None.
+    """
+    def run(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response = response.render()
+        return response
+    run = sync_to_async(run)
+
+    # Keeps the attributes of the view, such as csrf_exempt and the view class which the schema generator reads
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if fast_path is not None:
+            response = await fast_path(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await run(request, *args, **kwargs)
+    return async_view
+
+
+def async_routes(patterns, fast_paths):
+    """
+    The URL patterns with the synchronous views of the names in `fast_paths` (name -> fast path or None) made async
+    with as_async_view
+    """
+    return [
+        URLPattern(pattern.pattern, as_async_view(pattern.callback, fast_paths[pattern.name]), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in fast_paths and not asyncio.iscoroutinefunction(pattern.callback)
+        else pattern
+        for pattern in patterns
+    ]
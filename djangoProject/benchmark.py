@@ -0,0 +1,55 @@
+import math
+import time
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize(durations, total_time=None):
+    """
+    Throughput and latency percentiles (in milliseconds) of a list of durations in seconds
+    """
+    durations = sorted(durations)
+    if not durations:
+        return {'count': 0, 'throughput': None, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    total_time = total_time if total_time is not None else sum(durations)
+    return {
+        'count': len(durations),
+        'throughput': len(durations) / total_time if total_time else None,
+        'mean_ms': sum(durations) / len(durations) * 1000,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+    }
+
+
+def measure(function, iterations, warmup=1, setup=None):
+    """
+    Calls the function `iterations` times (after `warmup` untimed calls) and summarizes the durations of the calls. The
+    optional `setup` is called before each call, its result is passed to the function and its time isn't counted.
+    """
+    def call():
+        return function(setup()) if setup else function()
+    for _ in range(warmup):
+        call()
+    durations = []
+    for _ in range(iterations):
+        argument = setup() if setup else None
+        call_started = time.perf_counter()
+        function(argument) if setup else function()
+        durations.append(time.perf_counter() - call_started)
+    return summarize(durations)
+
+
+def format_summary(name, summary):
+    if not summary['count']:
+        return '%s: no samples' % name
+    return '%s: %d calls, %.1f/s, mean %.2f ms, p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' % (
+        name, summary['count'], summary['throughput'] or 0, summary['mean_ms'], summary['p50_ms'], summary['p95_ms'],
+        summary['p99_ms'])
@@ -1,12 +1,21 @@
 import re
-from django.utils import timezone
+import json
+from datetime import datetime
+from functools import cmp_to_key
+from django.db import IntegrityError, models, router, transaction
 from django.db.models import Q
+from django.db.models.signals import m2m_changed
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import BasePermission as RestFrameworkBasePermission, SAFE_METHODS
 from rest_framework.viewsets import ViewSet
-from rest_framework.pagination import CursorPagination
-from rest_framework.serializers import ModelSerializer, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination, Cursor
+from rest_framework.settings import api_settings
+from rest_framework.response import Response
+from rest_framework.serializers import ModelSerializer, Serializer, ListField, IntegerField, ValidationError
 
-from member.models import Session, Blocklist
+from member.cache import blocklist_index, invalidate_sessions
+from member.middleware import attach_ip_session
+from member.models import Session
 
 
 EMOJI_PATTERN = re.compile(
@@ -43,18 +52,42 @@ class PermissionsPerMethodMixin(ViewSet):
 
 
 def get_current_session(request):
-    return Session.objects.get(ip_address=request.META['REMOTE_ADDR'])
+    """
+    Returns the Session resolved by ip_session_middleware for this request, attaching it on the first use when the
+    middleware left it to the view (under ASGI)
+    """
+    session = getattr(request, 'ip_session', None)
+    if session is None:
+        attach_ip_session(request)
+        session = request.ip_session
+    return session
+
+
+def save_with_current_session(request, save):
+    """
+    Calls `save` with the current Session, in a transaction of its own. A session cached by this process may have been
+    deleted since (by the cleanup command of another process), which the rows referencing it fail the foreign key check
+    on, in which case the session is resolved again and `save` repeated.
+    """
+    session = get_current_session(request)
+    try:
+        with transaction.atomic():
+            return save(session)
+    except IntegrityError:
+        if Session.objects.filter(pk=session.pk).exists():
+            raise
+    invalidate_sessions(session.ip_address)
+    attach_ip_session(request)
+    with transaction.atomic():
+        return save(request.ip_session)
 
 
 class BasePermission(RestFrameworkBasePermission):
     def has_permission(self, request, view):
         if not getattr(self, 'no_safe_methods', None) and request.method in SAFE_METHODS:
             return True
-        expires_query = Q(expires=None) | Q(expires__gt=timezone.now())
-        session_query = Q(session=get_current_session(request))
-        if request.user.is_authenticated:
-            session_query |= Q(user=request.user)
-        return not Blocklist.objects.filter(expires_query, session_query).exists()
+        return not blocklist_index.is_blocked(get_current_session(request).pk,
+                                              request.user.pk if request.user.is_authenticated else None)
 
 
 class IsAdminOrReadOnly(BasePermission):
@@ -85,6 +118,153 @@ class DefaultCursorPagination(CursorPagination):
     page_size = 20
 
 
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the ordering already applied to the queryset (e.g. by an ordering filter), with the primary
+    key appended as a tie-breaker. The cursor holds the ordering values of the boundary row, so every page is a single
+    range query which an index on the ordering columns can serve, no matter how deep the page is. Ordering fields must
+    be non-nullable.
+
+    A list of disjoint querysets with the same ordering may be passed instead of one, in which case each is paginated
+    on its own and the pages are merged, so that an OR of several index ranges can be served without a sort.
+    """
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_keyset_ordering(querysets[0])
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor.reverse if self.cursor else False
+        ordering = [(field, descending != reverse) for field, descending in self.ordering]
+
+        results = []
+        for queryset in querysets:
+            if self.cursor:
+                queryset = queryset.filter(self._get_keyset_query(ordering, self.cursor.position))
+            queryset = queryset.order_by(*[('-' if descending else '') + field for field, descending in ordering])
+            results += queryset[:self.page_size + 1]
+        if len(querysets) > 1:
+            results = sorted(results, key=cmp_to_key(lambda a, b: self._compare(a, b, ordering)))[:self.page_size + 1]
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    @staticmethod
+    def get_keyset_ordering(queryset):
+        ordering = []
+        pk_name = queryset.model._meta.pk.name
+        for field in queryset.query.order_by or queryset.model._meta.ordering:
+            field = field.lstrip('+')
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            if field == pk_name:
+                field = 'pk'
+            ordering.append((field, descending))
+            if field == 'pk':
+                return ordering
+        return ordering + [('pk', True)]
+
+    @staticmethod
+    def _compare(a, b, ordering):
+        for field, descending in ordering:
+            x, y = getattr(a, field), getattr(b, field)
+            if x != y:
+                return (-1 if x < y else 1) * (-1 if descending else 1)
+        return 0
+
+    @staticmethod
+    def _get_keyset_query(ordering, position):
+        # a <= x AND (a < x OR (b <= y AND (b < y OR ...))): the outer bound of each level is an index range
+        (field, descending), value = ordering[-1], position[-1]
+        query = Q(**{'%s__%s' % (field, 'lt' if descending else 'gt'): value})
+        for (field, descending), value in zip(reversed(ordering[:-1]), reversed(position[:-1])):
+            query = Q(**{'%s__%s' % (field, 'lt' if descending else 'gt'): value}) | query
+            query &= Q(**{'%s__%s' % (field, 'lte' if descending else 'gte'): value})
+        return query
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def encode_cursor(self, cursor):
+        return super().encode_cursor(cursor._replace(position=json.dumps(cursor.position)))
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for field, _ in ordering:
+            if isinstance(instance, dict):
+                value = instance[field] if field in instance else instance['id' if field == 'pk' else field]
+            else:
+                value = getattr(instance, field)
+            position.append(value.isoformat() if isinstance(value, datetime) else value)
+        return position
+
+    def _get_link(self, reverse):
+        item = self.page[0 if reverse else -1] if self.page else None
+        position = self._get_position_from_instance(item, self.ordering) if item is not None else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=position))
+
+    def get_next_link(self):
+        return self._get_link(reverse=False) if self.has_next else None
+
+    def get_previous_link(self):
+        return self._get_link(reverse=True) if self.has_previous else None
+
+
+class FeedPagination(BasePagination):
+    """
+    Keyset pagination, or page number pagination when the `page` query parameter is given
+    """
+    def __init__(self):
+        self.keyset_pagination = KeysetPagination()
+        self.page_number_pagination = PageNumberPagination()
+        self.pagination = self.keyset_pagination
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.pagination, 'display_page_controls', False)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_number_pagination.page_query_param in request.query_params:
+            self.pagination = self.page_number_pagination
+        else:
+            self.pagination = self.keyset_pagination
+        return self.pagination.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.pagination.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.keyset_pagination.get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.pagination.to_html()
+
+    def get_schema_operation_parameters(self, view):
+        return self.keyset_pagination.get_schema_operation_parameters(view) + \
+            [parameter for parameter in self.page_number_pagination.get_schema_operation_parameters(view)
+             if parameter['name'] == self.page_number_pagination.page_query_param]
+
+
 class ConfessionOrCommentInSerializerUnique(ModelSerializer):
     def create(self, validated_data):
         if bool(validated_data.get('confession', False)) == bool(validated_data.get('comment', False)):
@@ -93,3 +273,56 @@ class ConfessionOrCommentInSerializerUnique(ModelSerializer):
             raise ValidationError({"error": self._duplicate_error})
         return super().create(validated_data)
 
+
+class BulkSerializer(Serializer):
+    ids = ListField(child=IntegerField(), min_length=1, max_length=1000)
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+def bulk_response(ids, errors, key='id'):
+    """
+    Per item results of a bulk action in the order of `ids`, where `errors` maps the ids which failed to their reason,
+    each identified under `key`
+    """
+    return Response({"results": [
+        {key: pk, "success": False, "error": errors[pk]} if pk in errors else {key: pk, "success": True} for pk in ids
+    ]})
+
+
+def set_through_rows(instance, through, lookup, target_field, target_ids):
+    """
+    Makes the many-to-many rows of the instance (the rows of the `through` model matching `lookup`) point to exactly
+    the `target_ids`, inserting and deleting only the difference with one query each. Sends the same m2m_changed
+    signals as the related manager would, so that their receivers keep working.
+    """
+    db = router.db_for_write(through, instance=instance)
+    column = through._meta.get_field(target_field).attname
+    rows = through._default_manager.using(db).filter(**lookup)
+    current = set(rows.values_list(column, flat=True))
+    target_model = through._meta.get_field(target_field).related_model
+    changes = (
+        ('remove', current - set(target_ids), lambda pks: rows.filter(**{column + '__in': pks}).delete()),
+        ('add', set(target_ids) - current,
+         lambda pks: through._default_manager.using(db).bulk_create([through(**lookup, **{column: pk}) for pk in pks])),
+    )
+    for action, pks, write in changes:
+        if not pks:
+            continue
+        signal_kwargs = dict(sender=through, instance=instance, reverse=False, model=target_model, pk_set=pks, using=db)
+        m2m_changed.send(action='pre_' + action, **signal_kwargs)
+        write(pks)
+        m2m_changed.send(action='post_' + action, **signal_kwargs)
+
+
+class AtomicSaveModel(models.Model):
+    """
+    Runs save() and its post_save receivers (e.g. the counter updates in confession.signals) in one transaction
+    """
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
@@ -0,0 +1,136 @@
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = 'primary_until'
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def get_pin_window():
+    return getattr(settings, 'READ_YOUR_WRITES_WINDOW', 10)
+
+
+class RoutingState:
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.wrote = False
+
+
+# Mutated rather than set by the router, so that the changes made in the threads of sync_to_async() are seen by the
+# middleware under ASGI too
+_state = ContextVar('db_routing_state', default=None)
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of safe-method requests to the DATABASE_REPLICAS and everything else to the primary (default)
+    database, as reads outside of requests (commands, the workers) may be followed by writes based on them. Reads move
+    to the primary for the rest of the request once it writes, as well as inside transactions, and clients which wrote
+    stay on the primary for READ_YOUR_WRITES_WINDOW seconds (see replica_routing_middleware), so that they see their
+    writes (e.g. an author their unapproved confession) despite the replication lag.
+    """
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = get_replicas()
+        if state is None or not state.use_replicas or not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Rather than None, which would send the reads of related objects to the database of the instance
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.use_replicas = False
+            state.wrote = True
+        # Also for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through the replication
+        return False if db in get_replicas() else None
+
+
+@contextmanager
+def primary_reads():
+    """
+    Sends the reads of the current request to the primary within the block, for results which outlive the request (e.g.
+    cached ones), so that they don't keep the replication lag
+    """
+    state = _state.get()
+    if state is None or not state.use_replicas:
+        yield
+        return
+    state.use_replicas = False
+    try:
+        yield
+    finally:
+        state.use_replicas = not state.wrote
+
+
+def _is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _start(request):
+    state = RoutingState(request.method in SAFE_METHODS and not _is_pinned(request))
+    return state, _state.set(state)
+
+
+def _finish(response, state, token):
+    _state.reset(token)
+    if state.wrote:
+        window = get_pin_window()
+        response.set_cookie(PIN_COOKIE, str(time.time() + window), max_age=window, httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Lets ReplicaRouter send the reads of safe-method requests to the replicas, unless the client wrote within the last
+    READ_YOUR_WRITES_WINDOW seconds, which a cookie set on the responses of writing requests tells. Goes before the
+    middleware which reads the database (sessions, authentication). Removes itself from the chain without replicas.
+    """
+    if not get_replicas():
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = _start(request)
+            return _finish(await get_response(request), state, token)
+    else:
+        def middleware(request):
+            state, token = _start(request)
+            return _finish(get_response(request), state, token)
+    return middleware
+
+
+def replicate_sqlite(source=DEFAULT_DB_ALIAS, target=None):
+    """
+    Copies an SQLite database over another one, which stands in for the replication to a replica locally (see the
+    simulate_replication command), the time between two copies being the replication lag
+    """
+    target = target or get_replicas()[0]
+    for alias in (source, target):
+        connections[alias].ensure_connection()
+    connections[source].connection.backup(connections[target].connection)
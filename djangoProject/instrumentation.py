@@ -0,0 +1,371 @@
+import asyncio
+import copy
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .common import IsAdmin
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTATION_CACHE_ALIAS = 'instrumentation'
+# Cache slots the workers publish their statistics in, which the report reads all of
+WORKER_SLOTS = 64
+# Flush intervals after which the statistics of a worker which stopped publishing them expire
+SNAPSHOT_TTL_INTERVALS = 12
+METRICS = ('queries', 'sql_ms', 'serialization_ms', 'wall_ms')
+DUPLICATE_QUERY_LIMIT = 10
+
+
+class Histogram:
+    """
+    Log-scale histogram, counting values in buckets which grow by `growth`, so that the percentiles are accurate within
+    that factor while the memory use stays constant
+    """
+    growth = 1.1
+
+    def __init__(self, minimum=1):
+        self.minimum = minimum
+        self.buckets = Counter()
+        self.count = 0
+        self.max = 0
+
+    def bucket(self, value):
+        return -1 if value <= 0 else max(0, math.ceil(math.log(value / self.minimum, self.growth)))
+
+    def bucket_value(self, bucket):
+        return 0 if bucket < 0 else min(self.minimum * self.growth ** bucket, self.max)
+
+    def add(self, value):
+        self.buckets[self.bucket(value)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        for bucket in sorted(self.buckets):
+            rank -= self.buckets[bucket]
+            if rank <= 0:
+                return self.bucket_value(bucket)
+
+    def summary(self):
+        return {'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99), 'max': self.max}
+
+
+class CountHistogram(Histogram):
+    """
+    Exact histogram of small integers, such as query counts
+    """
+    def bucket(self, value):
+        return value
+
+    def bucket_value(self, bucket):
+        return bucket
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.duplicate_requests = 0
+        self.duplicate_queries = Counter()
+        self.histograms = {metric: CountHistogram() if metric == 'queries' else Histogram(0.01) for metric in METRICS}
+
+    def add(self, metrics, duplicates):
+        self.count += 1
+        for metric in METRICS:
+            self.histograms[metric].add(metrics[metric])
+        if duplicates:
+            self.duplicate_requests += 1
+            self.duplicate_queries.update(duplicates)
+            # Keep the most frequent ones only
+            self.duplicate_queries = Counter(dict(self.duplicate_queries.most_common(DUPLICATE_QUERY_LIMIT)))
+
+    def merge(self, other):
+        self.count += other.count
+        self.duplicate_requests += other.duplicate_requests
+        self.duplicate_queries = Counter(dict((self.duplicate_queries + other.duplicate_queries).most_common(DUPLICATE_QUERY_LIMIT)))
+        for metric in METRICS:
+            self.histograms[metric].merge(other.histograms[metric])
+
+    def summary(self):
+        return {
+            'count': self.count,
+            **{metric: self.histograms[metric].summary() for metric in METRICS},
+            'duplicate_requests': self.duplicate_requests,
+            'duplicate_queries': [{'sql': sql, 'requests': count} for sql, count in self.duplicate_queries.most_common()],
+        }
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = Counter()
+        self.sql_time = 0
+        self.serialization_time = 0
+        self.serializing = False
+
+
+_current = ContextVar('instrumentation_request_metrics', default=None)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started
+        metrics.queries[(sql, repr(params))] += 1
+
+
+def _install_execute_wrapper(connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Counts the time spent within the block towards the serialization time of the current request, once when nested
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialization_time += time.perf_counter() - started
+        metrics.serializing = False
+
+
+class TimedSerializerMixin:
+    """
+    Serializer mixin counting the time spent turning instances into their representation towards the serialization
+    time of the request
+    """
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+def _flush_interval():
+    return getattr(settings, 'INSTRUMENTATION_FLUSH_INTERVAL', 5)
+
+
+def _slot_key(slot):
+    return 'instrumentation:worker:%d' % slot
+
+
+class Collector:
+    """
+    Statistics of the requests handled by this process, which a background thread periodically publishes to a slot of
+    the `instrumentation` cache, so that the report can merge the ones of all workers
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.installed = False
+        self.slot = None
+        self.flusher_pid = None
+
+    def install(self):
+        """
+        Hooks into the database connections, which is only done when the instrumentation is enabled
+        """
+        with self.lock:
+            if self.installed:
+                return
+            self.installed = True
+        connection_created.connect(_install_execute_wrapper)
+
+    @property
+    def cache(self):
+        return caches[INSTRUMENTATION_CACHE_ALIAS]
+
+    def record(self, route, metrics, duplicates):
+        with self.lock:
+            self.routes.setdefault(route, RouteStats()).add(metrics, duplicates)
+            # Also after a fork, which the thread of the parent doesn't survive
+            start_flusher = self.flusher_pid != os.getpid()
+            if start_flusher:
+                self.flusher_pid = os.getpid()
+                self.slot = None
+        if start_flusher:
+            threading.Thread(target=self.run_flusher, name='instrumentation-flusher', daemon=True).start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(_flush_interval())
+            # Stops with the instrumentation, e.g. when a test disabled it again
+            if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+                with self.lock:
+                    self.flusher_pid = None
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Publishing the instrumentation statistics failed")
+
+    def flush(self):
+        """
+        Publishes the statistics of this process to its slot, claiming a free one first. The snapshot is refreshed on
+        every flush, so that only the ones of gone workers expire.
+        """
+        with self.lock:
+            # Copied, as the requests keep adding to the statistics while the cache pickles them
+            snapshot = {'pid': os.getpid(), 'routes': copy.deepcopy(self.routes)}
+            slot = self.slot
+        timeout = _flush_interval() * SNAPSHOT_TTL_INTERVALS
+        if slot is not None:
+            current = self.cache.get(_slot_key(slot))
+            # Missing after a reset, or taken by another worker after this one stopped flushing for too long
+            if current is None or current['pid'] == snapshot['pid']:
+                self.cache.set(_slot_key(slot), snapshot, timeout)
+                return
+        for slot in range(WORKER_SLOTS):
+            # Atomic on the shared backends, so that no two workers claim the same slot
+            if self.cache.add(_slot_key(slot), snapshot, timeout):
+                with self.lock:
+                    self.slot = slot
+                return
+        logger.warning("All %d instrumentation slots are taken, the statistics of this worker aren't published", WORKER_SLOTS)
+
+    def report(self):
+        """
+        Per route statistics merged from all workers, the slowest (by p95 wall time) first
+        """
+        if self.routes:
+            self.flush()
+        merged = {}
+        for snapshot in self.cache.get_many([_slot_key(slot) for slot in range(WORKER_SLOTS)]).values():
+            for route, stats in snapshot['routes'].items():
+                merged.setdefault(route, RouteStats()).merge(stats)
+        return sorted(({'route': route, **stats.summary()} for route, stats in merged.items()),
+                      key=lambda route: route['wall_ms']['p95'] or 0, reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+        self.cache.delete_many([_slot_key(slot) for slot in range(WORKER_SLOTS)])
+
+
+collector = Collector()
+
+
+def _start():
+    # The connections of each thread (and async context) are separate, and those opened before the installation missed
+    # the signal
+    for connection in connections.all():
+        _install_execute_wrapper(connection)
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics), time.perf_counter()
+
+
+def _finish(request, metrics, token, started):
+    wall_time = time.perf_counter() - started
+    _current.reset(token)
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return
+    duplicates = [sql for (sql, _), count in metrics.queries.items() if count > 1]
+    for sql in duplicates:
+        logger.warning("Duplicate query in %s %s: %s", request.method, request.path, sql)
+    collector.record('%s %s' % (request.method, match.view_name or match.route), {
+        'queries': sum(metrics.queries.values()),
+        'sql_ms': metrics.sql_time * 1000,
+        'serialization_ms': metrics.serialization_time * 1000,
+        'wall_ms': wall_time * 1000,
+    }, duplicates)
+
+
+class InstrumentationMiddleware:
+    """
+    Records the query count, SQL, serialization (see timed_serialization(), plus the rendering of the response data) and
+    wall time of each request per route when INSTRUMENTATION_ENABLED is set, and logs identical queries repeated within
+    a request. When disabled, it removes itself from the chain. A class, as Django only calls the
+    process_template_response hook of those.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed
+        collector.install()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as django.utils.deprecation.MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics, token, started = _start()
+        try:
+            return self.get_response(request)
+        finally:
+            _finish(request, metrics, token, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = _start()
+        try:
+            return await self.get_response(request)
+        finally:
+            _finish(request, metrics, token, started)
+
+    def process_template_response(self, request, response):
+        """
+        Times the rendering of the response data, which the handler does after the view and this hook
+        """
+        metrics = _current.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.serialization_time += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class InstrumentationView(APIView):
+    """
+    Per route percentiles of the query count, SQL, serialization and wall time (in milliseconds) recorded by
+    InstrumentationMiddleware, DELETE resets them
+    """
+    permission_classes = (IsAdmin,)
+
+    @extend_schema(responses=OpenApiTypes.OBJECT)
+    def get(self, request):
+        return Response({"enabled": getattr(settings, 'INSTRUMENTATION_ENABLED', False), "results": collector.report()})
+
+    @extend_schema(responses={status.HTTP_204_NO_CONTENT: None})
+    def delete(self, request):
+        collector.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
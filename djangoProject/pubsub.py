@@ -0,0 +1,189 @@
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+# Results a long-poll response carries at most, the client polls again for the rest
+POLL_RESULT_LIMIT = 100
+
+
+class Hub:
+    """
+    In-process fan-out of events to the coroutines of this worker waiting for them. Events only carry the channel name,
+    waiters are woken up and fetch whatever is new themselves, so a missed or duplicated event costs at most one query.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def subscribe(self, channels):
+        return Subscription(self, channels)
+
+    def _add(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._waiters[channel].add(subscription)
+
+    def _remove(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                waiters = self._waiters.get(channel)
+                if waiters is not None:
+                    waiters.discard(subscription)
+                    if not waiters:
+                        del self._waiters[channel]
+
+    def dispatch(self, channel):
+        """
+        Wakes up the subscribers of the channel, may be called from any thread
+        """
+        with self._lock:
+            subscriptions = list(self._waiters.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._waiters.values()))
+
+
+class Subscription:
+    def __init__(self, hub, channels):
+        self.hub = hub
+        self.channels = tuple(channels)
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def __enter__(self):
+        self.hub._add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hub._remove(self)
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # The loop of the waiting request is already closed
+            pass
+
+    async def wait(self, timeout):
+        """
+        Returns whether an event arrived before the timeout
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+class LocalBroker:
+    """
+    Delivers events to the hub of this process only, which is enough for a single worker
+    """
+    def __init__(self, hub, **options):
+        self.hub = hub
+
+    def publish(self, channel):
+        self.hub.dispatch(channel)
+
+    def start(self):
+        """
+        Called from the event loop before a request starts waiting
+        """
+
+
+class RedisBroker(LocalBroker):
+    """
+    Delivers events to the hubs of all workers through Redis pub/sub, requires the redis package (4.2+)
+    """
+    def __init__(self, hub, url='redis://localhost:6379/0', prefix='pubsub:', **options):
+        super().__init__(hub)
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._listeners = {}
+
+    def publish(self, channel):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.prefix + channel, b'')
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.psubscribe(self.prefix + '*')
+            async for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    self.hub.dispatch(message['channel'].decode()[len(self.prefix):])
+
+
+hub = Hub()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    config = getattr(settings, 'PUBSUB_BROKER', {})
+    return import_string(config.get('BACKEND', 'djangoProject.pubsub.LocalBroker'))(hub, **config.get('OPTIONS', {}))
+
+
+def publish(channel):
+    get_broker().publish(channel)
+
+
+def publish_on_commit(channel, using=None):
+    transaction.on_commit(lambda: publish(channel), using=using)
+
+
+def _fetch(fetch):
+    results = fetch()
+    if not results and not connection.in_atomic_block:
+        # Don't hold on to a database connection while idle
+        connection.close()
+    return results
+
+
+def get_timeout(request):
+    """
+    The `timeout` query parameter of a long-poll request, capped by the LONG_POLL_TIMEOUT setting
+    """
+    maximum = getattr(settings, 'LONG_POLL_TIMEOUT', 25)
+    try:
+        return min(max(float(request.GET.get('timeout', maximum)), 0), maximum)
+    except ValueError:
+        return maximum
+
+
+async def long_poll(channels, fetch, timeout):
+    """
+    Returns the results of `fetch` (a synchronous callable) as soon as they are non-empty, or an empty result once
+    `timeout` seconds pass without any, fetching again only when an event arrives on one of the channels
+    """
+    get_broker().start()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    with hub.subscribe(channels) as subscription:
+        # Subscribed before the first fetch, so that nothing committed in between is missed
+        results = await sync_to_async(_fetch)(fetch)
+        while not results:
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not await subscription.wait(remaining):
+                break
+            results = await sync_to_async(_fetch)(fetch)
+    return results
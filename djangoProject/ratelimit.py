@@ -0,0 +1,172 @@
+import math
+import time
+
+from django.core.cache import caches
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .common import get_current_session
+
+
+RATE_LIMIT_CACHE_ALIAS = 'ratelimit'
+
+
+class SlidingWindowLimiter:
+    """
+    Allows at most `limit` hits per key within any `window` seconds. The window is split into `buckets` counters,
+    so that a check costs one atomic increment and one multi-key read in the cache backend, and is accurate to
+    `window / buckets` seconds. Rejected hits aren't counted.
+    """
+    def __init__(self, limit, window, buckets=10, cache_alias=RATE_LIMIT_CACHE_ALIAS):
+        self.limit = limit
+        self.window = window
+        self.buckets = buckets
+        self.bucket_size = window / buckets
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _bucket_key(self, key, bucket):
+        return 'ratelimit:%s:%d:%d' % (key, self.window, bucket)
+
+    def _increment(self, cache, bucket_key):
+        timeout = math.ceil(self.window + self.bucket_size)
+        cache.add(bucket_key, 0, timeout)
+        try:
+            return cache.incr(bucket_key)
+        except ValueError:
+            # The counter expired between add() and incr()
+            cache.add(bucket_key, 0, timeout)
+            return cache.incr(bucket_key)
+
+    def hit(self, key, now=None):
+        """
+        Records a hit and returns 0 if it's allowed, or else the number of seconds (at least one) until the next hit would be
+        """
+        now = now or time.time()
+        cache = self.cache
+        current_bucket = int(now // self.bucket_size)
+        buckets = range(current_bucket - self.buckets + 1, current_bucket + 1)
+        current_key = self._bucket_key(key, current_bucket)
+        current_count = self._increment(cache, current_key)
+        counts = cache.get_many([self._bucket_key(key, bucket) for bucket in buckets[:-1]])
+        counts = [counts.get(self._bucket_key(key, bucket), 0) for bucket in buckets[:-1]] + [current_count]
+        total = sum(counts)
+        if total <= self.limit:
+            return 0
+
+        cache.decr(current_key)
+        counts[-1] -= 1
+        total -= 1
+        # The oldest buckets leave the window first, wait until enough of them did to allow one more hit
+        for bucket, count in zip(buckets, counts):
+            total -= count
+            if total < self.limit:
+                return max((bucket + self.buckets) * self.bucket_size - now, 1)
+        return self.window
+
+    def record(self, key):
+        """
+        Records a hit without checking the limit
+        """
+        self._increment(self.cache, self._bucket_key(key, int(time.time() // self.bucket_size)))
+
+    def release(self, key, hit_time):
+        """
+        Takes back an allowed hit recorded at `hit_time`, e.g. of a request which failed afterwards
+        """
+        try:
+            self.cache.decr(self._bucket_key(key, int(hit_time // self.bucket_size)))
+        except ValueError:
+            # Already left the window
+            pass
+
+    def reset(self, key):
+        current_bucket = int(time.time() // self.bucket_size)
+        self.cache.delete_many([self._bucket_key(key, bucket)
+                                for bucket in range(current_bucket - self.buckets + 1, current_bucket + 1)])
+
+
+class RateLimit:
+    def __init__(self, limit, window, message=None, **kwargs):
+        self.limiter = SlidingWindowLimiter(limit, window, **kwargs)
+        self.message = message
+
+
+class ActionRateThrottle(BaseThrottle):
+    """
+    Applies the RateLimit declared for the current action in the view's `action_rate_limits`, per user if authenticated
+    or if the IP session is bound to one, and per IP session otherwise. The allowed hit is kept on the view as
+    `rate_limit_hit`, for ActionRateLimitMixin to settle once the response is known.
+    """
+    def __init__(self):
+        self.retry_after = None
+
+    @staticmethod
+    def get_ident(request):
+        if request.user.is_authenticated:
+            return 'user:%d' % request.user.pk
+        session = get_current_session(request)
+        # E.g. the user provisioned by the first confession of the IP address, which keeps its limits after logging out
+        if session.user_id:
+            return 'user:%d' % session.user_id
+        return 'session:%d' % session.pk
+
+    @staticmethod
+    def get_key(view, ident):
+        return '%s:%s:%s' % (type(view).__name__, view.action, ident)
+
+    def allow_request(self, request, view):
+        rate_limit = getattr(view, 'action_rate_limits', {}).get(view.action)
+        if rate_limit is None:
+            return True
+        ident = self.get_ident(request)
+        now = time.time()
+        self.retry_after = rate_limit.limiter.hit(self.get_key(view, ident), now)
+        if self.retry_after:
+            view.throttle_message = rate_limit.message
+            return False
+        view.rate_limit_hit = (rate_limit.limiter, ident, now)
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class ActionRateLimitMixin:
+    """
+    Enforces `action_rate_limits`, a mapping of action names to RateLimit instances, with 429 responses. Only requests
+    which succeed count: the hit of a failed one (e.g. invalid data) is given back. The hit of an anonymous client which
+    got logged in by the request (see member.identity) moves over to its user, so that it has one identity.
+    """
+    action_rate_limits = {}
+    rate_limit_hit = None
+
+    def get_throttles(self):
+        return super().get_throttles() + [ActionRateThrottle()]
+
+    def throttled(self, request, wait):
+        raise Throttled(wait, getattr(self, 'throttle_message', None))
+
+    def settle_rate_limit_hit(self, request, succeeded):
+        if self.rate_limit_hit is None:
+            return
+        limiter, ident, hit_time = self.rate_limit_hit
+        self.rate_limit_hit = None
+        if not succeeded:
+            limiter.release(ActionRateThrottle.get_key(self, ident), hit_time)
+        elif ident.startswith('session:') and request.user.is_authenticated:
+            limiter.record(ActionRateThrottle.get_key(self, 'user:%d' % request.user.pk))
+
+    def handle_exception(self, exc):
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            self.settle_rate_limit_hit(self.request, False)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self.settle_rate_limit_hit(request, response.status_code < 400)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,128 @@
+from collections import namedtuple
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .instrumentation import timed_serialization
+
+ROLES = ('anonymous', 'user', 'moderator', 'admin')
+# Fields whose representation of a database value is the value itself
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.FloatField, serializers.BooleanField,
+                      serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField)
+
+Layout = namedtuple('Layout', 'fields columns pk')
+
+
+def get_role(user):
+    if not user.is_authenticated:
+        return 'anonymous'
+    return user.role or 'user'
+
+
+def role_user(role):
+    """
+    A user standing for the role, for serializers which only look at the role of the request user
+    """
+    if role == 'anonymous':
+        return AnonymousUser()
+    return get_user_model()(role=None if role == 'user' else role)
+
+
+class RowSerializer:
+    """
+    Read-only serializer producing the same representation as a ModelSerializer, but from values() rows instead of
+    model instances. The fields each role gets (the serializers add or drop some depending on the request user) are
+    resolved once per role by instantiating the serializer, after which a row is turned into a dict with a plain loop
+    over precompiled (name, column, conversion) triples.
+
+    Many-to-many fields are filled by `related_loaders`, which map their names to functions returning a dict of
+    primary key -> representation for a list of primary keys, so that a page needs one query per such field.
+    """
+    def __init__(self, serializer_class, related_loaders=None):
+        self.serializer_class = serializer_class
+        self.related_loaders = related_loaders or {}
+        self.layouts = {}
+
+    def get_layout(self, role):
+        layout = self.layouts.get(role)
+        if layout is None:
+            layout = self.layouts[role] = self.compile(role)
+        return layout
+
+    def compile(self, role):
+        request = SimpleNamespace(method='GET', user=role_user(role))
+        serializer = self.serializer_class(context={'request': request})
+        opts = self.serializer_class.Meta.model._meta
+        fields, columns = [], [opts.pk.attname]
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in self.related_loaders:
+                fields.append((name, None, None))
+                continue
+            try:
+                column = opts.get_field(field.source).attname
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured("%s.%s isn't backed by a model field, so it can't be read from rows" % (
+                    self.serializer_class.__name__, name))
+            fields.append((name, column, None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation))
+            if column not in columns:
+                columns.append(column)
+        return Layout(tuple(fields), tuple(columns), opts.pk.attname)
+
+    def values(self, queryset, role):
+        """
+        The queryset as rows of the columns the layout of the role reads, plus the ones it's ordered by, which the
+        paginations read from the rows
+        """
+        opts = queryset.model._meta
+        columns = list(self.get_layout(role).columns)
+        for ordering in queryset.query.order_by or opts.ordering:
+            if not isinstance(ordering, str):
+                continue
+            name = ordering.lstrip('-+')
+            if name == 'pk':
+                name = opts.pk.attname
+            elif name not in queryset.query.annotations:
+                name = opts.get_field(name).attname
+            if name not in columns:
+                columns.append(name)
+        return queryset.prefetch_related(None).values(*columns)
+
+    def to_representation(self, rows, role):
+        fields, _, pk = self.get_layout(role)
+        # Fetched before the timing, which counts the queries as SQL time
+        rows = list(rows)
+        related = {name: loader([row[pk] for row in rows]) for name, loader in self.related_loaders.items()}
+        with timed_serialization():
+            results = []
+            for row in rows:
+                item = {}
+                for name, column, convert in fields:
+                    if column is None:
+                        item[name] = related[name].get(row[pk], [])
+                    else:
+                        value = row[column]
+                        item[name] = value if convert is None or value is None else convert(value)
+                results.append(item)
+        return results
+
+
+class RowListMixin:
+    """
+    Serves the list action of a view from values() rows with `row_serializer`, skipping model instances and the
+    serializer class
+    """
+    row_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        role = get_role(request.user)
+        rows = self.row_serializer.values(self.filter_queryset(self.get_queryset()), role)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.row_serializer.to_representation(page, role))
+        return Response(self.row_serializer.to_representation(rows, role))
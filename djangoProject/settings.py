@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'djangoProject.instrumentation.InstrumentationMiddleware',
+    'djangoProject.db_router.replica_routing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,9 +89,109 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the in-memory default, whose table locks fail concurrent writers at once instead of
+        # letting them wait, which tests of concurrent requests need
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# Aliases of read replicas of the default (primary) database, to which the reads of safe-method requests go, see
+# djangoProject.db_router.ReplicaRouter
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['djangoProject.db_router.ReplicaRouter']
+# Seconds for which a client which wrote keeps reading from the primary, longer than the replication lag
+READ_YOUR_WRITES_WINDOW = 10
+
+# A second SQLite file standing in for a replica locally, which the simulate_replication command keeps up to date
+if os.environ.get('DJANGO_SQLITE_REPLICA', '0') == '1':
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
     }
+    DATABASE_REPLICAS = ['replica']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # IP address -> member.Session, looked up by ip_session_middleware on every request. Use a shared backend with
+    # several workers, so that the cleanup command's invalidation of deleted sessions reaches all of them
+    'ip_sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ip_sessions',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Active blocks, see member.cache.BlocklistIndex. Point this to a shared backend (Redis, Memcached) when running
+    # several workers, so that they agree on an invalidation within BLOCKLIST_REFRESH_INTERVAL seconds
+    'blocklist': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'blocklist',
+        'TIMEOUT': 300,
+    },
+    # Counters of djangoProject.ratelimit.SlidingWindowLimiter, use a shared backend with several workers
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    # Rendered first pages of the confession feed for anonymous readers, see confession.feed. Use a shared backend with
+    # several workers, so that an invalidation reaches all of them
+    'feed': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feed',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Per worker statistics of djangoProject.instrumentation, which the report merges. Has to be shared by the workers
+    # and the instrumentation_report command
+    'instrumentation': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.instrumentation',
+    },
 }
 
+BLOCKLIST_REFRESH_INTERVAL = 5
+
+# Number of first pages of each sort order of the feed cached for anonymous readers (0 disables the cache), and for how
+# many seconds at most. Changes to confessions in the cached pages invalidate them sooner.
+FEED_CACHE_PAGES = 3
+FEED_CACHE_TIMEOUT = 60
+
+# The trending sort weighs engagement (reactions, plus comments times the weight) down by a factor of e every
+# TRENDING_DECAY seconds of age, see confession.trending. Run update_trending_scores after changing these.
+TRENDING_DECAY = 12 * 60 * 60
+TRENDING_COMMENT_WEIGHT = 2
+
+# Events waking up long polls (see djangoProject.pubsub). The local broker only reaches the process that published the
+# event, use djangoProject.pubsub.RedisBroker (OPTIONS: url, prefix) when running several workers
+PUBSUB_BROKER = {
+    'BACKEND': 'djangoProject.pubsub.LocalBroker',
+}
+
+# Maximum number of seconds a long poll is held open
+LONG_POLL_TIMEOUT = 25
+
+# Serves the read paths of the confession API with async views (see djangoProject.async_views), which only pays off
+# under ASGI, where djangoProject/asgi.py enables it. Under WSGI every async view would need an event loop of its own.
+ASYNC_READ_VIEWS = os.environ.get('DJANGO_ASYNC_READ_VIEWS', '0') == '1'
+
+# Per route query count and latency statistics, see djangoProject.instrumentation. Costs nothing while disabled
+INSTRUMENTATION_ENABLED = False
+# Seconds between publications of the statistics of a worker
+INSTRUMENTATION_FLUSH_INTERVAL = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -1,8 +1,13 @@
 import json
+from collections import defaultdict
+from operator import attrgetter
+from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
+from .common import set_through_rows
+
 
 class TagList(list):
     def __init__(self, *args, **kwargs):
@@ -28,6 +33,10 @@ class TagList(list):
             return json.dumps(self)
 
 
+def _is_prefetched(manager):
+    return manager.prefetch_cache_name in getattr(manager.instance, '_prefetched_objects_cache', {})
+
+
 @extend_schema_field(serializers.ListField(child=serializers.CharField()))
 class TagListSerializerField(serializers.Field):
     child = serializers.CharField(max_length=100)
@@ -80,20 +89,60 @@ class TagListSerializerField(serializers.Field):
     def to_representation(self, value):
         if not isinstance(value, TagList):
             if not isinstance(value, list):
-                if self.order_by:
+                if self.order_by and not _is_prefetched(value):
                     tags = value.all().order_by(*self.order_by)
                 else:
                     tags = value.all()
+                    if self.order_by:
+                        for field in reversed(self.order_by):
+                            tags = sorted(tags, key=attrgetter(field.lstrip('-')), reverse=field.startswith('-'))
                 value = [tag.name for tag in tags]
             value = TagList(value, pretty_print=self.pretty_print)
 
         return value
 
 
+def tag_name_loader(model, name='tags'):
+    """
+    Related loader of the tag names of instances of the model for RowSerializer, with one query per page
+    """
+    def load(pks):
+        through = model._meta.get_field(name).through
+        names = defaultdict(TagList)
+        for pk, tag_name in through.objects.filter(content_type=ContentType.objects.get_for_model(model), object_id__in=pks)\
+                .values_list('object_id', 'tag__name'):
+            names[pk].append(tag_name)
+        return names
+    return load
+
+
+def resolve_tags(tag_model, names):
+    """
+    Returns the tags of the given names, fetching the existing ones with one query and creating the missing ones with
+    another, rather than a get_or_create() per tag
+    """
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    tags = {tag.name: tag for tag in tag_model.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        # Tags created concurrently are conflicts, which the second fetch picks up
+        tag_model.objects.bulk_create([tag_model(name=name, slug=tag_model().slugify(name)) for name in missing],
+                                      ignore_conflicts=True)
+        tags.update((tag.name, tag) for tag in tag_model.objects.filter(name__in=missing))
+        for name in missing:
+            if name not in tags:
+                # The slug of another name, which the model's save() makes unique
+                tags[name], _ = tag_model.objects.get_or_create(name=name)
+    return [tags[name] for name in names]
+
+
 def _save_tags(tag_object, tags):
     for key in tags.keys():
-        tag_values = tags.get(key)
-        getattr(tag_object, key).set(tag_values)
+        manager = getattr(tag_object, key)
+        tag_model = manager.through.tag_model()
+        set_through_rows(tag_object, manager.through, manager._lookup_kwargs(), 'tag',
+                         {tag.pk for tag in resolve_tags(tag_model, tags.get(key))})
+        getattr(tag_object, '_prefetched_objects_cache', {}).pop(manager.prefetch_cache_name, None)
 
     return tag_object
 
@@ -0,0 +1,25 @@
+from django.core.cache import caches
+
+# The caches the requests fill, which would leak state from one test into the next
+REQUEST_CACHE_ALIASES = ('ip_sessions', 'blocklist', 'ratelimit', 'feed')
+
+
+class ClearCachesMixin:
+    """
+    Clears the request caches before each test
+    """
+    def setUp(self):
+        super().setUp()
+        for alias in REQUEST_CACHE_ALIASES:
+            caches[alias].clear()
+
+
+class QueryPlanMixin:
+    """
+    Assertions on the SQLite query plans of querysets, for the QueryPlanTest of each app
+    """
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            self.assertNotRegex(line, r'(SCAN|SEARCH) \w+$', plan)
+            self.assertNotIn('TEMP B-TREE', line, plan)
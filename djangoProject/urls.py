@@ -16,6 +16,8 @@ Including another URLconf
 from django.urls import include, path
 from drf_spectacular.views import SpectacularSwaggerView, SpectacularAPIView
 
+from djangoProject.instrumentation import InstrumentationView
+
 from member import urls as member_urls
 from confession import urls as confession_urls
 from moderation import urls as moderation_urls
@@ -24,6 +26,7 @@ urlpatterns = [
     path('confession/', include(confession_urls)),
     path('member/', include(member_urls)),
     path('moderation/', include(moderation_urls)),
+    path('instrumentation/', InstrumentationView.as_view(), name='instrumentation'),
     path('schema/base/', SpectacularAPIView.as_view(), name='schema'),
     path('schema/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 ]
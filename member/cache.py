@@ -0,0 +1,123 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Session, Blocklist
+
+
+SESSION_CACHE_ALIAS = 'ip_sessions'
+
+
+def _session_cache():
+    return caches[SESSION_CACHE_ALIAS]
+
+
+def _session_cache_key(ip_address):
+    return 'session:%s' % ip_address
+
+
+def get_session_for_ip(ip_address):
+    """
+    Returns the Session bound to the IP address, hitting the database only on a cache miss. A cached session may have
+    been deleted since (by the cleanup command, whose invalidation only reaches the caches of other workers with a
+    shared backend), which the writes referencing it handle, see djangoProject.common.save_with_current_session().
+    The cache backend is responsible for the TTL and for evicting the least recently used entries.
+    """
+    cache = _session_cache()
+    key = _session_cache_key(ip_address)
+    session = cache.get(key)
+    if session is None:
+        # Read first, as get_or_create() is routed as a write (see djangoProject.db_router) even when the row exists
+        session = Session.objects.filter(ip_address=ip_address).first()
+        if session is None:
+            session, _ = Session.objects.get_or_create(ip_address=ip_address)
+        cache.set(key, session)
+    return session
+
+
+def bind_session_user(session, user):
+    session.user = user
+    if not Session.objects.filter(pk=session.pk).update(user=user):
+        # Deleted while cached, the IP address gets a new session, which the passed one becomes
+        fresh, _ = Session.objects.update_or_create(ip_address=session.ip_address, defaults={'user': user})
+        session.pk, session.created = fresh.pk, fresh.created
+    # Not before the commit, so that a rolled back binding isn't cached
+    transaction.on_commit(lambda: _session_cache().set(_session_cache_key(session.ip_address), session))
+
+
+def invalidate_sessions(*ip_addresses):
+    _session_cache().delete_many([_session_cache_key(ip_address) for ip_address in ip_addresses])
+
+
+BLOCKLIST_CACHE_ALIAS = 'blocklist'
+
+
+class BlocklistIndex:
+    """
+    Active blocks indexed by session and user id. The built index is shared through the cache backend, while every
+    process keeps its own copy for at most `refresh_interval` seconds, which bounds how long processes can disagree
+    after an invalidation.
+    """
+    cache_key = 'blocklist:index'
+
+    def __init__(self, cache_alias=BLOCKLIST_CACHE_ALIAS, refresh_interval=None):
+        self.cache_alias = cache_alias
+        self.refresh_interval = refresh_interval if refresh_interval is not None else \
+            getattr(settings, 'BLOCKLIST_REFRESH_INTERVAL', 5)
+        self._local = None
+        self._local_expires = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def _merge(entries, key, expires):
+        if key is None:
+            return
+        current = entries.get(key, 0)
+        if current is None or expires is None:
+            entries[key] = None
+        else:
+            entries[key] = max(current, expires)
+
+    def build(self):
+        now = timezone.now()
+        sessions, users = {}, {}
+        blocklist = Blocklist.objects.filter(Q(expires=None) | Q(expires__gt=now)).order_by().values_list('session_id', 'user_id', 'expires')
+        for session_id, user_id, expires in blocklist:
+            expires = expires and expires.timestamp()
+            self._merge(sessions, session_id, expires)
+            self._merge(users, user_id, expires)
+        return {'sessions': sessions, 'users': users}
+
+    def get(self):
+        if self._local is None or self._local_expires <= time.monotonic():
+            index = self.cache.get(self.cache_key)
+            if index is None:
+                index = self.build()
+                self.cache.set(self.cache_key, index)
+            self._local = index
+            self._local_expires = time.monotonic() + self.refresh_interval
+        return self._local
+
+    def is_blocked(self, session_id=None, user_id=None):
+        index = self.get()
+        now = time.time()
+        for entries, key in ((index['sessions'], session_id), (index['users'], user_id)):
+            if key in entries:
+                expires = entries[key]
+                if expires is None or expires > now:
+                    return True
+        return False
+
+    def invalidate(self):
+        self.cache.delete(self.cache_key)
+        self._local = None
+
+
+blocklist_index = BlocklistIndex()
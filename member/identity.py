@@ -0,0 +1,19 @@
+from django.contrib.auth import login
+from django.db import transaction
+
+from djangoProject.common import get_current_session
+from .cache import bind_session_user
+from .models import User
+
+
+def provision_anonymous_user(request):
+    """
+    Creates the one user of an anonymous client, binds it to the session of the client's IP address and logs it in,
+    all in one transaction. login() records the last login, so it isn't set on creation.
+    """
+    session = get_current_session(request)
+    with transaction.atomic():
+        user = User.objects.create_with_random_handle()
+        bind_session_user(session, user)
+        login(request, user)
+    return user
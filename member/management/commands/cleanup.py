@@ -1,21 +1,106 @@
-from django.core.management.base import BaseCommand
+import json
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
 from member import models
+from member.cache import invalidate_sessions, blocklist_index
 
 
 class Command(BaseCommand):
     help = "Cleans piled up inactive users, sessions and expired blocks from the database"
+    phases = ('blocklist', 'users', 'sessions')
 
     def add_arguments(self, parser):
         parser.add_argument('--session_minimum_days_old', '-s', type=int, default=30, help="Remove all sessions older than X days.")
         parser.add_argument('--user_minimum_days_inactive', '-u', type=int, default=60, help="Remove all generated users which are inactive more than X days.")
+        parser.add_argument('--batch_size', '-b', type=int, default=500, help="Number of entries deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to wait between batches, letting other writers in.")
+        parser.add_argument('--dry_run', action='store_true', help="Only count the entries which would be removed.")
+        parser.add_argument('--state_file', help="File where the progress is saved, and resumed from if it exists.")
+
+    def get_querysets(self, options):
+        now = timezone.now()
+        return {
+            'blocklist': models.Blocklist.objects.filter(expires__lte=now),
+            'users': models.User.objects.filter(blocklist=None, is_password_custom=False, last_login__lte=now - timezone.timedelta(days=options['user_minimum_days_inactive'])),
+            'sessions': models.Session.objects.filter(blocklist=None, created__lte=now - timezone.timedelta(days=options['session_minimum_days_old'])),
+        }
+
+    def load_state(self, state_file):
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            self.stdout.write("Resuming from %s after #%d" % (state['phase'], state['last_pk']))
+            return state
+        return {'phase': self.phases[0], 'last_pk': 0, 'deleted_count': 0}
+
+    def save_state(self, state_file, state):
+        if state_file:
+            with open(state_file, 'w') as f:
+                json.dump(state, f)
+
+    def interrupt(self, signum, frame):
+        self.stdout.write("Interrupted, stopping after the current batch...")
+        self.interrupted = True
+
+    def delete_batch(self, phase, queryset, pks):
+        queryset = queryset.filter(pk__in=pks)
+        if phase == 'users':
+            ip_addresses = list(models.Session.objects.filter(user__in=queryset).values_list('ip_address', flat=True))
+        elif phase == 'sessions':
+            ip_addresses = list(queryset.values_list('ip_address', flat=True))
+        else:
+            ip_addresses = []
+        with transaction.atomic():
+            deleted_count = queryset.delete()[0]
+        invalidate_sessions(*ip_addresses)
+        if phase == 'blocklist':
+            blocklist_index.invalidate()
+        return deleted_count
 
     def handle(self, *args, **options):
-        self.stdout.write("Cleaning blocklist...")
-        deleted_count = models.Blocklist.objects.filter(expires__lte=timezone.now()).delete()[0]
-        self.stdout.write("Cleaning users...")
-        deleted_count += models.User.objects.filter(blocklist=None, is_password_custom=False, last_login__lte=timezone.now() - timezone.timedelta(days=options['user_minimum_days_inactive'])).delete()[0]
-        self.stdout.write("Cleaning sessions...")
-        deleted_count += models.Session.objects.filter(blocklist=None, created__lte=timezone.now() - timezone.timedelta(days=options['session_minimum_days_old'])).delete()[0]
-        self.stdout.write(self.style.SUCCESS("Cleaned up %d entries from the database" % deleted_count) if deleted_count > 0 else "No entries have been cleaned")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch_size must be at least 1.")
+        querysets = self.get_querysets(options)
+        if options['dry_run']:
+            for phase in self.phases:
+                self.stdout.write("%s: %d entries would be removed" % (phase.capitalize(), querysets[phase].count()))
+            return
 
+        state = self.load_state(options['state_file'])
+        self.interrupted = False
+        previous_handler = signal.signal(signal.SIGINT, self.interrupt)
+        try:
+            for phase in self.phases[self.phases.index(state['phase']):]:
+                self.stdout.write("Cleaning %s..." % phase)
+                started, phase_deleted_count = time.monotonic(), 0
+                while not self.interrupted:
+                    pks = list(querysets[phase].filter(pk__gt=state['last_pk']).order_by('pk')
+                               .values_list('pk', flat=True)[:options['batch_size']])
+                    if not pks:
+                        break
+                    deleted_count = self.delete_batch(phase, querysets[phase], pks)
+                    phase_deleted_count += deleted_count
+                    state.update(phase=phase, last_pk=pks[-1], deleted_count=state['deleted_count'] + deleted_count)
+                    self.save_state(options['state_file'], state)
+                    self.stdout.write("  %d entries removed, %.1f/s" % (phase_deleted_count, phase_deleted_count / (time.monotonic() - started)))
+                    if options['sleep']:
+                        time.sleep(options['sleep'])
+                if self.interrupted:
+                    self.stdout.write(self.style.WARNING("Stopped in %s after #%d, %d entries removed so far" % (phase, state['last_pk'], state['deleted_count'])))
+                    return
+                next_phase = self.phases.index(phase) + 1
+                if next_phase < len(self.phases):
+                    state.update(phase=self.phases[next_phase], last_pk=0)
+                    self.save_state(options['state_file'], state)
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+
+        if options['state_file'] and os.path.exists(options['state_file']):
+            os.remove(options['state_file'])
+        deleted_count = state['deleted_count']
+        self.stdout.write(self.style.SUCCESS("Cleaned up %d entries from the database" % deleted_count) if deleted_count > 0 else "No entries have been cleaned")
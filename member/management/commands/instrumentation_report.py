@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from djangoProject.instrumentation import collector, METRICS
+
+
+class Command(BaseCommand):
+    help = "Dumps the per route query count and latency percentiles recorded by the instrumentation middleware of all workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Output the raw report as JSON.")
+        parser.add_argument('--reset', action='store_true', help="Clear the recorded statistics after dumping them.")
+
+    def handle(self, *args, **options):
+        report = collector.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        elif not report:
+            self.stdout.write("Nothing recorded, is INSTRUMENTATION_ENABLED set?")
+        for route in report if not options['json'] else ():
+            self.stdout.write(self.style.MIGRATE_HEADING('%s (%d requests)' % (route['route'], route['count'])))
+            for metric in METRICS:
+                summary = route[metric]
+                self.stdout.write('  %-17s p50 %9.2f  p95 %9.2f  p99 %9.2f  max %9.2f' % (
+                    metric, summary['p50'], summary['p95'], summary['p99'], summary['max']))
+            if route['duplicate_requests']:
+                self.stdout.write(self.style.WARNING('  %d requests with duplicate queries:' % route['duplicate_requests']))
+                for duplicate in route['duplicate_queries']:
+                    self.stdout.write('    %dx %s' % (duplicate['requests'], duplicate['sql']))
+        if options['reset']:
+            collector.reset()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from djangoProject.db_router import get_replicas, replicate_sqlite
+
+
+class Command(BaseCommand):
+    help = ("Keeps the local SQLite replicas (set DJANGO_SQLITE_REPLICA=1) up to date by copying the primary database "
+            "over them every `lag` seconds, which stands in for the replication and its lag")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', '-l', type=float, default=2, help="Seconds between two copies.")
+        parser.add_argument('--once', action='store_true', help="Copy once and exit.")
+
+    def handle(self, *args, **options):
+        replicas = get_replicas()
+        if not replicas:
+            raise CommandError("There are no replicas, set DJANGO_SQLITE_REPLICA=1.")
+        if any(connections[alias].vendor != 'sqlite' for alias in (DEFAULT_DB_ALIAS, *replicas)):
+            raise CommandError("Only SQLite databases can be copied.")
+        while True:
+            for alias in replicas:
+                replicate_sqlite(DEFAULT_DB_ALIAS, alias)
+            self.stdout.write("Replicated to %s" % ', '.join(replicas))
+            if options['once']:
+                return
+            time.sleep(options['lag'])
@@ -1,15 +1,35 @@
+import asyncio
+
+from django.utils.decorators import sync_and_async_middleware
+
 # from django.contrib.auth import login
-from .models import Session
+from .cache import get_session_for_ip, bind_session_user
+
 
+def attach_ip_session(request):
+    session = get_session_for_ip(request.META['REMOTE_ADDR'])
+    if request.user.is_authenticated and session.user_id != request.user.pk:
+        bind_session_user(session, request.user)
+    # elif request.user.is_anonymous and session.user:
+    #     login(request, session.user)
+    request.ip_session = session
 
+
+@sync_and_async_middleware
 def ip_session_middleware(get_response):
-    def middleware(request):
-        session, _ = Session.objects.get_or_create(ip_address=request.META['REMOTE_ADDR'])
-        if request.user.is_authenticated and session.user != request.user:
-            session.user = request.user
-            session.save()
-        # elif request.user.is_anonymous and session.user:
-        #     login(request, session.user)
-        return get_response(request)
+    """
+    Attaches the Session of the client's IP address to the request, binding it to the logged in user. Under ASGI it's
+    only attached on its first use instead (see get_current_session()), so a client which only reads views that don't
+    use it gets no Session row and no binding there, unlike under WSGI.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        # Under ASGI the chain stays asynchronous, so that async views (e.g. long polls) don't tie up a thread. Attaching
+        # the session may query the database, so it's left to its first use by the view, see get_current_session(),
+        # rather than done in a thread of its own on every request.
+        async def middleware(request):
+            return await get_response(request)
+    else:
+        def middleware(request):
+            attach_ip_session(request)
+            return get_response(request)
     return middleware
-
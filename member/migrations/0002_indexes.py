@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+# Models referencing member.Session
+SESSION_REFERENCES = (
+    ('member', 'Blocklist', 'session'),
+    ('confession', 'Comment', 'sender'),
+    ('confession', 'Reaction', 'sender'),
+    ('moderation', 'Report', 'session'),
+)
+
+
+def merge_duplicate_sessions(apps, schema_editor):
+    Session = apps.get_model('member', 'Session')
+    duplicates = Session.objects.values('ip_address').annotate(count=Count('pk'), kept_pk=Min('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        sessions = Session.objects.filter(ip_address=duplicate['ip_address']).exclude(pk=duplicate['kept_pk'])
+        for app_label, model_name, field in SESSION_REFERENCES:
+            apps.get_model(app_label, model_name).objects.filter(**{field + '__in': sessions})\
+                .update(**{field: duplicate['kept_pk']})
+        sessions.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('member', '0001_initial'),
+        ('confession', '0001_initial'),
+        ('moderation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='session',
+            name='ip_address',
+            field=models.GenericIPAddressField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='blocklist',
+            index=models.Index(fields=['expires'], name='blocklist_expires_idx'),
+        ),
+    ]
@@ -3,7 +3,7 @@ import random
 
 from django.core.validators import MinLengthValidator
 from django.contrib.auth.base_user import AbstractBaseUser
-from django.db import models
+from django.db import models, transaction, IntegrityError
 
 
 def generate_random_password():
@@ -16,6 +16,22 @@ def generate_random_handle():
     return ''.join(random.choices(string.ascii_uppercase, k=8))
 
 
+class UserManager(models.Manager):
+    handle_attempts = 5
+
+    def create_with_random_handle(self, **fields):
+        """
+        Creates a user with a random handle, drawing another one whenever the handle turns out to be taken
+        """
+        for attempt in range(self.handle_attempts):
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(handle=generate_random_handle(), **fields)
+            except IntegrityError:
+                if attempt == self.handle_attempts - 1:
+                    raise
+
+
 class User(AbstractBaseUser):
     password = models.CharField(default=generate_random_password, max_length=128, validators=[MinLengthValidator(8)])
     role = models.CharField(choices=(('admin', "Administrator"), ('moderator', "Moderator")), max_length=9, null=True, blank=True)
@@ -23,12 +39,14 @@ class User(AbstractBaseUser):
     is_password_custom = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = UserManager()
+
     USERNAME_FIELD = 'handle'
     REQUIRED_FIELDS = []
 
 
 class Session(models.Model):
-    ip_address = models.GenericIPAddressField()
+    ip_address = models.GenericIPAddressField(unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
 
@@ -44,6 +62,7 @@ class Blocklist(models.Model):
     class Meta:
         ordering = ('-pk',)
         constraints = (models.UniqueConstraint(fields=('user', 'session', 'expires'), name='blocklist_unique'),)
+        indexes = (models.Index(fields=('expires',), name='blocklist_expires_idx'),)
 
     def __str__(self):
         return 'Blocked %s%s, expires %s' % (self.session, self.user, self.expires)
@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from django.utils import timezone
+
+from djangoProject.instrumentation import TimedSerializerMixin
 from . import models
 from .models import Session
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.User
         exclude = ('is_password_custom',)
@@ -33,7 +35,14 @@ class UserSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class BlocklistSerializer(serializers.ModelSerializer):
+class ExpiresSerializerMixin:
+    def validate_expires(self, value):
+        if value and timezone.now() > value:
+            raise serializers.ValidationError("You can't set a point in the past.")
+        return value
+
+
+class BlocklistSerializer(TimedSerializerMixin, ExpiresSerializerMixin, serializers.ModelSerializer):
     session = serializers.SlugRelatedField(slug_field='ip_address', queryset=Session.objects.all())
 
     class Meta:
@@ -45,8 +54,10 @@ class BlocklistSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You can't block yourself.")
         return value
 
-    def validate_expires(self, value):
-        if value and timezone.now() > value:
-            raise serializers.ValidationError("You can't set a point in the past.")
-        return value
 
+class BulkBlocklistSerializer(ExpiresSerializerMixin, serializers.Serializer):
+    ip_addresses = serializers.ListField(child=serializers.IPAddressField(), min_length=1, max_length=1000)
+    expires = serializers.DateTimeField(required=False, allow_null=True)
+
+    def validate_ip_addresses(self, value):
+        return list(dict.fromkeys(value))
@@ -1,3 +1,210 @@
-from django.test import TestCase
+import json
+import os
+import signal
+import tempfile
+import threading
+from io import StringIO
+from unittest import skipUnless, mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.db import connection
+from django.db.models import Q
+from django.core.management import call_command, CommandError
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from confession.models import Comment, Confession
+from djangoProject.testing import ClearCachesMixin, QueryPlanMixin
+from . import models
+from .cache import get_session_for_ip
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    def test_session_by_ip_address(self):
+        self.assertUsesIndex(models.Session.objects.filter(ip_address='10.0.0.1'))
+
+    def test_active_blocks(self):
+        self.assertUsesIndex(models.Blocklist.objects.filter(Q(expires=None) | Q(expires__gt=timezone.now())).order_by())
+
+    def test_expired_blocks(self):
+        self.assertUsesIndex(models.Blocklist.objects.filter(expires__lte=timezone.now()).order_by())
+
+
+class BulkBlocklistTest(ClearCachesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = models.User.objects.create(role='admin')
+        self.client.force_login(self.admin)
+
+    def test_bulk_create(self):
+        sessions = [models.Session.objects.create(ip_address='10.0.0.%d' % i) for i in range(3)]
+        models.Session.objects.filter(pk=sessions[0].pk).update(user=self.admin)
+        models.Blocklist.objects.create(session=sessions[1])
+        ip_addresses = [session.ip_address for session in sessions] + ['10.0.0.9']
+        response = self.client.post('/member/blocklist/bulk_create/', {'ip_addresses': ip_addresses},
+                                    content_type='application/json')
+        self.assertEqual([(result['ip_address'], result['success']) for result in response.json()['results']],
+                         list(zip(ip_addresses, [False, False, True, False])))
+        self.assertEqual(models.Blocklist.objects.filter(session=sessions[2]).count(), 1)
+
+
+class StaleSessionTest(ClearCachesMixin, TransactionTestCase):
+    """
+    Sessions deleted by the cleanup command of another process stay in the cache of this one
+    """
+    def setUp(self):
+        super().setUp()
+        self.stale = get_session_for_ip('127.0.0.1')
+        models.Session.objects.filter(pk=self.stale.pk).delete()
+
+    def test_write_resolves_the_session_again(self):
+        confession = Confession.objects.create(title='Hello', text='x' * 200, is_approved=True)
+        response = self.client.post('/confession/comment/', {'confession': confession.pk, 'text': 'Hello', 'recaptcha': 'token'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.get().sender, models.Session.objects.get(ip_address='127.0.0.1'))
+
+    def test_cached_session_serves_writes(self):
+        confession = Confession.objects.create(title='Hello', text='x' * 200, is_approved=True)
+        get_session_for_ip('10.0.0.2')
+        with CaptureQueriesContext(connection) as context:
+            response = Client(REMOTE_ADDR='10.0.0.2').post('/confession/comment/', {
+                'confession': confession.pk, 'text': 'Hello', 'recaptcha': 'token'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([query['sql'] for query in context.captured_queries if 'FROM "member_session"' in query['sql']], [])
+
+    def test_binding_recreates_the_session(self):
+        user = models.User.objects.create()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/member/user/me').status_code, 200)
+        self.assertEqual(models.Session.objects.get(ip_address='127.0.0.1').user, user)
+        self.assertNotEqual(get_session_for_ip('127.0.0.1').pk, self.stale.pk)
+
+
+class SessionAttachmentTest(ClearCachesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.confession = Confession.objects.create(title='Hello', text='x' * 200, is_approved=True)
+
+    def test_reads_attach_the_session_under_wsgi(self):
+        self.assertEqual(self.client.get('/confession/comment/', {'confession': self.confession.pk}).status_code, 200)
+        self.assertTrue(models.Session.objects.filter(ip_address='127.0.0.1').exists())
+
+    async def test_first_use_attaches_the_session_under_asgi(self):
+        response = await self.async_client.get('/confession/comment/', {'confession': self.confession.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await sync_to_async(models.Session.objects.exists)())
+        response = await self.async_client.post('/confession/comment/', {
+            'confession': self.confession.pk, 'text': 'Hello', 'recaptcha': 'token'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await sync_to_async(models.Session.objects.filter(ip_address='127.0.0.1').exists)())
+
+
+class AnonymousProvisioningTest(ClearCachesMixin, TransactionTestCase):
+    @staticmethod
+    def post_confession(client):
+        return client.post('/confession/entry/', {'title': 'Hello', 'text': 'x' * 200, 'tags': [], 'recaptcha': 'token'},
+                           content_type='application/json')
+
+    def test_one_user_per_confession(self):
+        client = Client(REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.post_confession(client).status_code, 201)
+        user = models.User.objects.get()
+        self.assertEqual(models.Session.objects.get(ip_address='10.0.0.1').user, user)
+        self.assertEqual(client.get('/member/user/me').json()['handle'], user.handle)
+        self.assertEqual(user.confession_set.count(), 1)
+
+    def test_one_confession_per_day_and_poster(self):
+        client = Client(REMOTE_ADDR='10.0.0.1')
+        response = client.post('/confession/entry/', {'title': 'Hello', 'text': 'Too short', 'tags': [], 'recaptcha': 'token'},
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_confession(client).status_code, 201)
+        # Logged in as the provisioned user now, and after logging out again
+        self.assertEqual(self.post_confession(client).status_code, 429)
+        client.logout()
+        self.assertEqual(self.post_confession(client).status_code, 429)
+        self.assertEqual(models.User.objects.count(), 1)
+
+    def test_taken_handle_is_drawn_again(self):
+        taken = models.User.objects.create()
+        with mock.patch('member.models.generate_random_handle', side_effect=[taken.handle, 'UNTAKEN']):
+            self.assertEqual(self.post_confession(Client(REMOTE_ADDR='10.0.0.1')).status_code, 201)
+        self.assertEqual(sorted(models.User.objects.values_list('handle', flat=True)), sorted([taken.handle, 'UNTAKEN']))
+
+    def test_parallel_posts(self):
+        clients = [Client(REMOTE_ADDR='10.0.1.%d' % i) for i in range(10)]
+        statuses = []
+        threads = [threading.Thread(target=lambda client=client: statuses.append(self.post_confession(client).status_code))
+                   for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [201] * len(clients))
+        self.assertEqual(models.User.objects.count(), len(clients))
+        self.assertEqual(models.Session.objects.filter(user__isnull=False).values('user').distinct().count(), len(clients))
+
+
+class CleanupCommandTest(TestCase):
+    def setUp(self):
+        self.sessions = [models.Session.objects.create(ip_address='10.0.0.%d' % i) for i in range(5)]
+        models.Session.objects.update(created=timezone.now() - timezone.timedelta(days=40))
+        self.recent = models.Session.objects.create(ip_address='10.0.1.1')
+        models.Blocklist.objects.create(expires=timezone.now() - timezone.timedelta(days=1))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, 'cleanup.json')
+
+    def cleanup(self, **options):
+        output = StringIO()
+        call_command('cleanup', stdout=output, **{'batch_size': 2, 'sleep': 0, **options})
+        return output.getvalue()
+
+    def test_deletes_in_batches(self):
+        output = self.cleanup()
+        self.assertEqual(list(models.Session.objects.all()), [self.recent])
+        self.assertFalse(models.Blocklist.objects.exists())
+        # One batch of blocks and three of sessions
+        self.assertEqual(output.count('entries removed,'), 4)
+        self.assertIn("Cleaned up 6 entries", output)
+
+    def test_dry_run_only_counts(self):
+        output = self.cleanup(dry_run=True)
+        self.assertIn("Blocklist: 1 entries would be removed", output)
+        self.assertIn("Users: 0 entries would be removed", output)
+        self.assertIn("Sessions: 5 entries would be removed", output)
+        self.assertEqual(models.Session.objects.count(), 6)
+        self.assertEqual(models.Blocklist.objects.count(), 1)
+
+    def test_rejects_empty_batches(self):
+        for batch_size in (0, -1):
+            with self.assertRaisesMessage(CommandError, "--batch_size must be at least 1."):
+                self.cleanup(batch_size=batch_size)
+        self.assertEqual(models.Session.objects.count(), 6)
+
+    def test_resumes_from_state_file_after_interruption(self):
+        interruptions = iter([False, True])
+
+        def sleep(seconds):
+            if next(interruptions, False):
+                os.kill(os.getpid(), signal.SIGINT)
+
+        # Interrupted after the first batch of sessions
+        with mock.patch('member.management.commands.cleanup.time.sleep', side_effect=sleep):
+            output = self.cleanup(sleep=1, state_file=self.state_file)
+        self.assertIn("Stopped in sessions after #%d, 3 entries removed so far" % self.sessions[1].pk, output)
+        self.assertEqual(models.Session.objects.count(), 4)
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {'phase': 'sessions', 'last_pk': self.sessions[1].pk, 'deleted_count': 3})
+
+        # The finished blocklist phase isn't run again
+        models.Blocklist.objects.create(expires=timezone.now() - timezone.timedelta(days=1))
+        output = self.cleanup(state_file=self.state_file)
+        self.assertIn("Resuming from sessions after #%d" % self.sessions[1].pk, output)
+        self.assertEqual(list(models.Session.objects.all()), [self.recent])
+        self.assertEqual(models.Blocklist.objects.count(), 1)
+        self.assertIn("Cleaned up 6 entries", output)
+        self.assertFalse(os.path.exists(self.state_file))
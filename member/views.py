@@ -1,4 +1,7 @@
 from django.contrib.auth import login, logout
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from drf_spectacular.types import OpenApiTypes
 from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
@@ -7,9 +10,10 @@ from rest_framework import generics, viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, permission_classes as permission_classes_decorator
 
-from djangoProject.common import PermissionsPerMethodMixin, IsAdmin
+from djangoProject.common import PermissionsPerMethodMixin, IsAdmin, bulk_response
 from member import models
 from . import serializers
+from .cache import blocklist_index
 
 
 @extend_schema_view(
@@ -76,3 +80,44 @@ class BlocklistViewSet(viewsets.ModelViewSet):
     filterset_fields = ('session__ip_address',)
     ordering_fields = ('pk', 'expires')
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        transaction.on_commit(blocklist_index.invalidate)
+
+    @extend_schema(request=serializers.BulkBlocklistSerializer, responses=OpenApiTypes.OBJECT)
+    @action(methods=['POST'], detail=False, filter_backends=())
+    def bulk_create(self, request):
+        """
+        Blocks the sessions of the given IP addresses
+        """
+        serializer = serializers.BulkBlocklistSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ip_addresses = serializer.validated_data['ip_addresses']
+        with transaction.atomic():
+            sessions = {ip_address: (pk, user_id) for pk, ip_address, user_id
+                        in models.Session.objects.filter(ip_address__in=ip_addresses).values_list('pk', 'ip_address', 'user_id')}
+            blocked = set(models.Blocklist.objects.filter(Q(expires=None) | Q(expires__gt=timezone.now()),
+                                                          session__ip_address__in=ip_addresses)
+                          .order_by().values_list('session__ip_address', flat=True))
+            errors = {}
+            for ip_address in ip_addresses:
+                if ip_address not in sessions:
+                    errors[ip_address] = "Not found."
+                elif sessions[ip_address][1] == request.user.pk:
+                    errors[ip_address] = "You can't block yourself."
+                elif ip_address in blocked:
+                    errors[ip_address] = "Already blocked."
+            models.Blocklist.objects.bulk_create([
+                models.Blocklist(session_id=sessions[ip_address][0], expires=serializer.validated_data.get('expires'))
+                for ip_address in ip_addresses if ip_address not in errors
+            ])
+            transaction.on_commit(blocklist_index.invalidate)
+        return bulk_response(ip_addresses, errors, key='ip_address')
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        transaction.on_commit(blocklist_index.invalidate)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        transaction.on_commit(blocklist_index.invalidate)
@@ -0,0 +1,40 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import models
+
+
+PREVIEW_LENGTH = models.Conversation._meta.get_field('last_message_preview').max_length
+
+
+def record_message(message):
+    """
+    Counts the message in the conversations of both of its sides
+    """
+    last_message = {'last_message_sent': message.sent, 'last_message_preview': message.text[:PREVIEW_LENGTH]}
+    for user_id, other_id in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+        conversations = models.Conversation.objects.filter(user_id=user_id, other_id=other_id)
+        if conversations.update(message_count=F('message_count') + 1, **last_message):
+            continue
+        try:
+            with transaction.atomic():
+                models.Conversation.objects.create(user_id=user_id, other_id=other_id, message_count=1, **last_message)
+        except IntegrityError:
+            # Created concurrently
+            conversations.update(message_count=F('message_count') + 1, **last_message)
+
+
+def build_conversations(messages):
+    """
+    Returns unsaved conversations summarizing the messages
+    """
+    conversations = {}
+    for sender_id, receiver_id, text, sent in messages.order_by('pk').values_list('sender_id', 'receiver_id', 'text', 'sent').iterator():
+        for user_id, other_id in ((sender_id, receiver_id), (receiver_id, sender_id)):
+            conversation = conversations.get((user_id, other_id))
+            if conversation is None:
+                conversation = conversations[user_id, other_id] = models.Conversation(user_id=user_id, other_id=other_id)
+            conversation.message_count += 1
+            conversation.last_message_sent = sent
+            conversation.last_message_preview = text[:PREVIEW_LENGTH]
+    return list(conversations.values())
@@ -1,5 +1,4 @@
-from django_filters import OrderingFilter, FilterSet
-from django.db.models import Count
+from django_filters import OrderingFilter, FilterSet, IsoDateTimeFilter
 
 
 class ReportOrderingFilter(OrderingFilter):
@@ -14,7 +13,7 @@ class ReportOrderingFilter(OrderingFilter):
         if value:
             for v in value:
                 if v == 'vote_count':
-                    return qs.annotate(vote_count=Count('voters')).order_by('-vote_count')
+                    return qs.order_by('-vote_count', '-pk')
                 if v == 'newest':
                     return qs.order_by('-pk')
         return super().filter(qs, value)
@@ -23,3 +22,10 @@ class ReportOrderingFilter(OrderingFilter):
 class ReportFilter(FilterSet):
     sort_by = ReportOrderingFilter()
 
+
+class MessageFilter(FilterSet):
+    since = IsoDateTimeFilter(field_name='sent', lookup_expr='gt', help_text="Only messages sent after this time.")
+
+
+class MessagePollFilter(MessageFilter):
+    since = IsoDateTimeFilter(field_name='sent', lookup_expr='gt', required=True)
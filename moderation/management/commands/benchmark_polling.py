@@ -0,0 +1,95 @@
+import asyncio
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, override_settings
+from django.utils import timezone
+
+from djangoProject.benchmark import summarize, format_summary
+from member.models import User
+from moderation import models
+
+
+class QueryCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = ("Compares repeatedly polling the message thread endpoint with long-polling for new messages, by delivery "
+            "latency and the number of requests and queries per delivered message. Creates and afterwards removes its "
+            "own users.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', '-c', type=int, default=200, help="Number of concurrently waiting receivers.")
+        parser.add_argument('--duration', '-d', type=float, default=10, help="Seconds each mode runs for.")
+        parser.add_argument('--rate', '-r', type=float, default=20, help="Messages sent per second.")
+        parser.add_argument('--interval', '-i', type=float, default=2, help="Seconds between the requests of a polling client.")
+
+    def handle(self, *args, **options):
+        sender = User.objects.create()
+        receivers = [User.objects.create() for _ in range(options['clients'])]
+        counter = QueryCounter()
+        for connection in connections.all():
+            counter.install(connection)
+        connection_created.connect(counter.install)
+        try:
+            for mode in ('polling', 'long-polling'):
+                with override_settings(ALLOWED_HOSTS=['testserver']):
+                    latencies, request_count = asyncio.run(self.run(mode, sender, receivers, counter, options))
+                self.stdout.write(format_summary('%s, delivery latency' % mode, summarize(latencies, options['duration'])))
+                self.stdout.write('%s: %d requests, %d queries, %.1f requests and %.1f queries per delivered message' % (
+                    mode, request_count, counter.count, request_count / max(len(latencies), 1), counter.count / max(len(latencies), 1)))
+        finally:
+            connection_created.disconnect(counter.install)
+            User.objects.filter(pk__in=[user.pk for user in [sender] + receivers]).delete()
+
+    async def run(self, mode, sender, receivers, counter, options):
+        clients = []
+        for receiver in receivers:
+            client = AsyncClient()
+            await sync_to_async(client.force_login)(receiver)
+            clients.append(client)
+        latencies, request_count = [], 0
+        counter.count = 0
+        deadline = time.monotonic() + options['duration']
+
+        async def receive(client):
+            nonlocal request_count
+            since = timezone.now().isoformat()
+            while time.monotonic() < deadline:
+                if mode == 'polling':
+                    response = await client.get('/moderation/message/%s/' % sender.handle, {'since': since})
+                else:
+                    response = await client.get('/moderation/message/poll/', {'since': since, 'timeout': max(deadline - time.monotonic(), 0)})
+                request_count += 1
+                results = sorted(response.json()['results'], key=lambda message: message['sent'])
+                for message in results:
+                    latencies.append(time.time() - float(message['text']))
+                if results:
+                    since = results[-1]['sent']
+                if mode == 'polling':
+                    await asyncio.sleep(options['interval'])
+
+        async def send():
+            while time.monotonic() < deadline:
+                await sync_to_async(models.Message.objects.create)(sender=sender, receiver=random.choice(receivers), text=repr(time.time()))
+                await asyncio.sleep(1 / options['rate'])
+
+        await asyncio.gather(send(), *[receive(client) for client in clients])
+        return latencies, request_count
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from moderation import models, conversations
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the conversation summaries of the message inbox from all messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', '-b', type=int, default=1000, help="Number of conversations inserted per query.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Summarizing messages...")
+        summaries = conversations.build_conversations(models.Message.objects.all())
+        with transaction.atomic():
+            models.Conversation.objects.all().delete()
+            models.Conversation.objects.bulk_create(summaries, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Rebuilt %d conversations" % len(summaries)))
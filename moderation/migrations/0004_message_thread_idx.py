@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0003_conversation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'receiver', '-sent', '-id'], name='message_thread_idx'),
+        ),
+    ]
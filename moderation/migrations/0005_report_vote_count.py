@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:50
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+
+
+def populate_vote_counts(apps, schema_editor):
+    Report = apps.get_model('moderation', 'Report')
+    Report.objects.update(vote_count=Coalesce(Subquery(
+        Report.voters.through.objects.filter(report=OuterRef('pk')).order_by()
+        .values('report').annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0004_message_thread_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_vote_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['-vote_count', '-id'], name='report_vote_count_idx'),
+        ),
+    ]
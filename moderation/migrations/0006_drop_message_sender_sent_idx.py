@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0005_report_vote_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_sender_sent_idx',
+        ),
+    ]
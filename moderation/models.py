@@ -1,6 +1,8 @@
 from django.core.validators import MinLengthValidator
 from django.db import models
 
+from djangoProject.common import AtomicSaveModel
+
 
 class Report(models.Model):
     session = models.ForeignKey('member.Session', on_delete=models.SET_NULL, null=True, blank=True)
@@ -8,16 +10,18 @@ class Report(models.Model):
     comment = models.ForeignKey('confession.Comment', on_delete=models.CASCADE, null=True, blank=True)
     reason = models.CharField(max_length=1000, validators=[MinLengthValidator(15)])
     voters = models.ManyToManyField('member.User')
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ('pk',)
+        indexes = (models.Index(fields=('-vote_count', '-id'), name='report_vote_count_idx'),)
 
     def __str__(self):
         return 'Report #%d: %s%s (%s)' % (self.pk, self.confession, self.comment, self.session)
 
 
-class Message(models.Model):
+class Message(AtomicSaveModel):
     sender = models.ForeignKey('member.User', on_delete=models.CASCADE, related_name='sender')
     text = models.CharField(max_length=1000, validators=[MinLengthValidator(3)])
     receiver = models.ForeignKey('member.User', on_delete=models.CASCADE, related_name='receiver')
@@ -25,7 +29,29 @@ class Message(models.Model):
 
     class Meta:
         ordering = ('-pk',)
+        indexes = (
+            models.Index(fields=('receiver', '-sent'), name='message_receiver_sent_idx'),
+            models.Index(fields=('sender', 'receiver', '-sent', '-id'), name='message_thread_idx'),
+        )
 
     def __str__(self):
         return 'Message #%d, from %s to %s' % (self.pk, self.sender, self.receiver)
 
+
+class Conversation(models.Model):
+    """
+    Summary of the messages exchanged between `user` and `other`, one per side, maintained by moderation.signals
+    """
+    user = models.ForeignKey('member.User', on_delete=models.CASCADE, related_name='conversations')
+    other = models.ForeignKey('member.User', on_delete=models.CASCADE, related_name='+')
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_sent = models.DateTimeField()
+    last_message_preview = models.CharField(max_length=100)
+
+    class Meta:
+        ordering = ('-last_message_sent', '-pk')
+        constraints = (models.UniqueConstraint(fields=('user', 'other'), name='conversation_unique'),)
+        indexes = (models.Index(fields=('user', '-last_message_sent', '-id'), name='conversation_user_recent_idx'),)
+
+    def __str__(self):
+        return 'Conversation of %s with %s' % (self.user, self.other)
@@ -1,11 +1,12 @@
 from rest_framework import serializers
 
-from djangoProject.common import ConfessionOrCommentInSerializerUnique, get_current_session
+from djangoProject.common import ConfessionOrCommentInSerializerUnique
+from djangoProject.instrumentation import TimedSerializerMixin
 from member.models import User
 from . import models
 
 
-class ReportSerializer(ConfessionOrCommentInSerializerUnique):
+class ReportSerializer(TimedSerializerMixin, ConfessionOrCommentInSerializerUnique):
     voters = serializers.SlugRelatedField(slug_field='handle', many=True, read_only=True)
     _duplicate_error = "You already reported the targeted confession/comment."
 
@@ -20,12 +21,8 @@ class ReportSerializer(ConfessionOrCommentInSerializerUnique):
         if 'request' in self.context and self.context['request'].user.role != 'admin':
             self.fields.pop('session')
 
-    def create(self, validated_data):
-        validated_data['session'] = get_current_session(self.context['request'])
-        return super().create(validated_data)
 
-
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender = serializers.SlugRelatedField(queryset=User.objects.all(), slug_field='handle')
     receiver = serializers.SlugRelatedField(queryset=User.objects.all(), slug_field='handle', required=True)
 
@@ -46,8 +43,11 @@ class MessageSerializer(serializers.ModelSerializer):
         return value
 
 
-class MessageListSerializer(serializers.Serializer):
-    # id = serializers.IntegerField(source='target_id')
-    handle = serializers.CharField(source='target_handle')
-    count = serializers.IntegerField()
+class MessageListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    handle = serializers.CharField(source='other.handle')
+    count = serializers.IntegerField(source='message_count')
+
+    class Meta:
+        model = models.Conversation
+        fields = ('handle', 'count', 'last_message_sent', 'last_message_preview')
 
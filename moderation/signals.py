@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from djangoProject import pubsub
+from . import models, conversations
+
+
+@receiver(post_save, sender=models.Message)
+def message_created(sender, instance, created, **kwargs):
+    if created:
+        conversations.record_message(instance)
+        pubsub.publish_on_commit('message:%d' % instance.receiver_id)
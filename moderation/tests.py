@@ -1,3 +1,133 @@
+import asyncio
+import os
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+
+from confession.models import Confession
+from djangoProject.testing import ClearCachesMixin, QueryPlanMixin
+from member.models import User
+from . import models
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    def test_received_messages(self):
+        self.assertUsesIndex(models.Message.objects.filter(receiver=1).order_by('-sent'))
+
+    def test_sent_messages(self):
+        # The lookups of the sender's foreign key, e.g. on cascade, go through the thread index
+        self.assertUsesIndex(models.Message.objects.filter(sender=1))
+
+    def test_reports_by_votes(self):
+        self.assertUsesIndex(models.Report.objects.order_by('-vote_count', '-pk'))
+
+    def test_thread(self):
+        self.assertUsesIndex(models.Message.objects.filter(sender=1, receiver=2, sent__lt=timezone.now()).order_by('-sent', '-pk'))
+
+
+class MessageTestCase(ClearCachesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, self.first, self.second = User.objects.create(), User.objects.create(), User.objects.create()
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def send(self, sender, receiver, text='Hello'):
+        return models.Message.objects.create(sender=sender, receiver=receiver, text=text)
+
+
+class InboxTest(MessageTestCase):
+    def inbox(self):
+        return [(result['handle'], result['count'], result['last_message_preview'])
+                for result in self.client.get('/moderation/message/').json()['results']]
+
+    def test_conversations_follow_messages(self):
+        self.send(self.user, self.first)
+        self.send(self.second, self.user, 'Hi there')
+        self.send(self.first, self.user, 'Bye')
+        self.send(self.first, self.second)
+        expected = [(self.first.handle, 2, 'Bye'), (self.second.handle, 1, 'Hi there')]
+        self.assertEqual(self.inbox(), expected)
+        call_command('rebuild_conversations', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.inbox(), expected)
+
+
+class ThreadTest(MessageTestCase):
+    def thread(self, handle, **params):
+        response = self.client.get('/moderation/message/%s/' % handle, params)
+        return response.json()
+
+    def test_only_messages_between_both_parties(self):
+        messages = [self.send(self.user, self.first, 'Message %d' % i) if i % 2 else self.send(self.first, self.user, 'Message %d' % i)
+                    for i in range(15)]
+        self.send(self.first, self.second)
+        self.send(self.second, self.user)
+
+        page = self.thread(self.first.handle)
+        texts = [message['text'] for message in page['results']]
+        self.assertIsNotNone(page['next'])
+        texts += [message['text'] for message in self.client.get(page['next']).json()['results']]
+        self.assertEqual(texts, [message.text for message in reversed(messages)])
+
+    def test_since(self):
+        old = self.send(self.first, self.user, 'Old message')
+        new = self.send(self.user, self.first, 'New message')
+        models.Message.objects.filter(pk=old.pk).update(sent=new.sent - timezone.timedelta(minutes=1))
+        results = self.thread(self.first.handle, since=(new.sent - timezone.timedelta(seconds=1)).isoformat())['results']
+        self.assertEqual([message['text'] for message in results], ['New message'])
+
+    def test_unknown_handle(self):
+        self.assertEqual(self.client.get('/moderation/message/unknown/').status_code, 404)
+
+
+class MessagePollTest(MessageTestCase):
+    def send_and_commit(self, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.send(*args)
+
+    async def test_wakes_up_on_new_message(self):
+        since = timezone.now().isoformat()
+        poll = asyncio.ensure_future(self.async_client.get('/moderation/message/poll/', {'since': since, 'timeout': 5}))
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+        await sync_to_async(self.send_and_commit)(self.first, self.second, 'Not for me')
+        await sync_to_async(self.send_and_commit)(self.first, self.user, 'Hello there')
+        response = await asyncio.wait_for(poll, 1)
+        self.assertEqual([message['text'] for message in response.json()['results']], ['Hello there'])
+
+    async def test_returns_pending_messages_and_times_out(self):
+        message = await sync_to_async(self.send)(self.first, self.user, 'Already sent')
+        since = (message.sent - timezone.timedelta(seconds=1)).isoformat()
+        response = await self.async_client.get('/moderation/message/poll/', {'since': since})
+        self.assertEqual([message['text'] for message in response.json()['results']], ['Already sent'])
+        response = await self.async_client.get('/moderation/message/poll/', {'since': message.sent.isoformat(), 'timeout': 0.1})
+        self.assertEqual(response.json()['results'], [])
+
+    async def test_requires_since(self):
+        response = await self.async_client.get('/moderation/message/poll/')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportVoteTest(ClearCachesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.confession = Confession.objects.create(title='Confession', text='x' * 200, is_approved=True)
+        self.report = models.Report.objects.create(confession=self.confession, reason='Offensive confession')
+
+    def vote(self, user):
+        self.client.force_login(user)
+        return self.client.post('/moderation/report/%d/vote/' % self.report.pk)
 
-# Create your tests here.
+    def test_threshold_deletes_reported_confession(self):
+        moderators = [User.objects.create(role='moderator') for _ in range(3)]
+        self.assertEqual(self.vote(moderators[0]).json()['vote_count'], 1)
+        self.assertEqual(self.vote(moderators[0]).status_code, 400)
+        self.assertEqual(self.vote(moderators[1]).json()['vote_count'], 2)
+        self.assertTrue(Confession.objects.filter(pk=self.confession.pk).exists())
+        self.assertEqual(self.vote(moderators[2]).json()['vote_count'], 3)
+        self.assertFalse(Confession.objects.filter(pk=self.confession.pk).exists())
@@ -1,3 +1,4 @@
+from django.urls import path
 from rest_framework import routers
 from . import views
 
@@ -5,4 +6,6 @@ router = routers.DefaultRouter()
 router.register(r'report', views.ReportViewSet, basename='report')
 router.register(r'message', views.MessageViewSet, basename='message')
 
-urlpatterns = router.urls
+urlpatterns = [
+    path('message/poll/', views.message_poll, name='message-poll'),
+] + router.urls
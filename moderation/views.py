@@ -5,8 +5,18 @@ from rest_framework import viewsets, generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
-from django.db.models import Q, Count, Case, When, F
+from rest_framework.exceptions import ValidationError
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404
 
+from djangoProject import pubsub
+from djangoProject.common import KeysetPagination, save_with_current_session
+from confession import counters
+from confession.models import Confession, Comment
+from member.models import User
 from . import models, serializers, permissions, filters
 
 
@@ -19,18 +29,28 @@ class ReportViewSet(generics.ListCreateAPIView, generics.DestroyAPIView, viewset
     filterset_class = filters.ReportFilter
     _vote_limit = 3
 
+    def perform_create(self, serializer):
+        save_with_current_session(self.request, lambda session: serializer.save(session=session))
+
     @extend_schema(request=None)
     @action(methods=["post"], detail=True, url_path="vote", url_name="vote")
     def give_vote(self, request, *args, **kwargs):
         report = self.get_object()
-        if report.voters.filter(pk=request.user.pk).exists():
-            return Response({"error": "You already voted."}, status=status.HTTP_400_BAD_REQUEST)
-        report.voters.add(request.user)
-        if report.voters.count() == self._vote_limit:
-            if report.confession:
-                report.confession.delete()
-            elif report.comment:
-                report.comment.delete()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    models.Report.voters.through.objects.create(report=report, user=request.user)
+            except IntegrityError:
+                return Response({"error": "You already voted."}, status=status.HTTP_400_BAD_REQUEST)
+            # The row stays locked by the increment until commit, so exactly one vote reads the threshold back
+            models.Report.objects.filter(pk=report.pk).update(vote_count=F('vote_count') + 1)
+            report.vote_count = models.Report.objects.filter(pk=report.pk).values_list('vote_count', flat=True).get()
+            if report.vote_count == self._vote_limit:
+                if report.confession_id:
+                    with counters.deferred([report.confession_id]):
+                        Confession.objects.filter(pk=report.confession_id).delete()
+                elif report.comment_id:
+                    Comment.objects.filter(pk=report.comment_id).delete()
         serializer = self.get_serializer(report)
         return Response(serializer.data)
 
@@ -46,51 +66,53 @@ class MessageViewSet(generics.ListCreateAPIView, generics.RetrieveAPIView, views
     serializer_class = serializers.MessageSerializer
     permission_classes = (IsAuthenticated,)
     lookup_field = 'handle'
-    _queryset_fields = ('handle',)  # , id
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._target_queryset_fields = tuple('target_' + field for field in self._queryset_fields)
-        self._receiver_sender_queryset_fields = tuple(('receiver__' + field, 'sender__' + field) for field in self._queryset_fields)
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        queryset = models.Message.objects.filter(Q(sender=self.request.user) | Q(receiver=self.request.user))
+        if getattr(self, 'swagger_fake_view', False):
+            return models.Message.objects.none()
         if self.action == 'list':
-            annotate = {'target_' + self._queryset_fields[i]:
-                        Case(When(Q(sender=self.request.user), then=F(self._receiver_sender_queryset_fields[i][0])),
-                             When(Q(receiver=self.request.user), then=F(self._receiver_sender_queryset_fields[i][1])))
-                        for i in range(len(self._queryset_fields))}
-            queryset = queryset.annotate(**annotate).values(*self._target_queryset_fields)\
-                .annotate(count=Count(self._target_queryset_fields[0])).values(*self._target_queryset_fields + ('count',))
-        return queryset
+            return models.Conversation.objects.filter(user=self.request.user).select_related('other')
+        return models.Message.objects.select_related('sender', 'receiver')
 
     @extend_schema(responses=serializers.MessageListSerializer)
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = serializers.MessageListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = serializers.MessageListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def get_object(self):
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-
-        # if self.action != 'retrieve':
-        #     obj = get_object_or_404(queryset, **{'pk': self.kwargs[lookup_url_kwarg]})
-        #
-        #     # May raise a permission denied
-        #     self.check_object_permissions(self.request, obj)
-        #
-        #     return obj
-
-        filter_args = Q()
-        for f in ('sender', 'receiver'):
-            filter_args |= Q(**{f + '__' + self.lookup_field: self.kwargs[lookup_url_kwarg]})
-        return queryset.filter(filter_args)
+        return get_object_or_404(User.objects.only('pk'), **{self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]})
 
+    @extend_schema(parameters=[OpenApiParameter('since', OpenApiTypes.DATETIME, description="Only messages sent after this time.")])
     def retrieve(self, request, *args, **kwargs):
-        queryset = self.get_object()
+        other = self.get_object()
+        # Each direction of the thread is a range of message_thread_idx, paginated separately and merged
+        querysets = []
+        for sender, receiver in ((request.user, other), (other, request.user)):
+            filterset = filters.MessageFilter(request.query_params, self.get_queryset().filter(sender=sender, receiver=receiver))
+            if not filterset.is_valid():
+                raise ValidationError(filterset.errors)
+            querysets.append(filterset.qs.order_by('-sent', '-pk'))
 
-        page = self.paginate_queryset(queryset)
+        page = self.paginate_queryset(querysets)
         serializer = self.get_serializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
+
+async def message_poll(request):
+    """
+    Long-polls for the messages received after `since`, answering as soon as there are any, or with an empty result
+    after `timeout` seconds
+    """
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_403_FORBIDDEN)
+    filterset = filters.MessagePollFilter(request.GET, models.Message.objects.filter(receiver=request.user))
+    if not filterset.is_valid():
+        return JsonResponse(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+    queryset = filterset.qs.select_related('sender', 'receiver').order_by('sent', 'pk')[:pubsub.POLL_RESULT_LIMIT]
+
+    def fetch():
+        return serializers.MessageSerializer(queryset.all(), many=True, context={'request': request}).data
+    results = await pubsub.long_poll(['message:%d' % request.user.pk], fetch, pubsub.get_timeout(request))
+    return JsonResponse({"results": results})